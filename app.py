@@ -6,9 +6,11 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
 from werkzeug.exceptions import InternalServerError
 from manual_search import MediaDownloader  # 导入 MediaDownloader 类
+from media_parser import normalize_title
 from datetime import timedelta
 from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import json
 import time
 import settings
 import configparser
@@ -223,13 +225,40 @@ def subscriptions():
     miss_tvs = db.execute('SELECT * FROM MISS_TVS').fetchall()
     return render_template('subscriptions.html', miss_movies=miss_movies, miss_tvs=miss_tvs, version=APP_VERSION)
 
+def feed_owner(rss_url):
+    """从豆瓣订阅URL中取出用户ID"""
+    parts = rss_url.rstrip('/').split('/')
+    return parts[parts.index('people') + 1] if 'people' in parts[:-1] else rss_url
+
 @app.route('/douban_subscriptions')
 @login_required
 def douban_subscriptions():
     db = get_db()
     rss_movies = db.execute('SELECT * FROM RSS_MOVIES').fetchall()
     rss_tvs = db.execute('SELECT * FROM RSS_TVS').fetchall()
-    return render_template('douban_subscriptions.html', rss_movies=rss_movies, rss_tvs=rss_tvs, version=APP_VERSION)
+    try:
+        # 豆瓣搜索结果中没有找到的条目，缓存过期前不会重新查询
+        missing_subjects = db.execute('SELECT douban_id, rss_title, fetched_at FROM DOUBAN_SUBJECTS WHERE found = 0 ORDER BY fetched_at DESC').fetchall()
+    except sqlite3.OperationalError:
+        missing_subjects = []
+    # 每个条目来自哪些用户的订阅
+    sources = {}
+    try:
+        for row in db.execute('SELECT douban_id, rss_url FROM RSS_FEED_ITEMS ORDER BY rss_url'):
+            sources.setdefault(row['douban_id'], []).append(feed_owner(row['rss_url']))
+    except sqlite3.OperationalError:
+        pass
+    return render_template('douban_subscriptions.html', rss_movies=rss_movies, rss_tvs=rss_tvs, missing_subjects=missing_subjects,
+                           sources=sources, now=int(time.time()), version=APP_VERSION)
+
+@app.route('/refetch_douban_subject/<douban_id>', methods=['POST'])
+@login_required
+def refetch_douban_subject(douban_id):
+    db = get_db()
+    # 使缓存过期，下次获取豆瓣订阅时重新查询
+    db.execute('UPDATE DOUBAN_SUBJECTS SET fetched_at = 0 WHERE douban_id = ?', (douban_id,))
+    db.commit()
+    return redirect(url_for('douban_subscriptions'))
 
 @app.route('/search', methods=['GET'])
 @login_required
@@ -285,9 +314,9 @@ def edit_subscription(type, id):
         missing_episodes = request.form['missing_episodes'] if type == 'tv' else None
 
         if type == 'movie':
-            db.execute('UPDATE MISS_MOVIES SET title = ?, year = ? WHERE id = ?', (title, year, id))
+            db.execute('UPDATE MISS_MOVIES SET title = ?, title_key = ?, year = ? WHERE id = ?', (title, normalize_title(title), year, id))
         elif type == 'tv':
-            db.execute('UPDATE MISS_TVS SET title = ?, season = ?, missing_episodes = ? WHERE id = ?', (title, season, missing_episodes, id))
+            db.execute('UPDATE MISS_TVS SET title = ?, title_key = ?, season = ?, missing_episodes = ?, search_attempts = 0, next_search = 0 WHERE id = ?', (title, normalize_title(title), season, missing_episodes, id))
         db.commit()
         return redirect(url_for('subscriptions'))
 
@@ -306,6 +335,44 @@ def delete_subscription(type, id):
     db.commit()
     return redirect(url_for('subscriptions'))
 
+@app.route('/retry_queue')
+@login_required
+def retry_queue():
+    db = get_db()
+    try:
+        retries = db.execute('SELECT * FROM RETRY_QUEUE ORDER BY next_attempt ASC').fetchall()
+    except sqlite3.OperationalError:
+        # 目录监控服务尚未创建重试队列
+        retries = []
+    return render_template('retry_queue.html', retries=retries, now=int(time.time()), version=APP_VERSION)
+
+@app.route('/edit_retry/<int:id>', methods=['POST'])
+@login_required
+def edit_retry(id):
+    db = get_db()
+    title = request.form['title'].strip() or None
+    year = request.form['year'].strip() or None
+    # 修改名称和年份后立即重试
+    db.execute('UPDATE RETRY_QUEUE SET override_title = ?, override_year = ?, next_attempt = 0 WHERE id = ?', (title, year, id))
+    db.commit()
+    return redirect(url_for('retry_queue'))
+
+@app.route('/retry_now/<int:id>', methods=['POST'])
+@login_required
+def retry_now(id):
+    db = get_db()
+    db.execute('UPDATE RETRY_QUEUE SET next_attempt = 0 WHERE id = ?', (id,))
+    db.commit()
+    return redirect(url_for('retry_queue'))
+
+@app.route('/delete_retry/<int:id>', methods=['POST'])
+@login_required
+def delete_retry(id):
+    db = get_db()
+    db.execute('DELETE FROM RETRY_QUEUE WHERE id = ?', (id,))
+    db.commit()
+    return redirect(url_for('retry_queue'))
+
 @app.route('/service_control')
 @login_required
 def service_control():
@@ -354,6 +421,26 @@ def realtime_log(service):
     
     return Response(generate(), mimetype='text/event-stream', content_type='text/event-stream; charset=utf-8')
 
+@app.route('/api/transfer_progress')
+@login_required
+def transfer_progress():
+    # 目录监控服务定期将转移进度写入该文件
+    try:
+        with open('/tmp/sync_progress.json', 'r', encoding='utf-8') as f:
+            return jsonify(json.load(f))
+    except (OSError, ValueError):
+        return jsonify({'updated': 0, 'bytes_per_second': 0, 'transfers': []})
+
+@app.route('/api/sync_stats')
+@login_required
+def sync_stats():
+    # 目录监控服务每分钟将内存统计写入该文件
+    try:
+        with open('/tmp/sync_stats.json', 'r', encoding='utf-8') as f:
+            return jsonify(json.load(f))
+    except (OSError, ValueError):
+        return jsonify({'updated': 0, 'rss_bytes': None, 'caches': {}})
+
 # 新增手动搜索和下载接口
 @app.route('/manual_search')
 @login_required
@@ -422,6 +509,7 @@ section_titles = {
     'douban': '豆瓣设置',
     'tmdb': 'TMDB设置',
     'download_mgmt': '下载管理设置',
+    'mediaserver': '媒体服务器设置',
     'resources': '资源站点设置',
     'urls': '站点URL设置',
     'running': '程序运行设置'
@@ -439,21 +527,53 @@ config_descriptions = {
     },
     'downloadtransfer': {
         'directory': '下载监听目录',
-        'action': '动作（复制或移动）',
+        'watch_roots': '多个监听目录名称（逗号分隔，每个名称对应一个 [watch:名称] 配置段）',
+        'action': '动作（copy复制、move移动、hardlink硬链接、reflink克隆、auto自动选择）',
         'excluded_filenames': '排除的文件名',
+        'workers': '转移工作线程数',
+        'device_concurrency': '单个磁盘同时转移的文件数',
+        'stable_seconds': '下载完成判定时间（秒）',
+        'record_retention_days': '处理记录保留天数，超过此天数且源文件已不存在时清理',
+        'bandwidth_limit': '转移限速（MB/s，0为不限速）',
+        'transfer_chunk_mb': '复制分块大小（MB）',
+        'transfer_nice': '转移线程CPU优先级（nice值）',
+        'transfer_io_class': '转移线程IO优先级（idle、best-effort、realtime）',
+        'verify': '复制校验（off不校验、sample抽样回读、full完整回读）',
+        'watch_mode': '监控方式（auto自动、inotify实时事件、poll轮询）',
+        'poll_min_interval': '轮询最短间隔（秒）',
+        'poll_max_interval': '轮询最长间隔（秒）',
+        'trigger': '下载完成判断方式（watch监控目录、transmission查询Transmission）',
+        'transmission_poll_interval': 'Transmission查询间隔（秒）',
+        'transmission_callback_port': 'Transmission下载完成回调端口（0为不启用）',
     },
     'douban': {
         'api_key': '豆瓣API密钥',
         'cookie': '豆瓣Cookie',
-        'rss_url': '豆瓣订阅URL',
+        'rss_url': '豆瓣订阅URL（多个用户的订阅用逗号分隔）',
+        'rate_limits': '豆瓣请求限速（主机:请求数/秒数，多个用逗号分隔）',
+        'max_block_wait': '豆瓣限制访问时最长等待时间（秒），超过后剩余项目下次处理',
+        'subject_cache_days': '豆瓣条目详情缓存天数',
+        'miss_cache_days': '豆瓣未找到的条目重新查询间隔（天）',
     },
     'tmdb': {
         'base_url': 'TMDB API接口',
         'api_key': 'TMDB API密钥',
+        'schedule_refresh_hours': '未播完剧集的播出日期更新间隔（小时）',
     },
     'download_mgmt': {
         'download_mgmt': '是否启用下载管理',
         'download_mgmt_url': '下载器URL',
+        'rpc_username': 'Transmission RPC 用户名',
+        'rpc_password': 'Transmission RPC 密码',
+        'path_map': '下载路径映射（Transmission路径:本地路径，多个用逗号分隔）',
+    },
+    'mediaserver': {
+        'server_type': '媒体服务器类型（none不通知、jellyfin、emby、plex、webhook）',
+        'server_url': '媒体服务器URL（webhook类型填写完整的回调地址）',
+        'api_key': '媒体服务器API密钥（Plex填写X-Plex-Token）',
+        'path_map': '媒体库路径映射（本地路径:媒体服务器路径，多个用逗号分隔）',
+        'debounce_seconds': '合并通知等待时间（秒）',
+        'max_delay_seconds': '通知最长延迟（秒）',
     },
     'resources': {
         'login_username': '登录用户名',
@@ -468,15 +588,33 @@ config_descriptions = {
     },
     'running': {
         'run_interval_hours': '运行间隔（小时）',
+        'full_check_hours': '完整核对订阅间隔（小时），其余时间只核对有变化的标题',
     }
 }
 
+# [watch:名称] 配置段的选项描述，未设置的选项沿用下载转移设置和媒体目录设置
+watch_root_descriptions = {
+    'directory': '下载监听目录',
+    'action': '动作（copy复制、move移动、hardlink硬链接、reflink克隆、auto自动选择）',
+    'excluded_filenames': '排除的文件名',
+    'movies_path': '电影库目录',
+    'episodes_path': '剧集库目录',
+    'lane': '转移通道名称（同名通道共享并发限制，留空按磁盘划分）',
+}
+
 @app.route('/settings')
 @login_required
 def settings_page():
     # 从配置文件读取数据并传递给模板
     config_data = settings.read_config()
-    return render_template('settings.html', config=config_data, descriptions=config_descriptions, section_titles=section_titles, version=APP_VERSION)
+    titles = dict(section_titles)
+    descriptions = dict(config_descriptions)
+    # 监听目录配置段的名称由用户定义
+    for section in config_data:
+        if section.startswith('watch:'):
+            titles[section] = f"监听目录设置（{section[len('watch:'):]}）"
+            descriptions[section] = watch_root_descriptions
+    return render_template('settings.html', config=config_data, descriptions=descriptions, section_titles=titles, version=APP_VERSION)
 
 @app.route('/save_set', methods=['POST'])
 @login_required
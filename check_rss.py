@@ -1,6 +1,9 @@
+import time
 import sqlite3
 import logging
 import configparser
+from media_parser import add_title_key
+from tmdb_id import create_tmdb_tables
 
 # 设置日志配置
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s', encoding='utf-8')
@@ -12,14 +15,26 @@ def read_config(config_path):
     config.read(config_path, encoding='utf-8')
     return config
 
+def add_douban_id_column(cursor, table, match):
+    """为订阅表添加 douban_id 字段，并按标题从豆瓣订阅中补全已有订阅的豆瓣ID"""
+    columns = [column[1] for column in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+    if 'douban_id' in columns:
+        return
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN douban_id TEXT")
+    rss_table = table.replace('MISS_', 'RSS_')
+    cursor.execute(f"UPDATE {table} SET douban_id = (SELECT r.douban_id FROM {rss_table} AS r WHERE {match} LIMIT 1)")
+    logger.info(f"在表 {table} 中添加了 douban_id 字段")
+
 def create_miss_movies_table(cursor):
     """创建MISS_MOVIES表（如果不存在）"""
     cursor.execute('''CREATE TABLE IF NOT EXISTS MISS_MOVIES (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         title TEXT,
         year INTEGER,
+        douban_id TEXT,
         UNIQUE(title, year)
     )''')
+    add_douban_id_column(cursor, 'MISS_MOVIES', 'r.title = MISS_MOVIES.title AND r.year = MISS_MOVIES.year')
 
 def create_miss_tvs_table(cursor):
     """创建MISS_TVS表（如果不存在）"""
@@ -28,101 +43,335 @@ def create_miss_tvs_table(cursor):
         title TEXT,
         season INTEGER,
         missing_episodes TEXT,
+        douban_id TEXT,
+        aired_through INTEGER,
+        search_attempts INTEGER NOT NULL DEFAULT 0,
+        next_search INTEGER NOT NULL DEFAULT 0,
         UNIQUE(title, season)
     )''')
+    add_douban_id_column(cursor, 'MISS_TVS', 'r.title = MISS_TVS.title AND r.season = MISS_TVS.season')
+    # aired_through：这一季尚未播完时已播出到第几集，为空表示全部已播出或没有播出日期；
+    # search_attempts、next_search：电视剧下载程序连续未搜索到资源的次数和下次搜索的时间
+    columns = [column[1] for column in cursor.execute("PRAGMA table_info(MISS_TVS)").fetchall()]
+    for column, definition in (('aired_through', 'INTEGER'),
+                               ('search_attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                               ('next_search', 'INTEGER NOT NULL DEFAULT 0')):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE MISS_TVS ADD COLUMN {column} {definition}")
+            logger.info(f"在表 MISS_TVS 中添加了 {column} 字段")
+
+# 需要记录变化的表，以及触发器中取季数（0 表示所有季）和TMDB ID的表达式
+TRACKED_TABLES = {
+    'LIB_MOVIES': ('0', "CAST(NULLIF({row}.tmdb_id, '') AS INTEGER)"),
+    'LIB_TVS': ('0', "CAST(NULLIF({row}.tmdb_id, '') AS INTEGER)"),
+    'RSS_MOVIES': ('0', 'NULL'),
+    'RSS_TVS': ('{row}.season', 'NULL'),
+}
+
+def create_dirty_tracking(cursor):
+    """创建记录变化的表和触发器：媒体库或豆瓣订阅中的条目发生增删改时，记录其 (标题, 年份, 季) 和TMDB ID"""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS SUBSCRIPTION_DIRTY (
+        title TEXT NOT NULL,
+        year TEXT NOT NULL DEFAULT '',
+        season INTEGER NOT NULL DEFAULT 0,
+        tmdb_id INTEGER,
+        changed_at INTEGER,
+        PRIMARY KEY (title, year, season)
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS RECONCILE_STATE (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    )''')
+    if 'tmdb_id' not in [column[1] for column in cursor.execute("PRAGMA table_info(SUBSCRIPTION_DIRTY)").fetchall()]:
+        cursor.execute("ALTER TABLE SUBSCRIPTION_DIRTY ADD COLUMN tmdb_id INTEGER")
+        # 旧触发器没有记录TMDB ID的变化，升级后完整核对一次
+        cursor.execute("DELETE FROM RECONCILE_STATE WHERE name = 'last_full_check'")
+    # 使用 INSERT OR REPLACE，核对期间再次变化的条目获得新的 rowid，不会被本次核对清除。
+    # 触发器每次运行时重建，表结构或记录内容变化后无需手动删除旧触发器
+    mark = "INSERT OR REPLACE INTO SUBSCRIPTION_DIRTY (title, year, season, tmdb_id, changed_at) "
+    events = (('INSERT', ('NEW',)), ('DELETE', ('OLD',)), ('UPDATE', ('OLD', 'NEW')))
+    triggers = {}
+    for table, (season, tmdb_id) in TRACKED_TABLES.items():
+        for event, rows in events:
+            triggers[(table, event)] = ''.join(
+                f"{mark}VALUES ({row}.title, CAST(IFNULL({row}.year, '') AS TEXT), {season.format(row=row)}, "
+                f"{tmdb_id.format(row=row)}, strftime('%s', 'now'));"
+                for row in rows
+            )
+    for event, rows in events:
+        # 剧集表只有 tv_id，从 LIB_TVS 中取标题、年份和TMDB ID
+        triggers[('LIB_TV_SEASONS', event)] = ''.join(
+            f"{mark}SELECT title, CAST(IFNULL(year, '') AS TEXT), {row}.season, CAST(NULLIF(tmdb_id, '') AS INTEGER), "
+            f"strftime('%s', 'now') FROM LIB_TVS WHERE id = {row}.tv_id;"
+            for row in rows
+        )
+        # 豆瓣ID对应的TMDB ID变化后，重新核对该豆瓣ID的订阅
+        triggers[('DOUBAN_TMDB_MAP', event)] = ''.join(
+            f"{mark}SELECT title, CAST(IFNULL(year, '') AS TEXT), {season}, {row}.tmdb_id, strftime('%s', 'now') "
+            f"FROM {rss_table} WHERE douban_id = {row}.douban_id;"
+            for row in rows for rss_table, season in (('RSS_MOVIES', '0'), ('RSS_TVS', 'season'))
+        )
+    for (table, event), body in triggers.items():
+        name = f"trg_{table.lower()}_{event.lower()}_dirty"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} AFTER {event} ON {table} BEGIN {body} END")
+
+def create_indexes(cursor):
+    """为订阅核对用到的连接条件创建索引"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lib_movies_title_year ON LIB_MOVIES (title, year)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lib_movies_title_key_year ON LIB_MOVIES (title_key, year)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lib_tv_seasons_tv_season ON LIB_TV_SEASONS (tv_id, season)')
+    # tmdb_id 字段为文本，按整数建立表达式索引，与 DOUBAN_TMDB_MAP 中的整数ID比较
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lib_movies_tmdb ON LIB_MOVIES (CAST(tmdb_id AS INTEGER))')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_lib_tvs_tmdb ON LIB_TVS (CAST(tmdb_id AS INTEGER))')
+
+def tmdb_unknown(alias, lib):
+    """订阅或媒体库条目任一方没有TMDB ID时，才按标题匹配"""
+    return (f"(NULLIF({lib}.tmdb_id, '') IS NULL OR NOT EXISTS "
+            f"(SELECT 1 FROM DOUBAN_TMDB_MAP AS d WHERE d.douban_id = {alias}.douban_id AND d.tmdb_id IS NOT NULL))")
+
+def movie_in_library(alias):
+    """订阅的电影已入库：TMDB ID 相同，或没有TMDB ID时标题匹配键和年份相同"""
+    return f"""(
+        EXISTS (SELECT 1 FROM DOUBAN_TMDB_MAP AS d JOIN LIB_MOVIES AS l ON CAST(l.tmdb_id AS INTEGER) = d.tmdb_id
+                WHERE d.douban_id = {alias}.douban_id)
+        OR EXISTS (SELECT 1 FROM LIB_MOVIES AS l WHERE l.title_key = {alias}.title_key AND l.year = {alias}.year AND {tmdb_unknown(alias, 'l')})
+    )"""
+
+def tv_in_library(alias):
+    """订阅的这一季已入库：TMDB ID 相同且媒体库中有这一季，或没有TMDB ID时标题匹配键和年份相同。
+
+    同一部剧的各季在豆瓣是不同条目，却对应同一个TMDB ID，所以按TMDB ID匹配时还要求媒体库中有这一季；
+    TMDB ID 相同但媒体库中没有这一季的记录时，仍按标题匹配键和年份匹配（豆瓣每一季的年份不同）"""
+    same_tv = (f"EXISTS (SELECT 1 FROM DOUBAN_TMDB_MAP AS d WHERE d.douban_id = {alias}.douban_id "
+               f"AND d.tmdb_id = CAST(l.tmdb_id AS INTEGER))")
+    has_season = f"EXISTS (SELECT 1 FROM LIB_TV_SEASONS AS s WHERE s.tv_id = l.id AND s.season = {alias}.season)"
+    return f"""(
+        EXISTS (SELECT 1 FROM DOUBAN_TMDB_MAP AS d JOIN LIB_TVS AS l ON CAST(l.tmdb_id AS INTEGER) = d.tmdb_id
+                WHERE d.douban_id = {alias}.douban_id AND {has_season})
+        OR EXISTS (SELECT 1 FROM LIB_TVS AS l WHERE l.title_key = {alias}.title_key AND l.year = {alias}.year
+                   AND ({tmdb_unknown(alias, 'l')} OR {same_tv} AND NOT {has_season}))
+    )"""
+
+def library_tv_id(alias):
+    """订阅对应的媒体库电视剧ID：优先按TMDB ID，没有TMDB ID时按标题匹配键"""
+    return f"""COALESCE(
+        (SELECT l.id FROM DOUBAN_TMDB_MAP AS d JOIN LIB_TVS AS l ON CAST(l.tmdb_id AS INTEGER) = d.tmdb_id
+         WHERE d.douban_id = {alias}.douban_id LIMIT 1),
+        (SELECT l.id FROM LIB_TVS AS l WHERE l.title_key = {alias}.title_key AND {tmdb_unknown(alias, 'l')} LIMIT 1)
+    )"""
+
+def aired_through(alias, total):
+    """订阅的这一季已播出到第几集：TMDB中第一个未播出（或播出日期未定）的集数减一；TMDB只列出已播出的集数
+    且列出的集数少于豆瓣总集数 total 时，为已列出的最后一集。没有播出日期或已全部播出时为 NULL"""
+    unaired = "e.air_date IS NULL OR e.air_date > date('now', 'localtime')"
+    return f"""(
+        SELECT COALESCE(
+            MIN(CASE WHEN {unaired} THEN e.episode END) - 1,
+            CASE WHEN COUNT(*) < {total} THEN MAX(e.episode) END
+        )
+        FROM DOUBAN_TMDB_MAP AS d
+        JOIN TMDB_EPISODES AS e ON e.tmdb_id = d.tmdb_id AND e.season = {alias}.season
+        WHERE d.douban_id = {alias}.douban_id
+    )"""
+
+def dirty_scope(alias, dirty_only):
+    """只核对有变化的标题时附加的条件。订阅表中的季与媒体库的季没有对应关系，所以按标题匹配键而不是 (标题, 年份, 季) 筛选"""
+    return f"AND {alias}.title_key IN (SELECT title_key FROM DIRTY_SNAPSHOT)" if dirty_only else ''
+
+def subscribe_movies(cursor, dirty_only=False):
+    """订阅电影：豆瓣订阅中尚未入库的电影加入 MISS_MOVIES，返回新增的 (标题, 年份)"""
+    return cursor.execute(f'''
+        INSERT OR IGNORE INTO MISS_MOVIES (title, year, douban_id, title_key)
+        SELECT r.title, r.year, r.douban_id, r.title_key FROM RSS_MOVIES AS r
+        WHERE NOT {movie_in_library('r')}
+          {dirty_scope('r', dirty_only)}
+        RETURNING title, year
+    ''').fetchall()
+
+def subscribe_tvs(cursor, dirty_only=False):
+    """订阅电视剧：豆瓣订阅中尚未入库的电视剧按总集数中已播出的集数加入 MISS_TVS，返回新增的 (标题, 季, 缺失集数)"""
+    for title, season in cursor.execute(
+        f"SELECT title, season FROM RSS_TVS WHERE (CAST(episode AS INTEGER) <= 0 OR episode IS NULL) {dirty_scope('RSS_TVS', dirty_only)}"
+    ).fetchall():
+        logger.warning(f"电视剧：{title} 第{season}季 缺少总集数信息，跳过处理！")
+
+    # 已入库的电视剧不自动订阅缺失的集数
+    return cursor.execute(f'''
+        WITH RECURSIVE numbers(n) AS (
+            SELECT 1
+            UNION ALL
+            SELECT n + 1 FROM numbers WHERE n < (SELECT MAX(CAST(episode AS INTEGER)) FROM RSS_TVS)
+        )
+        INSERT OR IGNORE INTO MISS_TVS (title, season, missing_episodes, douban_id, title_key, aired_through)
+        SELECT r.title, r.season,
+               COALESCE((SELECT group_concat(n, ',') FROM (
+                   SELECT n FROM numbers WHERE n <= CAST(r.episode AS INTEGER) AND (r.aired IS NULL OR n <= r.aired) ORDER BY n
+               )), ''),
+               r.douban_id, r.title_key,
+               CASE WHEN r.aired < CAST(r.episode AS INTEGER) THEN r.aired END
+        FROM (SELECT *, {aired_through('RSS_TVS', 'CAST(RSS_TVS.episode AS INTEGER)')} AS aired FROM RSS_TVS) AS r
+        WHERE CAST(r.episode AS INTEGER) > 0
+          AND NOT {tv_in_library('r')}
+          {dirty_scope('r', dirty_only)}
+        RETURNING title, season, missing_episodes
+    ''').fetchall()
 
-def subscribe_movies(cursor):
-    """订阅电影"""
-    cursor.execute('SELECT title, year FROM RSS_MOVIES')
-    rss_movies = cursor.fetchall()
-
-    for title, year in rss_movies:
-        if not cursor.execute('SELECT 1 FROM LIB_MOVIES WHERE title = ? AND year = ?', (title, year)).fetchone():
-            cursor.execute('INSERT OR IGNORE INTO MISS_MOVIES (title, year) VALUES (?, ?)', (title, year))
-            if cursor.rowcount > 0:
-                logger.info(f"影片：{title}（{year}) 已添加订阅！")
-            else:
-                logger.warning(f"影片：{title}（{year}) 已存在于订阅列表中，跳过插入。")
+def update_aired_episodes(cursor):
+    """按播出日期更新尚未播完的订阅：新播出且未入库的集数加入缺失集数并立即重新搜索，尚未播出的集数从缺失集数中移除。
+
+    播出与否随日期变化而不是随数据变化，所以每次都检查所有订阅，返回 (标题, 季, 新播出的集数)"""
+    rows = cursor.execute(f'''
+        SELECT m.id, m.title, m.season, m.missing_episodes, m.aired_through, m.total,
+               CASE WHEN m.aired < m.total THEN m.aired END AS aired, (
+                   SELECT s.episodes FROM LIB_TV_SEASONS AS s
+                   WHERE s.tv_id = {library_tv_id('m')} AND s.season = m.season AND json_valid('[' || s.episodes || ']')
+               ) AS library_episodes
+        FROM (
+            SELECT MISS_TVS.*, CAST(r.episode AS INTEGER) AS total, {aired_through('MISS_TVS', 'CAST(r.episode AS INTEGER)')} AS aired
+            FROM MISS_TVS JOIN RSS_TVS AS r ON r.douban_id = MISS_TVS.douban_id
+            WHERE json_valid('[' || COALESCE(MISS_TVS.missing_episodes, '') || ']') AND CAST(r.episode AS INTEGER) > 0
+        ) AS m
+        WHERE (CASE WHEN m.aired < m.total THEN m.aired END) IS NOT m.aired_through
+    ''').fetchall()
+
+    newly_aired = []
+    for id, title, season, missing_episodes, old_aired, total, new_aired, library_episodes in rows:
+        missing = {int(ep) for ep in (missing_episodes or '').split(',') if ep.strip()}
+        owned = {int(ep) for ep in (library_episodes or '').split(',') if ep.strip()}
+        old_limit = total if old_aired is None else old_aired
+        new_limit = total if new_aired is None else new_aired
+        aired = set(range(old_limit + 1, new_limit + 1)) - owned
+        missing = {ep for ep in missing | aired if ep <= new_limit}
+        if aired:
+            newly_aired.append((title, season, sorted(aired)))
+            cursor.execute(
+                'UPDATE MISS_TVS SET missing_episodes = ?, aired_through = ?, search_attempts = 0, next_search = 0 WHERE id = ?',
+                (','.join(map(str, sorted(missing))), new_aired, id)
+            )
         else:
-            logger.info(f"影片：{title}（{year}) 已入库，无需下载订阅！")
-
-def subscribe_tvs(cursor):
-    """订阅电视剧"""
-    cursor.execute('SELECT title, season, episode, year FROM RSS_TVS')
-    rss_tvs = cursor.fetchall()
-
-    for title, season, total_episodes, year in rss_tvs:
-        if total_episodes is None:
-            logger.warning(f"电视剧：{title} 第{season}季 缺少总集数信息，跳过处理！")
-            continue
-
-        total_episodes = int(total_episodes)
-        if not cursor.execute('SELECT 1 FROM LIB_TVS WHERE title = ? AND year = ?', (title, year)).fetchone():
-            missing_episodes_str = ','.join(map(str, range(1, total_episodes + 1)))
-            # 检查是否已经存在于 MISS_TVS 表中
-            if not cursor.execute('SELECT 1 FROM MISS_TVS WHERE title = ? AND season = ?', (title, season)).fetchone():
-                cursor.execute('INSERT INTO MISS_TVS (title, season, missing_episodes) VALUES (?, ?, ?)', (title, season, missing_episodes_str))
-                logger.info(f"电视剧：{title} 第{season}季 已添加订阅！")
-            else:
-                logger.warning(f"电视剧：{title} 第{season}季 已存在于订阅列表中，跳过插入。")
+            cursor.execute(
+                'UPDATE MISS_TVS SET missing_episodes = ?, aired_through = ? WHERE id = ?',
+                (','.join(map(str, sorted(missing))), new_aired, id)
+            )
+    return newly_aired
+
+def update_subscriptions(cursor, dirty_only=False):
+    """检查当前订阅，返回 (已完成的电影, 已完成的电视剧, 缺失集数变化的电视剧)"""
+    completed_movies = cursor.execute(f'''
+        DELETE FROM MISS_MOVIES
+        WHERE {movie_in_library('MISS_MOVIES')}
+          {dirty_scope('MISS_MOVIES', dirty_only)}
+        RETURNING title, year
+    ''').fetchall()
+
+    for title, season, missing_episodes in cursor.execute(
+        f"SELECT title, season, missing_episodes FROM MISS_TVS WHERE NOT json_valid('[' || COALESCE(missing_episodes, '') || ']') {dirty_scope('MISS_TVS', dirty_only)}"
+    ).fetchall():
+        logger.warning(f"电视剧：{title} 第{season}季 缺失集数格式错误（{missing_episodes}），跳过检查！")
+
+    # 一次计算所有订阅去掉已入库集数后剩余的缺失集数，只返回发生变化的订阅
+    diff = cursor.execute(f'''
+        WITH matched AS (
+            SELECT m.id, m.title, m.season, m.missing_episodes, m.aired_through, {library_tv_id('m')} AS tv_id
+            FROM MISS_TVS AS m
+            WHERE json_valid('[' || COALESCE(m.missing_episodes, '') || ']')
+              {dirty_scope('m', dirty_only)}
+        )
+        SELECT m.id, m.title, m.season, m.missing_episodes, m.aired_through, (
+            SELECT group_concat(value, ',') FROM (
+                SELECT me.value FROM json_each('[' || COALESCE(m.missing_episodes, '') || ']') AS me
+                WHERE me.value NOT IN (SELECT le.value FROM json_each('[' || s.episodes || ']') AS le)
+                ORDER BY me.value
+            )
+        ) AS remaining
+        FROM matched AS m
+        JOIN LIB_TV_SEASONS AS s ON s.tv_id = m.tv_id AND s.season = m.season
+        WHERE json_valid('[' || s.episodes || ']')
+          AND remaining IS NOT m.missing_episodes
+          AND NOT (remaining IS NULL AND m.aired_through IS NOT NULL AND IFNULL(m.missing_episodes, '') = '')
+    ''').fetchall()
+
+    # 尚未播完的季下载完已播出的集数后保留订阅，等待后续集数播出
+    completed = [row for row in diff if row[5] is None and row[4] is None]
+    updated = [row for row in diff if row not in completed]
+    completed_tvs = [(title, season) for _, title, season, _, _, _ in completed]
+    updated_tvs = [(title, season, remaining or '') for _, title, season, _, _, remaining in updated]
+    cursor.executemany('DELETE FROM MISS_TVS WHERE id = ?', [(row[0],) for row in completed])
+    cursor.executemany('UPDATE MISS_TVS SET missing_episodes = ? WHERE id = ?', [(row[5] or '', row[0]) for row in updated])
+    return completed_movies, completed_tvs, updated_tvs
+
+def reconcile(cursor, full=False):
+    """核对豆瓣订阅、媒体库和当前订阅，返回各类变化的数量。
+
+    full 为 False 时只核对 SUBSCRIPTION_DIRTY 中记录的有变化的标题，核对后清除这些记录"""
+    # 固定本次要处理的变化，核对期间新产生的记录留到下次
+    last_rowid = cursor.execute('SELECT IFNULL(MAX(rowid), 0) FROM SUBSCRIPTION_DIRTY').fetchone()[0]
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS DIRTY_SNAPSHOT (title_key TEXT PRIMARY KEY)')
+    cursor.execute('DELETE FROM DIRTY_SNAPSHOT')
+    cursor.execute(
+        'INSERT OR IGNORE INTO DIRTY_SNAPSHOT (title_key) SELECT normalize_title(title) FROM SUBSCRIPTION_DIRTY WHERE rowid <= ?',
+        (last_rowid,)
+    )
+    # 媒体库中的标题可能与订阅不同，按变化条目的TMDB ID找到对应的订阅标题
+    for table in ('RSS_MOVIES', 'RSS_TVS', 'MISS_MOVIES', 'MISS_TVS'):
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO DIRTY_SNAPSHOT (title_key)
+            SELECT r.title_key FROM {table} AS r JOIN DOUBAN_TMDB_MAP AS d ON d.douban_id = r.douban_id
+            WHERE d.tmdb_id IN (SELECT tmdb_id FROM SUBSCRIPTION_DIRTY WHERE rowid <= ? AND tmdb_id IS NOT NULL)
+        ''', (last_rowid,))
+    dirty_titles = cursor.execute('SELECT COUNT(*) FROM DIRTY_SNAPSHOT').fetchone()[0]
+
+    # 新播出的集数与数据变化无关，每次都检查
+    aired_tvs = update_aired_episodes(cursor)
+    for title, season, episodes in aired_tvs:
+        logger.info(f"电视剧：{title} 第{season}季 第{','.join(map(str, episodes))}集 已播出，已加入订阅！")
+
+    if full:
+        logger.info("执行完整的订阅核对")
+    elif dirty_titles:
+        logger.info(f"核对 {dirty_titles} 个有变化的标题")
+    else:
+        logger.info("媒体库和豆瓣订阅没有变化，跳过订阅核对")
+        return None
+
+    dirty_only = not full
+    added_movies = subscribe_movies(cursor, dirty_only)
+    added_tvs = subscribe_tvs(cursor, dirty_only)
+    completed_movies, completed_tvs, updated_tvs = update_subscriptions(cursor, dirty_only)
+    cursor.execute('DELETE FROM SUBSCRIPTION_DIRTY WHERE rowid <= ?', (last_rowid,))
+    if full:
+        cursor.execute("INSERT OR REPLACE INTO RECONCILE_STATE (name, value) VALUES ('last_full_check', ?)", (int(time.time()),))
+
+    for title, year in added_movies:
+        logger.info(f"影片：{title}（{year}) 已添加订阅！")
+    for title, season, _ in added_tvs:
+        logger.info(f"电视剧：{title} 第{season}季 已添加订阅！")
+    for title, year in completed_movies:
+        logger.info(f"影片：{title}（{year}) 已完成订阅！")
+    for title, season in completed_tvs:
+        logger.info(f"电视剧：{title} 第{season}季 已完成订阅！")
+    for title, season, missing_episodes in updated_tvs:
+        if missing_episodes:
+            logger.info(f"电视剧：{title} 第{season}季 缺失 {missing_episodes} 集，已更新订阅！")
         else:
-            existing_episodes_str = cursor.execute('''
-                SELECT episodes 
-                FROM LIB_TV_SEASONS 
-                WHERE tv_id = (SELECT id FROM LIB_TVS WHERE title = ? AND year = ?) AND season = ?
-            ''', (title, year, season)).fetchone()
-
-            if existing_episodes_str:
-                existing_episodes = set(map(int, existing_episodes_str[0].split(',')))
-                total_episodes_set = set(range(1, total_episodes + 1))
-                missing_episodes = total_episodes_set - existing_episodes
-
-                if missing_episodes:
-                    pass
-                else:
-                    logger.info(f"电视剧：{title} 第{season}季 已入库，无需下载订阅！")
-
-def update_subscriptions(cursor):
-    """检查并更新当前订阅"""
-    # 检查并删除已入库的电影
-    cursor.execute('SELECT title, year FROM MISS_MOVIES')
-    miss_movies = cursor.fetchall()
-
-    for title, year in miss_movies:
-        if cursor.execute('SELECT 1 FROM LIB_MOVIES WHERE title = ? AND year = ?', (title, year)).fetchone():
-            cursor.execute('DELETE FROM MISS_MOVIES WHERE title = ? AND year = ?', (title, year))
-            logger.info(f"影片：{title}（{year}) 已完成订阅！")
-
-    # 检查并删除已完整订阅的电视剧
-    cursor.execute('SELECT title, season, missing_episodes FROM MISS_TVS')
-    miss_tvs = cursor.fetchall()
-
-    for title, season, missing_episodes in miss_tvs:
-        existing_episodes_str = cursor.execute('''
-            SELECT episodes 
-            FROM LIB_TV_SEASONS 
-            WHERE tv_id = (SELECT id FROM LIB_TVS WHERE title = ?) AND season = ?
-        ''', (title, season)).fetchone()
-
-        if existing_episodes_str:
-            existing_episodes = set(map(int, existing_episodes_str[0].split(',')))
-            if missing_episodes:
-                missing_episodes_set = set(map(int, missing_episodes.split(',')))
-            else:
-                missing_episodes_set = set()
-
-            total_episodes_set = existing_episodes | missing_episodes_set
-
-            if len(total_episodes_set) == len(existing_episodes):
-                cursor.execute('DELETE FROM MISS_TVS WHERE title = ? AND season = ?', (title, season))
-                logger.info(f"电视剧：{title} 第{season}季 已完成订阅！")
-            else:
-                new_missing_episodes_str = ','.join(map(str, sorted(total_episodes_set - existing_episodes)))
-                if new_missing_episodes_str != missing_episodes:  # 检查是否发生变化
-                    cursor.execute('UPDATE MISS_TVS SET missing_episodes = ? WHERE title = ? AND season = ?', (new_missing_episodes_str, title, season))
-                    logger.info(f"电视剧：{title} 第{season}季 缺失 {new_missing_episodes_str} 集，已更新订阅！")
-                else:
-                    logger.info(f"电视剧：{title} 第{season}季 订阅未发生变化！")
+            logger.info(f"电视剧：{title} 第{season}季 已播出的集数均已入库，等待后续集数播出！")
+
+    changes = {
+        'movies_added': len(added_movies),
+        'tvs_added': len(added_tvs),
+        'movies_completed': len(completed_movies),
+        'tvs_completed': len(completed_tvs),
+        'tvs_updated': len(updated_tvs),
+        'tvs_aired': len(aired_tvs),
+    }
+    if any(changes.values()):
+        logger.info(f"订阅核对完成：新增电影 {changes['movies_added']} 部、电视剧 {changes['tvs_added']} 季，"
+                    f"完成电影 {changes['movies_completed']} 部、电视剧 {changes['tvs_completed']} 季，"
+                    f"更新电视剧 {changes['tvs_updated']} 季，新播出电视剧 {changes['tvs_aired']} 季")
+    else:
+        logger.info("订阅核对完成，没有发生变化")
+    return changes
 
 def main():
     # 读取配置文件
@@ -142,14 +391,26 @@ def main():
         # 创建MISS_TVS表（如果不存在）
         create_miss_tvs_table(cursor)
 
-        # 订阅电影
-        subscribe_movies(cursor)
+        # 创建豆瓣ID与TMDB ID的对应表和电视剧播出日期表（如果不存在），check_rss.py 可能先于 rss.py 运行
+        create_tmdb_tables(cursor)
+
+        # 标题匹配键，订阅与媒体库在没有TMDB ID时按匹配键对应
+        for table in ('LIB_MOVIES', 'LIB_TVS', 'RSS_MOVIES', 'RSS_TVS', 'MISS_MOVIES', 'MISS_TVS'):
+            add_title_key(cursor, table)
+
+        # 创建订阅核对用到的索引
+        create_indexes(cursor)
+
+        # 创建记录媒体库和豆瓣订阅变化的触发器
+        create_dirty_tracking(cursor)
 
-        # 订阅电视剧
-        subscribe_tvs(cursor)
+        # 只核对有变化的标题，每隔 full_check_hours 小时完整核对一次
+        full_check_seconds = config.getfloat('running', 'full_check_hours', fallback=24) * 3600
+        last_full_check = cursor.execute("SELECT value FROM RECONCILE_STATE WHERE name = 'last_full_check'").fetchone()
+        full = last_full_check is None or time.time() - last_full_check[0] >= full_check_seconds
 
-        # 更新订阅
-        update_subscriptions(cursor)
+        # 核对并更新订阅
+        reconcile(cursor, full)
 
         # 提交事务
         conn.commit()
@@ -0,0 +1,137 @@
+import os
+import sys
+import sqlite3
+import logging
+import tempfile
+import configparser
+from datetime import date, timedelta
+import rss
+import check_rss
+import scan_media
+from media_parser import normalize_title, add_title_key
+
+logging.disable(logging.CRITICAL)
+
+TMDB_ID = 84806
+DOUBAN_ID = '34937650'
+TOTAL = 36
+
+def create_database():
+    """创建包含媒体库、豆瓣订阅和订阅核对所需表的临时数据库，返回 (连接, 游标)"""
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'media.db')
+    scan_media.create_database(db_path)
+    config_path = os.path.join(directory, 'config.ini')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        f.write(f"[douban]\ncookie = \nrss_url = http://127.0.0.1/feed\n[database]\ndb_path = {db_path}\n")
+    rss.DouBanRSSParser(config_path).close_db()
+    check_rss.config = configparser.ConfigParser()
+    conn = sqlite3.connect(db_path)
+    conn.create_function('normalize_title', 1, normalize_title, deterministic=True)
+    cursor = conn.cursor()
+    check_rss.create_miss_movies_table(cursor)
+    check_rss.create_miss_tvs_table(cursor)
+    for table in ('LIB_MOVIES', 'LIB_TVS', 'RSS_MOVIES', 'RSS_TVS', 'MISS_MOVIES', 'MISS_TVS'):
+        add_title_key(cursor, table)
+    check_rss.create_indexes(cursor)
+    check_rss.create_dirty_tracking(cursor)
+    cursor.execute(
+        'INSERT INTO RSS_TVS (title, douban_id, season, episode, year, title_key) VALUES (?, ?, ?, ?, ?, ?)',
+        ('庆余年第二季', DOUBAN_ID, 2, str(TOTAL), '2024', normalize_title('庆余年第二季'))
+    )
+    cursor.execute('INSERT INTO DOUBAN_TMDB_MAP (douban_id, media_type, tmdb_id, resolved_at) VALUES (?, ?, ?, 0)',
+                   (DOUBAN_ID, 'tv', TMDB_ID))
+    return conn, cursor
+
+def set_schedule(cursor, schedule):
+    """schedule 为 {集数: 距今天数}，距今天数为 None 表示播出日期未定"""
+    cursor.execute('DELETE FROM TMDB_EPISODES')
+    cursor.executemany(
+        'INSERT INTO TMDB_EPISODES (tmdb_id, season, episode, air_date) VALUES (?, 2, ?, ?)',
+        [(TMDB_ID, episode, None if days is None else (date.today() + timedelta(days=days)).isoformat())
+         for episode, days in schedule.items()]
+    )
+
+def subscription(cursor):
+    row = cursor.execute('SELECT missing_episodes, aired_through FROM MISS_TVS WHERE douban_id = ?', (DOUBAN_ID,)).fetchone()
+    if row is None:
+        return None
+    return [int(episode) for episode in row[0].split(',') if episode], row[1]
+
+def episodes(first, last):
+    return list(range(first, last + 1))
+
+# (说明, TMDB 播出安排, 期望的缺失集数, 期望的 aired_through)
+CASES = [
+    ('TMDB 没有播出日期', {}, episodes(1, TOTAL), None),
+    ('TMDB 列出未播出的集数', {**{n: -7 for n in range(1, 11)}, 11: 3, 12: None}, episodes(1, 10), 10),
+    ('TMDB 只列出已播出的集数，少于豆瓣总集数', {n: -7 for n in range(1, 11)}, episodes(1, 10), 10),
+    ('TMDB 列出的集数与豆瓣总集数相同且已全部播出', {n: -30 for n in range(1, TOTAL + 1)}, episodes(1, TOTAL), None),
+]
+
+def check_subscribe():
+    """新订阅只包含已播出的集数"""
+    failures = 0
+    for description, schedule, expected_missing, expected_aired in CASES:
+        conn, cursor = create_database()
+        set_schedule(cursor, schedule)
+        check_rss.reconcile(cursor, True)
+        result = subscription(cursor)
+        if result != (expected_missing, expected_aired):
+            failures += 1
+            print(f"订阅结果不一致: {description}")
+            print(f"  期望: {(expected_missing, expected_aired)}")
+            print(f"  实际: {result}")
+        conn.close()
+    print(f"新订阅：{len(CASES) - failures}/{len(CASES)} 条通过")
+    return failures
+
+def check_newly_aired():
+    """TMDB 只列出已播出的集数时，后续集数播出并被列出后加入缺失集数"""
+    conn, cursor = create_database()
+    set_schedule(cursor, {n: -7 for n in range(1, 11)})
+    check_rss.reconcile(cursor, True)
+    set_schedule(cursor, {n: -7 for n in range(1, 13)})
+    newly_aired = check_rss.update_aired_episodes(cursor)
+    result = subscription(cursor)
+    conn.close()
+    expected = (episodes(1, 12), 12)
+    if newly_aired != [('庆余年第二季', 2, [11, 12])] or result != expected:
+        print("新播出的集数：未通过")
+        print(f"  期望: {expected}，新播出 [11, 12]")
+        print(f"  实际: {result}，新播出 {newly_aired}")
+        return 1
+    print("新播出的集数：通过")
+    return 0
+
+def check_before_rss():
+    """rss.py 还没有运行过（没有TMDB相关表）时，订阅核对也能完成"""
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'media.db')
+    scan_media.create_database(db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('CREATE TABLE RSS_MOVIES (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, douban_id TEXT UNIQUE, '
+                     'episode TEXT, year TEXT, img TEXT, url TEXT, sub_title TEXT)')
+        conn.execute('CREATE TABLE RSS_TVS (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, douban_id TEXT UNIQUE, '
+                     'season INTEGER DEFAULT 1, episode TEXT, year TEXT, img TEXT, url TEXT, sub_title TEXT)')
+        conn.execute("INSERT INTO RSS_TVS (title, douban_id, season, episode, year) VALUES ('繁花', '35207723', 1, '3', '2023')")
+    config = configparser.ConfigParser()
+    config.read_dict({'database': {'db_path': db_path}})
+    read_config = check_rss.read_config
+    check_rss.read_config = lambda config_path: config
+    try:
+        check_rss.main()
+    finally:
+        check_rss.read_config = read_config
+    with sqlite3.connect(db_path) as conn:
+        result = conn.execute('SELECT title, missing_episodes FROM MISS_TVS').fetchall()
+    if result != [('繁花', '1,2,3')]:
+        print("rss.py 运行前的订阅核对：未通过")
+        print(f"  实际: {result}")
+        return 1
+    print("rss.py 运行前的订阅核对：通过")
+    return 0
+
+if __name__ == "__main__":
+    failed = check_subscribe() + check_newly_aired() + check_before_rss()
+    sys.exit(1 if failed else 0)
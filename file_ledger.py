@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 采样哈希每段读取的字节数（文件头、中、尾各一段）
+SAMPLE_CHUNK_SIZE = 64 * 1024
+# 重试间隔从 10 分钟开始逐次翻倍，最长 1 天
+RETRY_BASE_SECONDS = 600
+RETRY_MAX_SECONDS = 86400
+
+def file_identity(file_path):
+    """返回文件的 (设备号, inode, 大小, 修改时间) 标识"""
+    stat = os.stat(file_path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+def sample_hash(file_path, size=None):
+    """读取文件头、中、尾三段数据计算哈希，用于文件被复制或跨文件系统移动后的识别"""
+    if size is None:
+        size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - SAMPLE_CHUNK_SIZE // 2), max(0, size - SAMPLE_CHUNK_SIZE)}):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_CHUNK_SIZE))
+    return digest.hexdigest()
+
+def directory_available(directory):
+    """目录存在且非空时认为可用；网络共享未挂载时挂载点通常不存在或为空目录"""
+    try:
+        with os.scandir(directory) as entries:
+            return any(True for _ in entries)
+    except OSError:
+        return False
+
+def under_directory(path, directory):
+    return os.path.commonpath([os.path.abspath(path), os.path.abspath(directory)]) == os.path.abspath(directory)
+
+class FileLedger:
+    """已处理文件台账，记录保存在 SQLite 中，只追加写入，按文件标识索引查询"""
+
+    def __init__(self, db_path, legacy_record_path=None):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.create_table()
+        self.migrated = self.migrate_record_file(legacy_record_path) if legacy_record_path else 0
+
+    def create_table(self):
+        with self.lock:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS PROCESSED_FILES (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device INTEGER,
+                    inode INTEGER,
+                    size INTEGER,
+                    mtime INTEGER,
+                    sample_hash TEXT,
+                    checksum TEXT,
+                    filename TEXT NOT NULL,
+                    source_path TEXT,
+                    target_path TEXT,
+                    processed_at INTEGER NOT NULL,
+                    UNIQUE(device, inode, size, mtime)
+                )
+            ''')
+            # 旧版数据库没有 checksum 列
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(PROCESSED_FILES)')}
+            if 'checksum' not in columns:
+                self.conn.execute('ALTER TABLE PROCESSED_FILES ADD COLUMN checksum TEXT')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_processed_files_sample ON PROCESSED_FILES (size, sample_hash)')
+            # 旧版记录只有文件名，没有文件标识
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_processed_files_legacy ON PROCESSED_FILES (filename) WHERE inode IS NULL')
+            # 启动核对进度，记录已核对过的文件及其大小和修改时间
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS RECONCILE_CHECKPOINTS (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    checked_at INTEGER NOT NULL
+                )
+            ''')
+            # 识别或转移失败的文件，按退避时间重试，可在 WEB 页面手动指定名称和年份
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS RETRY_QUEUE (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT UNIQUE NOT NULL,
+                    reason TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt INTEGER NOT NULL,
+                    override_title TEXT,
+                    override_year TEXT,
+                    updated_at INTEGER NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_retry_queue_next ON RETRY_QUEUE (next_attempt)')
+            # 内存缓存的持久层，保存 TMDB 查询结果等元数据
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS METADATA_CACHE (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            self.conn.commit()
+
+    def migrate_record_file(self, record_path):
+        """将旧版 files_record.txt 导入台账，导入后重命名原文件，返回导入的记录数"""
+        if not os.path.exists(record_path):
+            return 0
+        with open(record_path, 'r') as f:
+            filenames = {line.split('/')[-1] for line in f.read().splitlines() if line.strip()}
+        now = int(time.time())
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT INTO PROCESSED_FILES (filename, processed_at) VALUES (?, ?)',
+                    [(filename, now) for filename in filenames]
+                )
+        os.replace(record_path, record_path + '.migrated')
+        return len(filenames)
+
+    def contains(self, file_path, deep=True):
+        """判断文件是否已处理。deep 为 False 时只按文件标识查询，不读取文件内容"""
+        try:
+            device, inode, size, mtime = file_identity(file_path)
+        except OSError:
+            return False
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT 1 FROM PROCESSED_FILES WHERE device = ? AND inode = ? AND size = ? AND mtime = ?',
+                (device, inode, size, mtime)
+            ).fetchone()
+            if row:
+                return True
+            if not deep:
+                return False
+            # 旧版记录按文件名匹配，匹配成功后补全文件标识
+            filename = os.path.basename(file_path)
+            row = self.conn.execute(
+                'SELECT id FROM PROCESSED_FILES WHERE filename = ? AND inode IS NULL', (filename,)
+            ).fetchone()
+            if row:
+                with self.conn:
+                    self.conn.execute(
+                        'UPDATE OR IGNORE PROCESSED_FILES SET device = ?, inode = ?, size = ?, mtime = ?, source_path = ? WHERE id = ?',
+                        (device, inode, size, mtime, file_path, row[0])
+                    )
+                return True
+        try:
+            digest = sample_hash(file_path, size)
+        except OSError:
+            return False
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT 1 FROM PROCESSED_FILES WHERE size = ? AND sample_hash = ?', (size, digest)
+            ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def identify(file_path):
+        """在转移前读取文件标识与采样哈希，移动后源文件不存在时仍可写入记录"""
+        device, inode, size, mtime = file_identity(file_path)
+        return device, inode, size, mtime, sample_hash(file_path, size)
+
+    def record(self, file_path, target_path=None, identity=None, checksum=None):
+        """追加一条处理记录，checksum 为复制时计算的完整文件哈希"""
+        device, inode, size, mtime, digest = identity or self.identify(file_path)
+        with self.lock:
+            with self.conn:
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO PROCESSED_FILES
+                        (device, inode, size, mtime, sample_hash, checksum, filename, source_path, target_path, processed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (device, inode, size, mtime, digest, checksum, os.path.basename(file_path), file_path, target_path, int(time.time())))
+
+    def prune(self, retention_days=30, directories=None):
+        """删除超过保留期且源文件已不存在的记录，以及超过保留期仍未匹配到文件的旧版记录，返回删除的记录数。
+
+        指定 directories 时，源文件所在的监控目录不存在或为空（如网络共享未挂载）的记录不做清理，
+        不在任何监控目录下的记录也保留"""
+        cutoff = int(time.time()) - retention_days * 86400
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, source_path FROM PROCESSED_FILES WHERE source_path IS NOT NULL AND processed_at < ?', (cutoff,)
+            ).fetchall()
+        available = None
+        if directories is not None:
+            available = [directory for directory in directories if directory_available(directory)]
+        gone = []
+        for row_id, source_path in rows:
+            if available is not None and not any(under_directory(source_path, directory) for directory in available):
+                continue
+            if not os.path.exists(source_path):
+                gone.append((row_id,))
+        with self.lock:
+            with self.conn:
+                self.conn.executemany('DELETE FROM PROCESSED_FILES WHERE id = ?', gone)
+                legacy = self.conn.execute(
+                    'DELETE FROM PROCESSED_FILES WHERE inode IS NULL AND processed_at < ?', (cutoff,)
+                ).rowcount
+        return len(gone) + legacy
+
+    def load_checkpoints(self):
+        """返回 路径 -> (大小, 修改时间) 的核对进度"""
+        with self.lock:
+            rows = self.conn.execute('SELECT path, size, mtime FROM RECONCILE_CHECKPOINTS').fetchall()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def checkpoint(self, file_path, size, mtime):
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO RECONCILE_CHECKPOINTS (path, size, mtime, checked_at) VALUES (?, ?, ?, ?)',
+                    (file_path, size, mtime, int(time.time()))
+                )
+
+    def drop_checkpoints(self, paths):
+        with self.lock:
+            with self.conn:
+                self.conn.executemany('DELETE FROM RECONCILE_CHECKPOINTS WHERE path = ?', [(path,) for path in paths])
+
+    def retry_state(self, file_path):
+        """返回重试队列中的 (下次重试时间, 手动指定的名称, 手动指定的年份)，不在队列中时返回 None"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT next_attempt, override_title, override_year FROM RETRY_QUEUE WHERE path = ?', (file_path,)
+            ).fetchone()
+
+    def schedule_retry(self, file_path, reason):
+        """记录一次失败并按指数退避安排下次重试，返回 (失败次数, 距下次重试的秒数)"""
+        now = int(time.time())
+        with self.lock:
+            with self.conn:
+                row = self.conn.execute('SELECT attempts FROM RETRY_QUEUE WHERE path = ?', (file_path,)).fetchone()
+                attempts = (row[0] if row else 0) + 1
+                delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                self.conn.execute('''
+                    INSERT INTO RETRY_QUEUE (path, reason, attempts, next_attempt, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET reason = excluded.reason, attempts = excluded.attempts,
+                        next_attempt = excluded.next_attempt, updated_at = excluded.updated_at
+                ''', (file_path, reason, attempts, now + delay, now))
+        return attempts, delay
+
+    def clear_retry(self, file_path):
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM RETRY_QUEUE WHERE path = ?', (file_path,))
+
+    def due_retries(self):
+        """返回已到重试时间的文件路径"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT path FROM RETRY_QUEUE WHERE next_attempt <= ? ORDER BY next_attempt', (int(time.time()),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def cache_get(self, namespace, key, max_age):
+        """读取持久缓存，超过 max_age 秒的条目视为未命中"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT value FROM METADATA_CACHE WHERE namespace = ? AND key = ? AND updated_at >= ?',
+                (namespace, key, int(time.time()) - max_age)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_put(self, namespace, key, value):
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO METADATA_CACHE (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)',
+                    (namespace, key, json.dumps(value, ensure_ascii=False), int(time.time()))
+                )
+
+    def prune_cache(self, max_age):
+        """删除过期的持久缓存，返回删除的条目数"""
+        with self.lock:
+            with self.conn:
+                return self.conn.execute(
+                    'DELETE FROM METADATA_CACHE WHERE updated_at < ?', (int(time.time()) - max_age,)
+                ).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
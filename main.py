@@ -22,21 +22,52 @@ episodes_path = /Media/Your_episodes_path
 
 [downloadtransfer]
 directory = /Downloads
+watch_roots = 
 action = copy
 excluded_filenames = 【更多高清
+workers = 2
+device_concurrency = 1
+stable_seconds = 10
+bandwidth_limit = 0
+transfer_chunk_mb = 8
+transfer_nice = 10
+transfer_io_class = best-effort
+verify = off
+watch_mode = auto
+poll_min_interval = 2
+poll_max_interval = 30
+trigger = watch
+transmission_poll_interval = 10
+transmission_callback_port = 0
 
 [douban]
 api_key = 0ac44ae016490db2204ce0a042db2916
 cookie = your_douban_cookie_here
 rss_url = https://www.douban.com/feed/people/user-id/interests
+rate_limits = movie.douban.com:20/60, www.douban.com:20/60
+max_block_wait = 300
+subject_cache_days = 30
+miss_cache_days = 7
 
 [tmdb]
 base_url = https://api.tmdb.org/3
 api_key = your_tmdb_key
+schedule_refresh_hours = 24
 
 [download_mgmt]
 download_mgmt = False
 download_mgmt_url = http://your_transmission_url:port
+rpc_username = 
+rpc_password = 
+path_map = 
+
+[mediaserver]
+server_type = none
+server_url = http://your_jellyfin_url:8096
+api_key = your_api_key
+path_map = 
+debounce_seconds = 5
+max_delay_seconds = 60
 
 [resources]
 login_username = username
@@ -51,6 +82,7 @@ movie_url = https://100.tudoutudou.top
 
 [running]
 run_interval_hours = 6
+full_check_hours = 24
 """
     config_path = '/config/config.ini'
     try:
@@ -0,0 +1,193 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+# 解析结果缓存的条目数
+PARSE_CACHE_SIZE = 8192
+
+# 发布名称的词法规则：一次扫描同时识别季集、分辨率、年份和中文名称
+RELEASE_TOKEN_RE = re.compile(r'''
+    (?<![A-Za-z0-9])(?:
+          (?P<se>[Ss](?P<se_season>\d{1,2})(?:[Ee][Pp]?(?P<se_episode>\d{1,3}))?(?!\d))
+        | (?P<ep>(?:EP|Ep|ep|E|e)(?P<ep_episode>\d{1,4})(?![\dA-Za-z]))
+        | (?P<quality>(?:\d{3,4}[PpIi]|[248][Kk])(?![A-Za-z0-9]))
+        | (?P<year>(?:19|20)\d{2}(?![A-Za-z0-9]))
+        | (?P<cjk>(?<![\u4e00-\u9fa5：，·])[\u4e00-\u9fa5A-Za-z0-9：，·]*[\u4e00-\u9fa5][\u4e00-\u9fa5A-Za-z0-9：，·]*)(?=\.)
+    )
+    | (?P<cn_ep>第(?P<cn_episode>\d{1,3})[集话])
+    | (?P<cn_season>第(?P<cn_season_number>\d{1,2})季)
+''', re.VERBOSE)
+# 文件夹名称中的中文名称，如“【高清剧集网发布】繁花[第01集]...”
+FOLDER_NAME_RE = re.compile(r'】([\u4e00-\u9fa5A-Za-z0-9：$(). ]+)')
+FOLDER_YEAR_RE = re.compile(r'(?<![A-Za-z0-9])(?:19|20)\d{2}(?![A-Za-z0-9])')
+CJK_RE = re.compile(r'[\u4e00-\u9fa5]')
+# 中文名称中夹带的“第N集”、“第二季”
+CN_TOKEN_RE = re.compile(r'第(\d{1,3}|[零一二三四五六七八九十]{1,3})([集话季])')
+CN_DIGITS = {'零': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+SUFFIX_RE = re.compile(r'\.(\w+)$')
+BRACKET_RE = re.compile(r'\[[^\]]*\]|【[^】]*】')
+SEPARATOR_RE = re.compile(r'[\s._-]+')
+
+# 媒体库中整理后的文件名
+LIBRARY_MOVIE_RE = re.compile(r'^(.*) - \((\d{4})\) (\d+p)\.(mkv|mp4)$', re.IGNORECASE)
+LIBRARY_EPISODE_RE = re.compile(r'^(.*) - S(\d+)E(\d+) - (.*)\.(mkv|mp4)$', re.IGNORECASE)
+
+# 标题匹配键：常见繁体字与简体字的对照，按“繁简”成对排列
+TRADITIONAL_PAIRS = (
+    '與与專专業业叢丛東东絲丝兩两嚴严喪丧個个豐丰臨临為为麗丽舉举義义烏乌樂乐喬乔習习鄉乡書书買买亂乱爭争於于虧亏雲云亞亚產产'
+    '親亲億亿僅仅從从倉仓儀仪們们價价眾众優优會会傘伞偉伟傳传傷伤倫伦偽伪體体餘余俠侠侶侣偵侦側侧僑侨債债傾倾兒儿黨党蘭兰關关'
+    '興兴養养獸兽內内岡冈冊册寫写軍军農农馮冯衝冲決决況况凍冻淨净涼凉減减幾几鳳凤憑凭凱凯擊击劃划劉刘則则剛刚創创刪删別别劇剧'
+    '劑剂勸劝辦办務务動动勵励勁劲勞劳勢势勳勋區区醫医華华協协單单賣卖盧卢衛卫卻却廠厂廳厅歷历厲厉壓压厭厌縣县參参雙双發发變变'
+    '敘叙臺台葉叶號号嘆叹嚇吓嗎吗啟启啓启吳吴員员聽听嗚呜響响啞哑噴喷園园圍围圖图國国圓圆聖圣場场壞坏塊块堅坚壇坛墳坟墜坠墊垫'
+    '聲声處处備备復复複复夠够頭头誇夸夾夹奪夺奮奋獎奖婦妇媽妈嬌娇孫孙學学寧宁寶宝實实寵宠審审憲宪宮宫對对尋寻導导將将爾尔塵尘'
+    '嘗尝屍尸盡尽層层屬属屆届歲岁島岛嶺岭峽峡幣币帥帅師师帳帐帶带幫帮幹干廣广莊庄慶庆廬庐庫库應应廟庙廢废開开異异棄弃張张彌弥'
+    '彎弯彈弹強强歸归當当錄录徹彻徑径後后徵征憶忆懷怀態态憐怜總总惡恶惱恼悅悦懸悬驚惊慣惯憤愤願愿懶懒戀恋戰战戲戏戶户撲扑執执'
+    '擴扩掃扫揚扬擾扰撫抚搶抢護护報报擔担擬拟擁拥擇择掛挂摯挚揮挥損损撿捡換换據据擺摆攜携搖摇攝摄敵敌數数齋斋斬斩斷断無无舊旧'
+    '時时曠旷晝昼顯显晉晋曬晒曉晓暫暂術术機机殺杀雜杂權权條条來来楊杨極极構构樣样槍枪標标樓楼橫横樹树橋桥櫻樱檢检歡欢歐欧殘残'
+    '殼壳毀毁氣气漢汉湯汤溝沟沒没淚泪潑泼潔洁灑洒濃浓滅灭滿满湧涌漁渔濟济濱滨灣湾溫温淺浅遊游瀾澜燈灯靈灵災灾爐炉點点煉炼爛烂'
+    '熱热愛爱牽牵犧牺狀状獨独獄狱貓猫獵猎獅狮現现環环瑪玛電电畫画暢畅療疗瘋疯盜盗監监盤盘睜睁礎础確确禮礼禍祸離离種种稱称積积'
+    '穩稳窮穷竊窃競竞筆笔築筑簡简節节範范類类糧粮緊紧紅红紀纪約约級级紙纸紋纹納纳純纯線线練练組组細细終终結结給给絕绝統统經经'
+    '綠绿維维網网緣缘編编績绩繩绳續续緝缉紐纽錦锦繡绣羅罗罰罚聯联聰聪職职聞闻腦脑臉脸膽胆艦舰藝艺蘇苏蘋苹莖茎萬万蔣蒋薩萨藍蓝'
+    '蘆芦葦苇藥药蟲虫蝦虾螞蚂蠶蚕補补裝装裡里製制見见規规視视覺觉覽览觀观訂订計计記记討讨讓让訓训設设許许論论訪访證证評评識识'
+    '詞词試试詩诗話话該该誠诚語语說说誰谁課课調调談谈請请諸诸謝谢謎谜謠谣講讲讀读讚赞謀谋諜谍豬猪貝贝負负財财貢贡貨货質质貴贵'
+    '貸贷費费賀贺賊贼資资賞赏賢贤賭赌賽赛贏赢賴赖趙赵趕赶跡迹蹤踪躍跃車车軌轨輕轻載载較较輝辉輪轮輸输轉转邊边遼辽達达遷迁過过'
+    '運运還还這这進进遠远違违連连遲迟適适選选遺遗邁迈鄧邓鄭郑醜丑釋释鐘钟針针釣钓鐵铁鈴铃銀银鋒锋錯错錢钱鍵键鏡镜鎮镇鏢镖鑑鉴'
+    '劍剑長长門门閃闪閉闭問问間间閱阅闊阔闖闯鬧闹陽阳陰阴陣阵階阶際际陸陆陳陈險险隨随隱隐隊队難难雞鸡雖虽霧雾靜静韓韩頁页項项'
+    '順顺須须預预領领頻频題题額额顏颜顧顾顆颗風风飄飘飛飞飯饭飲饮館馆餓饿馬马駕驾驗验騎骑驅驱髮发鬥斗魚鱼鮮鲜鳥鸟鳴鸣鴨鸭鷹鹰'
+    '麥麦黃黄齊齐齒齿龍龙龜龟夢梦蠻蛮懼惧殭僵'
+)
+TRADITIONAL_TO_SIMPLIFIED = str.maketrans(dict(zip(TRADITIONAL_PAIRS[0::2], TRADITIONAL_PAIRS[1::2])))
+# 标题末尾的季数，如“第二季”、“Season 2”、“S02”
+TITLE_SEASON_RE = re.compile(r'(?:\s*第[\d零一二三四五六七八九十]{1,3}季|[\s._-]+(?:season[\s._-]*\d{1,2}|s\d{1,2}))$')
+TITLE_SYMBOL_RE = re.compile(r'[\W_]+')
+
+def cn_number(text):
+    """将“12”或“十二”这样的集数、季数转换为数字字符串"""
+    if text.isdigit():
+        return text
+    if '十' not in text:
+        return str(CN_DIGITS[text[0]])
+    tens, _, units = text.partition('十')
+    return str((CN_DIGITS[tens] if tens else 1) * 10 + (CN_DIGITS[units] if units else 0))
+
+def clean_title(text):
+    """去除方括号内容并将分隔符替换为空格"""
+    text = BRACKET_RE.sub(' ', text)
+    return SEPARATOR_RE.sub(' ', text).strip() or None
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def normalize_title(title):
+    """标题的匹配键：全角转半角、繁体转简体、忽略大小写，去除末尾的季数以及标点和空白。
+
+    豆瓣、TMDB、NFO、发布名称中的同一标题得到相同的匹配键，标题为空或只有空白时返回 None"""
+    if not title:
+        return None
+    text = unicodedata.normalize('NFKC', title).translate(TRADITIONAL_TO_SIMPLIFIED).casefold().strip()
+    key = TITLE_SYMBOL_RE.sub('', TITLE_SEASON_RE.sub('', text))
+    # 标题本身就是季数（如“S1”）时保留原样
+    return key or TITLE_SYMBOL_RE.sub('', text) or text or None
+
+def add_title_key(cursor, table, column='title'):
+    """为表添加标题匹配键字段 title_key 及其索引，并补全还没有匹配键的行。
+
+    同时在该连接上注册 SQL 函数 normalize_title()，供写入时计算匹配键"""
+    cursor.connection.create_function('normalize_title', 1, normalize_title, deterministic=True)
+    if 'title_key' not in [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN title_key TEXT")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_title_key ON {table} (title_key)")
+    cursor.execute(f"UPDATE {table} SET title_key = normalize_title({column}) WHERE title_key IS NULL AND {column} IS NOT NULL")
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_release_name(filename, folder_name=None):
+    """解析下载文件名，返回 (字段, 值) 元组，结果按文件名缓存"""
+    seasons, episodes, qualities, years, names = [], [], [], [], []
+    anchor = None
+    for match in RELEASE_TOKEN_RE.finditer(filename):
+        kind = match.lastgroup
+        if kind == 'se':
+            seasons.append(match.group('se_season').zfill(2))
+            if match.group('se_episode'):
+                episodes.append(match.group('se_episode'))
+        elif kind == 'ep':
+            episodes.append(match.group('ep_episode'))
+        elif kind == 'cn_ep':
+            episodes.append(match.group('cn_episode'))
+        elif kind == 'cn_season':
+            seasons.append(match.group('cn_season_number').zfill(2))
+        elif kind == 'quality':
+            qualities.append(match)
+            continue
+        elif kind == 'year':
+            years.append(match)
+            continue
+        else:
+            text = match.group('cjk')
+            cn_tokens = list(CN_TOKEN_RE.finditer(text))
+            if not cn_tokens:
+                names.append(text)
+                continue
+            for cn_token in cn_tokens:
+                if cn_token.group(2) == '季':
+                    seasons.append(cn_number(cn_token.group(1)).zfill(2))
+                else:
+                    episodes.append(cn_number(cn_token.group(1)))
+            names.append(text[:cn_tokens[0].start()])
+        if anchor is None:
+            anchor = match.start()
+
+    is_tv = bool(seasons or episodes)
+    year = None
+    if is_tv:
+        # 剧集：标题在第一个季集标记之前，年份取第一个
+        if years:
+            year = years[0].group()
+            anchor = min(anchor, years[0].start())
+    elif years:
+        # 电影：取分辨率之前的最后一个年份，避免片名中的数字（如“2049”）被当作年份
+        first_quality = qualities[0].start() if qualities else len(filename)
+        before_quality = [match for match in years if match.start() < first_quality]
+        year_match = before_quality[-1] if before_quality else years[0]
+        year = year_match.group()
+        anchor = year_match.start()
+    if anchor is None and qualities:
+        anchor = qualities[0].start()
+
+    name = next((name for name in names if CJK_RE.search(name)), None)
+    if not name and folder_name:
+        folder_match = FOLDER_NAME_RE.search(folder_name)
+        if folder_match and CJK_RE.search(folder_match.group(1)):
+            name = folder_match.group(1).strip()
+    if not name and anchor:
+        name = clean_title(filename[:anchor])
+
+    if not year and folder_name:
+        folder_year = FOLDER_YEAR_RE.search(folder_name)
+        if folder_year:
+            year = folder_year.group()
+
+    suffix = SUFFIX_RE.search(filename)
+    result = [
+        ('名称', name),
+        ('发行年份', year),
+        ('视频质量', qualities[0].group().upper() if qualities else None),
+        ('后缀名', suffix.group(1) if suffix else None),
+    ]
+    if episodes:
+        # 没有季信息时默认为第01季
+        result.append(('季', seasons[0] if seasons else '01'))
+        result.append(('集', episodes[0]))
+    return tuple(result)
+
+def extract_info(filename, folder_name=None):
+    """解析下载文件名，返回包含名称、发行年份、视频质量、后缀名以及季、集（剧集）的字典"""
+    return dict(parse_release_name(filename, folder_name))
+
+def parse_library_filename(filename):
+    """解析媒体库中整理后的文件名，返回 ('movie', 名称, 年份) 或 ('tv', 名称, 季, 集)，无法识别时返回 None"""
+    movie_match = LIBRARY_MOVIE_RE.match(filename)
+    if movie_match:
+        return 'movie', movie_match.group(1).strip(), movie_match.group(2)
+    episode_match = LIBRARY_EPISODE_RE.match(filename)
+    if episode_match:
+        return 'tv', episode_match.group(1).strip(), int(episode_match.group(2)), int(episode_match.group(3))
+    return None
@@ -0,0 +1,164 @@
+import sys
+import time
+import logging
+import media_parser
+import tvshow_downloader
+
+# 真实发布名称语料：(文件名, 所在文件夹名, 期望的解析结果)
+CORPUS = [
+    ('流浪地球2.The.Wandering.Earth.II.2023.2160p.WEB-DL.H265.DDP5.1.mkv', None,
+     {'名称': '流浪地球2', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('The.Matrix.1999.1080p.BluRay.x264-GROUP.mkv', None,
+     {'名称': 'The Matrix', '发行年份': '1999', '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('Blade.Runner.2049.2017.2160p.UHD.BluRay.x265.mkv', None,
+     {'名称': 'Blade Runner 2049', '发行年份': '2017', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('2012.2009.1080p.BluRay.x264.mkv', None,
+     {'名称': '2012', '发行年份': '2009', '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('1917.2019.2160p.WEB-DL.DDP5.1.Atmos.mp4', None,
+     {'名称': '1917', '发行年份': '2019', '视频质量': '2160P', '后缀名': 'mp4'}),
+    ('Oppenheimer.2023.IMAX.2160p.WEB-DL.DDP5.1.Atmos.H.265.mkv', None,
+     {'名称': 'Oppenheimer', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('沙丘2.Dune.Part.Two.2024.2160p.WEB-DL.H265.HDR.DDP5.1.mkv', None,
+     {'名称': '沙丘2', '发行年份': '2024', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('奥本海默.Oppenheimer.2023.1080p.mp4', None,
+     {'名称': '奥本海默', '发行年份': '2023', '视频质量': '1080P', '后缀名': 'mp4'}),
+    ('Inception.1080p.BluRay.mkv', 'Inception (2010)',
+     {'名称': 'Inception', '发行年份': '2010', '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('Se7en.1995.REMASTERED.1080p.BluRay.mkv', None,
+     {'名称': 'Se7en', '发行年份': '1995', '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('Breaking.Bad.S05E14.1080p.BluRay.x264-ROVERS.mkv', None,
+     {'名称': 'Breaking Bad', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv', '季': '05', '集': '14'}),
+    ('The.Last.of.Us.S01E09.2023.2160p.MAX.WEB-DL.DDP5.1.Atmos.DV.HEVC.mkv', None,
+     {'名称': 'The Last of Us', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv', '季': '01', '集': '09'}),
+    ('狂飙.Knockin.on.Heavens.Door.S01E05.2023.2160p.WEB-DL.H265.mkv', None,
+     {'名称': '狂飙', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv', '季': '01', '集': '05'}),
+    ('三体.Three-Body.EP03.2023.2160p.WEB-DL.H265.AAC.mp4', None,
+     {'名称': '三体', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mp4', '季': '01', '集': '03'}),
+    ('繁花.第05集.2160p.mp4', None,
+     {'名称': '繁花', '发行年份': None, '视频质量': '2160P', '后缀名': 'mp4', '季': '01', '集': '05'}),
+    ('S01E02.2160p.WEB-DL.H265.mkv', '【高清剧集网发布 www.DDHDTV.com】繁花[全30集][国语配音+中文字幕].Blossoms.Shanghai.S01.2023.2160p.WEB-DL.H265',
+     {'名称': '繁花', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv', '季': '01', '集': '02'}),
+    ('Blossoms.Shanghai.S01E02.2023.2160p.WEB-DL.H265.mkv', '【高清剧集网发布 www.DDHDTV.com】繁花[全30集][国语配音+中文字幕].Blossoms.Shanghai.S01.2023.2160p',
+     {'名称': '繁花', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv', '季': '01', '集': '02'}),
+    ('House.of.the.Dragon.S02E08.1080p.WEB.H264.mkv', None,
+     {'名称': 'House of the Dragon', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv', '季': '02', '集': '08'}),
+    ('Shogun.2024.S01E10.1080p.DSNP.WEB-DL.DDP5.1.H.264.mkv', None,
+     {'名称': 'Shogun', '发行年份': '2024', '视频质量': '1080P', '后缀名': 'mkv', '季': '01', '集': '10'}),
+    ('长相思.Lost.You.Forever.S01E39.2024.2160p.WEB-DL.H265.mkv', None,
+     {'名称': '长相思', '发行年份': '2024', '视频质量': '2160P', '后缀名': 'mkv', '季': '01', '集': '39'}),
+    ('庆余年第二季.Joy.of.Life.S02E01.2024.2160p.WEB-DL.H265.mkv', None,
+     {'名称': '庆余年', '发行年份': '2024', '视频质量': '2160P', '后缀名': 'mkv', '季': '02', '集': '01'}),
+    ('Friends.S10E17E18.1080p.BluRay.mkv', None,
+     {'名称': 'Friends', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv', '季': '10', '集': '17'}),
+    ('One.Piece.E1100.1080p.WEB.mkv', None,
+     {'名称': 'One Piece', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv', '季': '01', '集': '1100'}),
+    ('Severance.S2E3.720p.mkv', None,
+     {'名称': 'Severance', '发行年份': None, '视频质量': '720P', '后缀名': 'mkv', '季': '02', '集': '3'}),
+    ('The.Boys.第4季.E02.1080p.mkv', None,
+     {'名称': 'The Boys', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv', '季': '04', '集': '02'}),
+    ('黑镜.第7季.第03集.1080p.mkv', None,
+     {'名称': '黑镜', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv', '季': '07', '集': '03'}),
+    ('[SweetSub] 葬送的芙莉莲.E28.1080p.mp4', None,
+     {'名称': '葬送的芙莉莲', '发行年份': None, '视频质量': '1080P', '后缀名': 'mp4', '季': '01', '集': '28'}),
+    ('Dune.2021.4K.HDR.mkv', None,
+     {'名称': 'Dune', '发行年份': '2021', '视频质量': '4K', '后缀名': 'mkv'}),
+    ('Avatar.The.Way.of.Water.2022.720p.mp4', None,
+     {'名称': 'Avatar The Way of Water', '发行年份': '2022', '视频质量': '720P', '后缀名': 'mp4'}),
+    ('你好，李焕英.Hi.Mom.2021.1080p.WEB-DL.mp4', None,
+     {'名称': '你好，李焕英', '发行年份': '2021', '视频质量': '1080P', '后缀名': 'mp4'}),
+    ('满江红.Full.River.Red.2023.2160p.60fps.WEB-DL.mkv', None,
+     {'名称': '满江红', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('Top.Gun.Maverick.2022.2160p.UHD.BluRay.REMUX.HDR.HEVC.Atmos-EPSiLON.mkv', None,
+     {'名称': 'Top Gun Maverick', '发行年份': '2022', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('封神第一部：朝歌风云.Creation.of.the.Gods.I.2023.2160p.mkv', None,
+     {'名称': '封神第一部：朝歌风云', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mkv'}),
+    ('The.Bear.S03.COMPLETE.1080p.mkv', None,
+     {'名称': 'The Bear', '发行年份': None, '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('黑暗荣耀.The.Glory.S01E16.2022.1080p.NF.WEB-DL.mkv', None,
+     {'名称': '黑暗荣耀', '发行年份': '2022', '视频质量': '1080P', '后缀名': 'mkv', '季': '01', '集': '16'}),
+    ('Interstellar.2014.mkv', None,
+     {'名称': 'Interstellar', '发行年份': '2014', '视频质量': None, '后缀名': 'mkv'}),
+    ('movie.mkv', None,
+     {'名称': None, '发行年份': None, '视频质量': None, '后缀名': 'mkv'}),
+    ('漫长的季节.The.Long.Season.EP12.2023.2160p.mp4', None,
+     {'名称': '漫长的季节', '发行年份': '2023', '视频质量': '2160P', '后缀名': 'mp4', '季': '01', '集': '12'}),
+    ('Taxi.Driver.1976.1080p.BluRay.mkv', None,
+     {'名称': 'Taxi Driver', '发行年份': '1976', '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('Loki.S02E06.2160p.DSNP.WEB-DL.DDP5.1.Atmos.DV.HDR.H.265.mkv', None,
+     {'名称': 'Loki', '发行年份': None, '视频质量': '2160P', '后缀名': 'mkv', '季': '02', '集': '06'}),
+    ('北京遇上西雅图.Finding.Mr.Right.2013.BluRay.1080p.x264.mkv', None,
+     {'名称': '北京遇上西雅图', '发行年份': '2013', '视频质量': '1080P', '后缀名': 'mkv'}),
+    ('Fallout.S01E01.The.End.2160p.AMZN.WEB-DL.mkv', None,
+     {'名称': 'Fallout', '发行年份': None, '视频质量': '2160P', '后缀名': 'mkv', '季': '01', '集': '01'}),
+]
+
+def check_corpus():
+    """校验语料的解析结果，返回不一致的条目数"""
+    failures = 0
+    for filename, folder_name, expected in CORPUS:
+        result = media_parser.extract_info(filename, folder_name)
+        if result != expected:
+            failures += 1
+            print(f"解析结果不一致: {filename}")
+            print(f"  期望: {expected}")
+            print(f"  实际: {result}")
+    print(f"正确性：{len(CORPUS) - failures}/{len(CORPUS)} 条通过")
+    return failures
+
+# 搜索结果页面：标题为空的结果和一个正常的结果
+SEARCH_RESULTS = """
+<li class="pbw"><h3 class="xs3"><a href="/empty"> </a></h3></li>
+<li class="pbw"><h3 class="xs3"><a href="/fanhua">繁花 第3集 2160P 4.5GB</a></h3></li>
+"""
+
+def check_empty_titles():
+    """空白标题没有匹配键，搜索结果的标题为空时跳过而不是出错，也不会与没有匹配键的订阅误配"""
+    problems = []
+    for title in (None, '', '   ', '\u3000'):
+        if media_parser.normalize_title(title) is not None:
+            problems.append(f"{title!r} 的匹配键: {media_parser.normalize_title(title)!r}")
+    logging.disable(logging.CRITICAL)
+    try:
+        for title_key, expected in ((media_parser.normalize_title('繁花'), ['/fanhua']), (None, [])):
+            try:
+                results = tvshow_downloader.parse_search_results(SEARCH_RESULTS, title_key, '03', [], '2160P', '1080P')
+            except TypeError as e:
+                problems.append(f"订阅匹配键为 {title_key!r} 时出错: {e}")
+                continue
+            if [result['link'] for result in results] != expected:
+                problems.append(f"订阅匹配键为 {title_key!r} 时的结果: {[result['link'] for result in results]}")
+    finally:
+        logging.disable(logging.NOTSET)
+    if problems:
+        print("空白标题：未通过")
+        for problem in problems:
+            print(f"  {problem}")
+    else:
+        print("空白标题：通过")
+    return len(problems)
+
+def benchmark(rounds=200):
+    """分别测量无缓存和命中缓存时的解析速度"""
+    names = [(filename, folder_name) for filename, folder_name, _ in CORPUS]
+    total = len(names) * rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        media_parser.parse_release_name.cache_clear()
+        for filename, folder_name in names:
+            media_parser.extract_info(filename, folder_name)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for filename, folder_name in names:
+            media_parser.extract_info(filename, folder_name)
+    warm = time.perf_counter() - start
+
+    print(f"无缓存：{total / cold:,.0f} 个/秒，平均 {cold / total * 1e6:.1f} 微秒")
+    print(f"有缓存：{total / warm:,.0f} 个/秒，平均 {warm / total * 1e6:.1f} 微秒")
+
+if __name__ == "__main__":
+    failed = check_corpus() + check_empty_titles()
+    benchmark()
+    sys.exit(1 if failed else 0)
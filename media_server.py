@@ -0,0 +1,178 @@
+import os
+import time
+import sqlite3
+import threading
+import requests
+from path_mapping import parse_path_map, map_path
+
+# 变化类型，与 Jellyfin/Emby 的 UpdateType 一致
+CHANGE_CREATED = 'Created'
+CHANGE_DELETED = 'Deleted'
+CHANGE_MODIFIED = 'Modified'
+
+SERVER_TYPES = ('jellyfin', 'emby', 'plex', 'webhook')
+
+class MediaServerNotifier:
+    """媒体库文件变化后通知媒体服务器按路径刷新，避免媒体服务器定期全量扫描。
+
+    sync.py 与 scan_media.py 将变化的路径写入数据库中的待通知队列（同一路径只保留一条），
+    sync.py 的后台线程在一段时间内没有新变化后合并发送，scan_media.py 在每次扫描结束时发送。
+    Jellyfin/Emby 调用 /Library/Media/Updated 接口，Plex 按文件所在目录调用所属媒体库的
+    /library/sections/{id}/refresh?path= 接口，webhook 类型以 JSON 提交到指定地址"""
+
+    def __init__(self, db_path, server_type='none', server_url='', api_key='', path_map='',
+                 debounce_seconds=5, max_delay_seconds=60, batch_size=100):
+        self.db_path = db_path
+        self.server_type = server_type.strip().lower()
+        self.server_url = server_url.rstrip('/')
+        self.api_key = api_key
+        # 本地媒体库路径到媒体服务器中路径的映射
+        self.path_map = parse_path_map(path_map)
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+        self.thread = None
+        if self.enabled:
+            self.create_table()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['database']['db_path'],
+            config.get('mediaserver', 'server_type', fallback='none'),
+            config.get('mediaserver', 'server_url', fallback=''),
+            config.get('mediaserver', 'api_key', fallback=''),
+            config.get('mediaserver', 'path_map', fallback=''),
+            config.getfloat('mediaserver', 'debounce_seconds', fallback=5),
+            config.getfloat('mediaserver', 'max_delay_seconds', fallback=60),
+        )
+
+    @property
+    def enabled(self):
+        return self.server_type in SERVER_TYPES and bool(self.server_url)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def create_table(self):
+        with self.connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS MEDIA_SERVER_OUTBOX (
+                    path TEXT NOT NULL,
+                    change TEXT NOT NULL,
+                    queued_at INTEGER NOT NULL,
+                    PRIMARY KEY (path, change)
+                )
+            ''')
+
+    def queue(self, changes):
+        """将 (路径, 变化类型) 加入待通知队列"""
+        if not self.enabled or not changes:
+            return
+        now = time.time()
+        with self.connect() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO MEDIA_SERVER_OUTBOX (path, change, queued_at) VALUES (?, ?, ?)',
+                [(path, change, now) for path, change in changes]
+            )
+
+    def is_due(self):
+        """最近一次变化后已静默 debounce_seconds，或最早的变化已等待超过 max_delay_seconds"""
+        with self.connect() as conn:
+            oldest, newest = conn.execute('SELECT MIN(queued_at), MAX(queued_at) FROM MEDIA_SERVER_OUTBOX').fetchone()
+        if oldest is None:
+            return False
+        now = time.time()
+        return now - newest >= self.debounce_seconds or now - oldest >= self.max_delay_seconds
+
+    def drain(self):
+        """发送队列中的全部变化，发送成功后从队列删除，返回发送的路径数。发送失败时抛出 requests 异常，队列保留"""
+        if not self.enabled:
+            return 0
+        with self.connect() as conn:
+            changes = conn.execute('SELECT path, change, queued_at FROM MEDIA_SERVER_OUTBOX ORDER BY queued_at').fetchall()
+        sent = 0
+        for start in range(0, len(changes), self.batch_size):
+            batch = changes[start:start + self.batch_size]
+            self.send([(map_path(path, self.path_map), change) for path, change, _ in batch])
+            with self.connect() as conn:
+                # 只删除发送时的记录，发送期间重新加入的变化保留到下一次
+                conn.executemany(
+                    'DELETE FROM MEDIA_SERVER_OUTBOX WHERE path = ? AND change = ? AND queued_at = ?', batch
+                )
+            sent += len(batch)
+        return sent
+
+    def send(self, changes):
+        if self.server_type == 'plex':
+            self.send_plex(changes)
+            return
+        if self.server_type == 'webhook':
+            payload = {'event': 'library.changed', 'changes': [{'path': path, 'type': change} for path, change in changes]}
+            headers = {'Authorization': f"Bearer {self.api_key}"} if self.api_key else {}
+            response = requests.post(self.server_url, json=payload, headers=headers, timeout=10)
+        else:
+            payload = {'Updates': [{'Path': path, 'UpdateType': change} for path, change in changes]}
+            response = requests.post(
+                f"{self.server_url}/Library/Media/Updated",
+                json=payload,
+                headers={'X-Emby-Token': self.api_key},
+                timeout=10
+            )
+        response.raise_for_status()
+
+    def send_plex(self, changes):
+        """Plex 没有按文件通知的接口：按文件所在目录去重，对目录所属的媒体库做局部扫描，新增和删除都会被识别"""
+        headers = {'X-Plex-Token': self.api_key, 'Accept': 'application/json'}
+        response = requests.get(f"{self.server_url}/library/sections", headers=headers, timeout=10)
+        response.raise_for_status()
+        # (媒体库目录, 媒体库 ID)，长路径优先匹配
+        locations = sorted(
+            (
+                (location['path'].rstrip('/'), section['key'])
+                for section in response.json().get('MediaContainer', {}).get('Directory', [])
+                for location in section.get('Location', [])
+            ),
+            key=lambda location: len(location[0]),
+            reverse=True
+        )
+        for directory in dict.fromkeys(os.path.dirname(path) for path, _ in changes):
+            section_key = next(
+                (key for root, key in locations if directory == root or directory.startswith(root + '/')), None
+            )
+            if section_key is None:
+                continue
+            response = requests.get(
+                f"{self.server_url}/library/sections/{section_key}/refresh",
+                params={'path': directory},
+                headers=headers,
+                timeout=10
+            )
+            response.raise_for_status()
+
+    def start(self, on_sent=None, on_error=None):
+        """启动后台线程，每秒检查一次队列，到期后合并发送"""
+        self.thread = threading.Thread(target=self._run, args=(on_sent, on_error), name="media-server-notifier", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self, on_sent, on_error):
+        failures = 0
+        while not self.stop_event.wait(min(60, 2 ** failures)):
+            try:
+                if not self.is_due():
+                    continue
+                sent = self.drain()
+                failures = 0
+                if on_sent:
+                    on_sent(sent)
+            except (requests.RequestException, sqlite3.Error) as e:
+                # 媒体服务器不可用时逐步延长重试间隔
+                failures = min(failures + 1, 6)
+                if on_error:
+                    on_error(e)
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import logging
+import time
+import sqlite3
+import tempfile
+import threading
+import configparser
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from media_server import MediaServerNotifier, CHANGE_CREATED, CHANGE_DELETED
+import scan_media
+
+logging.disable(logging.CRITICAL)
+
+# 模拟 Plex 的媒体库：(ID, 媒体库目录)
+PLEX_SECTIONS = [('1', '/data/movies'), ('2', '/data/tv'), ('3', '/data/tv/anime')]
+
+class FakeMediaServer:
+    """本地模拟的媒体服务器，记录收到的请求，可以指定返回失败的次数"""
+
+    def __init__(self, server_type):
+        self.server_type = server_type
+        self.received = []
+        self.failures = 0
+        self.condition = threading.Condition()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        self.server.shutdown()
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while len(self.received) < count and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return list(self.received)
+
+    def respond(self, handler, method, body=None):
+        url = urlparse(handler.path)
+        with self.condition:
+            failed = self.failures > 0
+            self.failures -= failed
+            if not failed:
+                self.received.append((method, url.path, parse_qs(url.query), dict(handler.headers), body))
+                self.condition.notify_all()
+        if failed:
+            handler.send_response(503)
+            handler.end_headers()
+            return
+        data = b''
+        if self.server_type == 'plex' and url.path == '/library/sections':
+            directories = [{'key': key, 'Location': [{'path': path}]} for key, path in PLEX_SECTIONS]
+            data = json.dumps({'MediaContainer': {'Directory': directories}}).encode()
+        handler.send_response(200)
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.respond(self, 'GET')
+
+            def do_POST(self):
+                fake.respond(self, 'POST', json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0))))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def report(name, problems):
+    if problems:
+        print(f"{name}：未通过")
+        for problem in problems:
+            print(f"  {problem}")
+    else:
+        print(f"{name}：通过")
+    return len(problems)
+
+def outbox(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return sorted(conn.execute('SELECT path, change FROM MEDIA_SERVER_OUTBOX'))
+
+def check_jellyfin_emby(server_type):
+    """Jellyfin/Emby：按批调用 /Library/Media/Updated，携带 API 密钥并映射路径，发送失败时保留队列"""
+    fake = FakeMediaServer(server_type)
+    db_path = os.path.join(tempfile.mkdtemp(), 'media.db')
+    notifier = MediaServerNotifier(db_path, server_type, fake.url, 'secret', '/media:/data', batch_size=2)
+    problems = []
+    try:
+        changes = [
+            ('/media/tv/狂飙 (2023)/Season 1/狂飙 - S01E01.mkv', CHANGE_CREATED),
+            ('/media/tv/狂飙 (2023)/Season 1/狂飙 - S01E02.mkv', CHANGE_CREATED),
+            ('/media/movies/沙丘2 (2024)/沙丘2 - (2024) 2160P.mkv', CHANGE_DELETED),
+        ]
+        notifier.queue(changes)
+        notifier.queue(changes[:1])
+        if notifier.drain() != 3:
+            problems.append("发送的路径数不是 3，同一路径未去重")
+        received = fake.wait_for(2)
+        if len(received) != 2:
+            problems.append(f"3 个路径、每批 2 个应发送 2 次，实际 {len(received)} 次")
+        sent = [(update['Path'], update['UpdateType']) for _, _, _, _, body in received for update in body['Updates']]
+        if sorted(sent) != sorted((path.replace('/media', '/data', 1), change) for path, change in changes):
+            problems.append(f"发送的路径: {sent}")
+        if any(path != '/Library/Media/Updated' or headers.get('X-Emby-Token') != 'secret' for _, path, _, headers, _ in received):
+            problems.append("未调用 /Library/Media/Updated 或缺少 X-Emby-Token")
+        if outbox(db_path):
+            problems.append("发送成功后队列未清空")
+
+        fake.failures = 1
+        notifier.queue(changes[:1])
+        try:
+            notifier.drain()
+            problems.append("媒体服务器返回错误时未抛出异常")
+        except requests.RequestException:
+            pass
+        if outbox(db_path) != [changes[0]]:
+            problems.append("发送失败后队列未保留")
+    finally:
+        fake.stop()
+    return report(f"{server_type.capitalize()} 按路径刷新", problems)
+
+def check_plex():
+    """Plex：按文件所在目录去重，匹配最长的媒体库目录后调用该媒体库的局部扫描接口"""
+    fake = FakeMediaServer('plex')
+    db_path = os.path.join(tempfile.mkdtemp(), 'media.db')
+    notifier = MediaServerNotifier(db_path, 'plex', fake.url, 'plex-token', '/media:/data')
+    problems = []
+    try:
+        notifier.queue([
+            ('/media/tv/狂飙 (2023)/Season 1/狂飙 - S01E01.mkv', CHANGE_CREATED),
+            ('/media/tv/狂飙 (2023)/Season 1/狂飙 - S01E02.mkv', CHANGE_CREATED),
+            ('/media/tv/anime/葬送的芙莉莲 (2023)/Season 1/葬送的芙莉莲 - S01E28.mp4', CHANGE_CREATED),
+            ('/media/movies/沙丘2 (2024)/沙丘2 - (2024) 2160P.mkv', CHANGE_DELETED),
+            ('/media/other/readme.mkv', CHANGE_CREATED),
+        ])
+        notifier.drain()
+        received = fake.wait_for(4)
+        if received[0][1] != '/library/sections':
+            problems.append("未先查询媒体库列表")
+        refreshes = sorted((path, query.get('path', [None])[0]) for _, path, query, _, _ in received[1:])
+        expected = sorted([
+            ('/library/sections/2/refresh', '/data/tv/狂飙 (2023)/Season 1'),
+            ('/library/sections/3/refresh', '/data/tv/anime/葬送的芙莉莲 (2023)/Season 1'),
+            ('/library/sections/1/refresh', '/data/movies/沙丘2 (2024)'),
+        ])
+        if refreshes != expected:
+            problems.append(f"局部扫描请求: {refreshes}")
+        if any(headers.get('X-Plex-Token') != 'plex-token' for _, _, _, headers, _ in received):
+            problems.append("请求缺少 X-Plex-Token")
+    finally:
+        fake.stop()
+    return report("Plex 按目录局部扫描", problems)
+
+def check_debounce():
+    """后台线程在静默 debounce_seconds 后合并发送，持续有变化时最迟 max_delay_seconds 后发送"""
+    fake = FakeMediaServer('jellyfin')
+    db_path = os.path.join(tempfile.mkdtemp(), 'media.db')
+    notifier = MediaServerNotifier(db_path, 'jellyfin', fake.url, 'secret', debounce_seconds=1.5, max_delay_seconds=4)
+    problems = []
+    notifier.start()
+    try:
+        for number in range(1, 4):
+            notifier.queue([(f"/data/tv/繁花 (2023)/Season 1/繁花 - S01E0{number}.mkv", CHANGE_CREATED)])
+            time.sleep(0.5)
+        if fake.received:
+            problems.append("仍有新变化时提前发送")
+        received = fake.wait_for(1)
+        if len(received) != 1 or len(received[0][4]['Updates']) != 3:
+            problems.append(f"静默后应合并为 1 次发送，实际 {[len(body['Updates']) for *_, body in received]}")
+
+        # 每秒都有新变化，不会静默，由最长延迟触发发送
+        started = time.monotonic()
+        for number in range(1, 7):
+            notifier.queue([(f"/data/tv/三体 (2023)/Season 1/三体 - S01E0{number}.mkv", CHANGE_CREATED)])
+            time.sleep(1)
+            if len(fake.received) > 1:
+                break
+        if len(fake.wait_for(2)) != 2 or time.monotonic() - started > 6:
+            problems.append("持续有变化时未在最长延迟后发送")
+    finally:
+        notifier.stop()
+        fake.stop()
+    return report("合并与延迟发送", problems)
+
+def check_scan_media_drain():
+    """scan_media.py 将新增和删除的文件加入待通知队列并在扫描结束时发送，发送失败时保留队列"""
+    fake = FakeMediaServer('jellyfin')
+    db_path = os.path.join(tempfile.mkdtemp(), 'media.db')
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'database': {'db_path': db_path},
+        'mediaserver': {'server_type': 'jellyfin', 'server_url': fake.url, 'api_key': 'secret'},
+    })
+    problems = []
+    try:
+        kept = '/data/movies/奥本海默 (2023)/奥本海默 - (2023) 1080P.mp4'
+        removed = '/data/movies/满江红 (2023)/满江红 - (2023) 2160P.mkv'
+        added = '/data/tv/长相思 (2024)/Season 1/长相思 - S01E39.mkv'
+        scan_media.notify_media_server(config, db_path, {kept, removed})
+        if fake.received or outbox(db_path):
+            problems.append("首次扫描不应通知")
+
+        # 媒体服务器不可用时变化保留在队列中，不影响扫描
+        fake.failures = 1
+        scan_media.notify_media_server(config, db_path, {kept, added})
+        expected = sorted([(added, CHANGE_CREATED), (removed, CHANGE_DELETED)])
+        if outbox(db_path) != expected:
+            problems.append(f"发送失败后的待通知队列: {outbox(db_path)}")
+
+        # 下一次扫描没有新变化，也会发送之前积压的变化
+        scan_media.notify_media_server(config, db_path, {kept, added})
+        received = fake.wait_for(1)
+        sent = sorted((update['Path'], update['UpdateType']) for *_, body in received for update in body['Updates'])
+        if len(received) != 1 or sent != expected:
+            problems.append(f"扫描结束时发送的路径: {sent}")
+        if outbox(db_path):
+            problems.append("发送成功后队列未清空")
+    finally:
+        fake.stop()
+    return report("scan_media.py 扫描结束时发送", problems)
+
+if __name__ == "__main__":
+    failed = (check_jellyfin_emby('jellyfin') + check_jellyfin_emby('emby') + check_plex()
+              + check_debounce() + check_scan_media_drain())
+    sys.exit(1 if failed else 0)
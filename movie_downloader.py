@@ -7,6 +7,7 @@ import requests
 from typing import List
 from urllib.parse import urljoin, urlparse, unquote, urlencode, parse_qs
 from bs4 import BeautifulSoup
+from media_parser import normalize_title
 import configparser
 
 # 配置日志功能
@@ -65,15 +66,16 @@ class MovieInfoExtractor:
             with sqlite3.connect(self.db_path, isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
                 conn.text_factory = str  # 确保返回的是 Unicode 字符串
                 cursor = conn.cursor()
-                cursor.execute('SELECT title, year FROM MISS_MOVIES')
+                cursor.execute('SELECT title, year, title_key FROM MISS_MOVIES')
                 movies = cursor.fetchall()
 
-                for title, year in movies:
+                for title, year, title_key in movies:
                     # 添加调试信息，打印出读取到的每一行数据
                     logger.debug(f"读取到的电影信息: 标题={title}, 年份={year}")
                     all_movie_info.append({
                         "标题": title,
-                        "年份": year
+                        "年份": year,
+                        "title_key": title_key or normalize_title(title)
                     })
 
             logger.info("读取订阅电影信息完成")
@@ -243,8 +245,8 @@ def parse_file_size(size_str: str) -> float:
         return size
     return None
 
-def parse_search_results(html_content, title, year, exclude_keywords, preferred_resolution, fallback_resolution):
-    """解析搜索结果，并根据标题、年份及分辨率情况进行匹配，返回所有符合条件的链接"""
+def parse_search_results(html_content, title_key, year, exclude_keywords, preferred_resolution, fallback_resolution):
+    """解析搜索结果，并根据标题匹配键、年份及分辨率情况进行匹配，返回所有符合条件的链接"""
     try:
         soup = BeautifulSoup(html_content, 'html.parser')
         results = []
@@ -262,7 +264,9 @@ def parse_search_results(html_content, title, year, exclude_keywords, preferred_
             if year and str(year) not in result_title:
                 continue
             
-            if title.lower() not in result_title.lower() or should_exclude(result_title, exclude_keywords):
+            # 订阅或结果标题为空时没有匹配键，不能当作匹配
+            result_key = normalize_title(result_title)
+            if not title_key or not result_key or title_key not in result_key or should_exclude(result_title, exclude_keywords):
                 continue
             
             results.append({
@@ -371,7 +375,7 @@ def search_and_download_movie(movie_info, formhash):
         logger.error(f"搜索 {keyword} 失败")
         return
     
-    search_results = parse_search_results(html_content, title, year, exclude_keywords, preferred_resolution, fallback_resolution)
+    search_results = parse_search_results(html_content, movie_info.get("title_key"), year, exclude_keywords, preferred_resolution, fallback_resolution)
     if not search_results:
         logger.info(f" {keyword} ：没有找到匹配的资源")
         return
@@ -0,0 +1,14 @@
+def parse_path_map(value):
+    """解析“源路径:目标路径”形式的路径映射，多个映射用逗号分隔，长路径优先匹配"""
+    mappings = []
+    for item in value.split(','):
+        source, separator, target = item.strip().partition(':')
+        if separator and source and target:
+            mappings.append((source.rstrip('/'), target.rstrip('/')))
+    return sorted(mappings, key=lambda mapping: len(mapping[0]), reverse=True)
+
+def map_path(file_path, mappings):
+    for source, target in mappings:
+        if file_path == source or file_path.startswith(source + '/'):
+            return target + file_path[len(source):]
+    return file_path
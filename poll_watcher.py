@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import threading
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileDeletedEvent, FileMovedEvent
+
+# 不支持 inotify 的网络或用户态文件系统
+NETWORK_FILESYSTEMS = {
+    'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'ceph', 'glusterfs', 'davfs',
+    'fuse.sshfs', 'fuse.rclone', 'fuse.s3fs', 'fuse.glusterfs',
+}
+
+# /proc/mounts 中挂载点的空格等字符以八进制转义，如 \040
+MOUNT_ESCAPE_RE = re.compile(r'\\([0-7]{3})')
+
+def mount_type(path):
+    """从 /proc/mounts 中查找路径所在挂载点的文件系统类型，无法判断时返回 None"""
+    path = os.path.realpath(path)
+    best_point, best_type = '', None
+    try:
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                point = MOUNT_ESCAPE_RE.sub(lambda match: chr(int(match.group(1), 8)), fields[1])
+                prefix = point.rstrip('/') + '/'
+                if (path == point or path.startswith(prefix)) and len(point) > len(best_point):
+                    best_point, best_type = point, fields[2]
+    except OSError:
+        return None
+    return best_type
+
+def needs_polling(path):
+    return mount_type(path) in NETWORK_FILESYSTEMS
+
+class PollingWatcher:
+    """轮询方式的目录监控，用于 inotify 收不到事件的 SMB/NFS 挂载目录。
+
+    内存中只保存每个目录的修改时间和其中文件的 (inode, 大小, 修改时间)。目录修改时间
+    不变说明没有文件增删或改名，只需 stat 目录本身，不再列出其内容；文件内容的变化通过
+    最近变化过的文件（热点文件）单独 stat 检测，并定期完整扫描一次兜底。没有变化时
+    轮询间隔逐步加倍到 max_interval，检测到变化后恢复为 min_interval。
+    接口与 watchdog 的 Observer 一致，事件交给同一个 FileSystemEventHandler 处理。"""
+
+    def __init__(self, min_interval=2, max_interval=30, full_scan_interval=600, hot_seconds=600, file_filter=None):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.full_scan_interval = full_scan_interval
+        self.hot_seconds = hot_seconds
+        self.file_filter = file_filter or (lambda name: True)
+        # 监控根目录 -> {'handler', 'dirs': 目录 -> (修改时间, {文件名: (inode, 大小, 修改时间)}, 子目录), 'hot': 文件 -> 最近变化时间}
+        self.roots = {}
+        self.interval = min_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def schedule(self, event_handler, path, recursive=True):
+        self.roots[path] = {'handler': event_handler, 'dirs': {}, 'hot': {}}
+
+    def start(self):
+        # 建立初始快照，已存在的文件由启动核对处理，不产生事件
+        for root, state in self.roots.items():
+            self._scan(root, state, full=True, initial=True)
+        self.thread = threading.Thread(target=self._run, name="polling-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def _run(self):
+        last_full_scan = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            full = time.monotonic() - last_full_scan >= self.full_scan_interval
+            if full:
+                last_full_scan = time.monotonic()
+            changes = 0
+            for root, state in self.roots.items():
+                events = self._scan(root, state, full)
+                for event in events:
+                    state['handler'].dispatch(event)
+                changes += len(events)
+            self.interval = self.min_interval if changes else min(self.max_interval, self.interval * 2)
+
+    def _scan(self, root, state, full=False, initial=False):
+        """扫描一次目录树，返回与上次快照相比产生的事件"""
+        dirs, hot = state['dirs'], state['hot']
+        now = time.monotonic()
+        created, deleted, modified = {}, {}, []
+        seen, listed = set(), set()
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                dir_mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(directory)
+            previous = dirs.get(directory)
+            if previous and previous[0] == dir_mtime and not full:
+                stack.extend(previous[2])
+                continue
+            files, subdirs = {}, []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            elif entry.is_file() and self.file_filter(entry.name):
+                                stat = entry.stat()
+                                files[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            listed.add(directory)
+            old_files = previous[1] if previous else {}
+            for name, info in files.items():
+                file_path = os.path.join(directory, name)
+                old_info = old_files.get(name)
+                if old_info is None:
+                    created[file_path] = info
+                elif old_info != info:
+                    modified.append(file_path)
+                    hot[file_path] = now
+            for name in old_files.keys() - files.keys():
+                deleted[os.path.join(directory, name)] = old_files[name]
+            dirs[directory] = (dir_mtime, files, tuple(subdirs))
+            stack.extend(subdirs)
+
+        # 已删除的目录
+        for directory in dirs.keys() - seen:
+            for name, info in dirs.pop(directory)[1].items():
+                deleted[os.path.join(directory, name)] = info
+
+        # 目录未变化时，单独检查最近变化过的文件是否仍在写入
+        for file_path, changed_at in list(hot.items()):
+            directory, name = os.path.split(file_path)
+            if directory in listed:
+                continue
+            entry = dirs.get(directory)
+            if entry is None or name not in entry[1]:
+                hot.pop(file_path, None)
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            info = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if info != entry[1][name]:
+                entry[1][name] = info
+                modified.append(file_path)
+                hot[file_path] = now
+            elif now - changed_at > self.hot_seconds:
+                hot.pop(file_path, None)
+
+        if initial:
+            return []
+        events = []
+        # 同一 inode 从一个路径消失又出现在另一个路径，视为改名
+        moved_from = {(info[0], info[1]): file_path for file_path, info in deleted.items()}
+        for file_path, info in created.items():
+            src_path = moved_from.pop((info[0], info[1]), None)
+            if src_path:
+                deleted.pop(src_path)
+                events.append(FileMovedEvent(src_path, file_path))
+            else:
+                events.append(FileCreatedEvent(file_path))
+            hot[file_path] = now
+        for file_path in deleted:
+            hot.pop(file_path, None)
+            events.append(FileDeletedEvent(file_path))
+        events.extend(FileModifiedEvent(file_path) for file_path in modified)
+        return events
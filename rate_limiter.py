@@ -0,0 +1,100 @@
+import time
+import threading
+from urllib.parse import urlparse
+
+# 豆瓣要求验证码或提示异常请求时返回的页面特征
+CAPTCHA_MARKERS = ('sec.douban.com', 'misc/sorry', '检测到有异常请求', 'captcha')
+
+def parse_rate_limits(value):
+    """解析“主机:请求数/秒数”形式的限速设置，多个主机用逗号分隔，如 movie.douban.com:20/60"""
+    limits = {}
+    for item in value.split(','):
+        host, separator, rate = item.strip().partition(':')
+        count, slash, seconds = rate.partition('/')
+        try:
+            if separator and slash and float(count) > 0 and float(seconds) > 0:
+                limits[host.strip().lower()] = (float(count), float(seconds))
+        except ValueError:
+            continue
+    return limits
+
+def is_blocked(response):
+    """请求被限制：403/429，或被重定向到验证码页面"""
+    if response.status_code in (403, 429):
+        return True
+    if 'json' in response.headers.get('Content-Type', ''):
+        return False
+    if any(marker in response.url for marker in CAPTCHA_MARKERS):
+        return True
+    return any(marker in response.text[:4096] for marker in CAPTCHA_MARKERS)
+
+class RateLimitedError(Exception):
+    """请求被限制，且需要等待的时间超过允许的最长等待时间"""
+
+class HostBucket:
+    def __init__(self, count, seconds):
+        self.rate = count / seconds
+        self.capacity = max(1.0, count)
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        # 被限制后速率除以 slowdown，并在 blocked_until 之前暂停请求
+        self.slowdown = 1
+        self.blocked_until = 0
+
+    def refill(self, now):
+        rate = self.rate / self.slowdown
+        self.tokens = min(max(1.0, self.capacity / self.slowdown), self.tokens + (now - self.last) * rate)
+        self.last = now
+
+class RateLimiter:
+    """按主机区分的令牌桶限速，多个线程共享。
+
+    正常响应时按配置的速率请求，并逐步恢复被降低的速率；遇到 403/429 或验证码页面时
+    暂停一段时间（优先使用 Retry-After），暂停时间和速率降低倍数随连续被限制的次数加倍"""
+
+    def __init__(self, limits=None, default=(20, 60), backoff_seconds=60, max_backoff_seconds=1800):
+        self.limits = limits or {}
+        self.default = default
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlparse(url).hostname or ''
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = HostBucket(*self.limits.get(host, self.default))
+        return bucket
+
+    def acquire(self, url, max_wait=None):
+        """等待到可以请求 url，等待时间会超过 max_wait 秒时不等待，返回 False"""
+        while True:
+            with self.lock:
+                bucket = self.bucket(url)
+                now = time.monotonic()
+                bucket.refill(now)
+                wait = max(0, bucket.blocked_until - now)
+                if not wait and bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    return True
+                if not wait:
+                    wait = (1 - bucket.tokens) * bucket.slowdown / bucket.rate
+            if max_wait is not None and wait > max_wait:
+                return False
+            time.sleep(wait)
+
+    def report(self, url, response):
+        """根据响应调整速率，请求被限制时返回 True"""
+        blocked = is_blocked(response)
+        with self.lock:
+            bucket = self.bucket(url)
+            if blocked:
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff_seconds * bucket.slowdown
+                bucket.blocked_until = time.monotonic() + min(delay, self.max_backoff_seconds)
+                bucket.slowdown = min(bucket.slowdown * 2, 32)
+                bucket.tokens = 0
+            elif bucket.slowdown > 1:
+                bucket.slowdown //= 2
+        return blocked
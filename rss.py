@@ -1,12 +1,17 @@
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
 from urllib.parse import urlparse, parse_qs
 import time
-import random
 import sqlite3
 import logging
 import re
 import configparser
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from rate_limiter import RateLimiter, RateLimitedError, parse_rate_limits
+from tmdb_id import query_tmdb_api, query_tmdb_season, create_tmdb_tables
+from media_parser import add_title_key
 
 # 设置日志配置
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s', encoding='utf-8')
@@ -31,11 +36,29 @@ def chinese_to_int(chinese_num):
     else:
         raise ValueError(f"无法解析中文数字: {chinese_num}")
 
+# RSS 未发生变化（服务器返回 304）
+RSS_NOT_MODIFIED = object()
+
+# 豆瓣搜索结果中没有该豆瓣ID
+SUBJECT_NOT_FOUND = object()
+
+SUBJECT_FIELDS = ('title', 'douban_id', 'episode', 'year', 'img', 'url', 'sub_title', 'media_type', 'season')
+
+def parse_pub_date(value):
+    """将 RSS 的 pubDate 转换为时间戳，无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
 class DouBanRSSParser:
     def __init__(self, config_path):
         self.config = self.read_config(config_path)
         self.cookie = self.config['douban']['cookie']
-        self.rss_url = self.config['douban']['rss_url']
+        # 多个豆瓣用户的订阅URL用逗号分隔
+        self.rss_urls = [url.strip() for url in self.config['douban']['rss_url'].split(',') if url.strip()]
         self.db_path = self.config['database']['db_path']
         self.pcheaders = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/105.0.0.0 Safari/537.36 Edg/105.0.1343.27",
@@ -43,6 +66,19 @@ class DouBanRSSParser:
             "Cookie": self.cookie,
             "Connection": "keep-alive",
         }
+        # 所有豆瓣请求共享的按主机限速，被限制后需要等待超过 max_block_wait 秒时停止本次运行的剩余请求
+        self.rate_limiter = RateLimiter(parse_rate_limits(self.config.get('douban', 'rate_limits', fallback='')))
+        self.max_block_wait = self.config.getfloat('douban', 'max_block_wait', fallback=300)
+        # 豆瓣条目详情缓存有效期，未找到的条目在 miss_cache_days 内不再重复查询
+        self.subject_cache_seconds = self.config.getfloat('douban', 'subject_cache_days', fallback=30) * 86400
+        self.miss_cache_seconds = self.config.getfloat('douban', 'miss_cache_days', fallback=7) * 86400
+        # 尚未播完的季每隔 schedule_refresh_hours 小时重新获取一次播出日期
+        self.schedule_refresh_seconds = self.config.getfloat('tmdb', 'schedule_refresh_hours', fallback=24) * 3600
+        # 所有请求共用一个保持连接的会话，连接池大小足够同时获取全部订阅
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(4, len(self.rss_urls)))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.db_connection = sqlite3.connect(self.db_path)
         self.create_tables()
 
@@ -89,24 +125,170 @@ class DouBanRSSParser:
                 )
             ''')
             logging.info("RSS_TVS表已创建")
+
+        # 标题匹配键，用于与媒体库中的标题匹配
+        add_title_key(cursor, 'RSS_MOVIES')
+        add_title_key(cursor, 'RSS_TVS')
+
+        # 按豆瓣ID缓存条目详情，found 为 0 表示豆瓣搜索结果中没有该ID
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS DOUBAN_SUBJECTS (
+                douban_id TEXT PRIMARY KEY,
+                rss_title TEXT,
+                title TEXT,
+                media_type TEXT,
+                season INTEGER,
+                episode TEXT,
+                year TEXT,
+                img TEXT,
+                url TEXT,
+                sub_title TEXT,
+                found INTEGER NOT NULL,
+                fetched_at INTEGER NOT NULL
+            )
+        ''')
+
+        # 记录RSS的缓存校验信息和已处理到的位置
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS RSS_FEED_STATE (
+                rss_url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                last_guid TEXT,
+                last_pub_date INTEGER,
+                updated_at INTEGER
+            )
+        ''')
+
+        # 豆瓣ID与TMDB ID的对应表、电视剧播出日期表，与 check_rss.py 共用
+        create_tmdb_tables(cursor)
+
+        # 每次同步的新增、更新、删除数量，供后续处理参考
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS RSS_SYNC_LOG (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                synced_at INTEGER NOT NULL,
+                inserted INTEGER NOT NULL,
+                updated INTEGER NOT NULL,
+                removed INTEGER NOT NULL
+            )
+        ''')
+
+        # 每个订阅中当前包含的豆瓣ID，用于记录条目来自哪些用户的订阅
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS RSS_FEED_ITEMS (
+                rss_url TEXT NOT NULL,
+                douban_id TEXT NOT NULL,
+                title TEXT,
+                guid TEXT,
+                pub_date INTEGER,
+                PRIMARY KEY (rss_url, douban_id)
+            )
+        ''')
         
         self.db_connection.commit()
 
-    def fetch_rss_data(self):
+    def load_feed_state(self, rss_url):
+        row = self.db_connection.execute(
+            'SELECT etag, last_modified, last_guid, last_pub_date FROM RSS_FEED_STATE WHERE rss_url = ?', (rss_url,)
+        ).fetchone()
+        return row or (None, None, None, None)
+
+    def save_feed_state(self, rss_url, validators, last_guid, last_pub_date):
+        etag, last_modified = validators
+        self.db_connection.execute('''
+            INSERT INTO RSS_FEED_STATE (rss_url, etag, last_modified, last_guid, last_pub_date, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(rss_url) DO UPDATE SET
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                last_guid = excluded.last_guid,
+                last_pub_date = excluded.last_pub_date,
+                updated_at = excluded.updated_at
+        ''', (rss_url, etag, last_modified, last_guid, last_pub_date, int(time.time())))
+        self.db_connection.commit()
+
+    def load_subject(self, douban_id):
+        """返回缓存中未过期的条目：详情字典、SUBJECT_NOT_FOUND，没有缓存或已过期时返回 None"""
+        row = self.db_connection.execute(
+            f"SELECT found, fetched_at, {', '.join(SUBJECT_FIELDS)} FROM DOUBAN_SUBJECTS WHERE douban_id = ?", (douban_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        found, fetched_at = row[0], row[1]
+        ttl = self.subject_cache_seconds if found else self.miss_cache_seconds
+        if time.time() - fetched_at > ttl:
+            return None
+        return dict(zip(SUBJECT_FIELDS, row[2:])) if found else SUBJECT_NOT_FOUND
+
+    def save_subject(self, douban_id, rss_title, details):
+        if details is SUBJECT_NOT_FOUND:
+            values = (douban_id, rss_title, rss_title) + (None,) * 7 + (0, int(time.time()))
+        else:
+            values = (douban_id, rss_title, details['title'], details['media_type'], details['season'], details['episode'],
+                      details['year'], details['img'], details['url'], details['sub_title'], 1, int(time.time()))
+        self.db_connection.execute('''
+            INSERT OR REPLACE INTO DOUBAN_SUBJECTS
+                (douban_id, rss_title, title, media_type, season, episode, year, img, url, sub_title, found, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', values)
+        self.db_connection.commit()
+
+    def expired_misses(self):
+        """未找到且缓存已过期、需要重新查询的豆瓣ID"""
+        rows = self.db_connection.execute(
+            'SELECT douban_id FROM DOUBAN_SUBJECTS WHERE found = 0 AND fetched_at < ?',
+            (int(time.time() - self.miss_cache_seconds),)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_subject_details(self, title, douban_id):
+        """优先使用缓存的条目详情，没有缓存时查询豆瓣并缓存结果（请求失败的结果不缓存）"""
+        details = self.load_subject(douban_id)
+        if details is SUBJECT_NOT_FOUND:
+            logging.info(f"豆瓣ID {douban_id} 近期未找到详细信息，跳过查询")
+            return details
+        if details:
+            logging.info(f"使用缓存的豆瓣ID {douban_id} 详细信息")
+            return details
+        details = self.fetch_movie_details(title, douban_id)
+        if details:
+            self.save_subject(douban_id, title, details)
+        return details
+
+    def douban_get(self, url, **kwargs):
+        """经过限速的豆瓣请求，被限制时抛出 RateLimitedError"""
+        if not self.rate_limiter.acquire(url, self.max_block_wait):
+            raise RateLimitedError(f"豆瓣限制访问，需要等待超过 {self.max_block_wait:.0f} 秒")
+        response = self.session.get(url, **kwargs)
+        if self.rate_limiter.report(url, response):
+            raise RateLimitedError(f"豆瓣限制访问，状态码: {response.status_code}")
+        return response
+
+    def fetch_rss_data(self, rss_url, etag=None, last_modified=None):
+        """获取订阅内容，返回 (内容, (ETag, Last-Modified))，在多个线程中同时调用，不访问数据库"""
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
         }
+        # 带上次的 ETag/Last-Modified 发起条件请求，RSS 未变化时服务器只返回 304
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
         try:
-            response = requests.get(self.rss_url, headers=headers, timeout=10)
+            response = self.douban_get(rss_url, headers=headers, timeout=10)
+            if response.status_code == 304:
+                logging.info(f"RSS数据未发生变化: {rss_url}")
+                return RSS_NOT_MODIFIED, (etag, last_modified)
             if response.status_code == 200:
-                logging.info("成功获取RSS数据")
-                return response.text
+                logging.info(f"成功获取RSS数据: {rss_url}")
+                return response.text, (response.headers.get('ETag'), response.headers.get('Last-Modified'))
             else:
-                logging.error(f"获取RSS数据失败，状态码: {response.status_code}")
-                return None
-        except requests.RequestException as e:
+                logging.error(f"获取RSS数据失败，状态码: {response.status_code}: {rss_url}")
+                return None, None
+        except (requests.RequestException, RateLimitedError) as e:
             logging.error(f"请求RSS数据时发生错误: {e}")
-            return None
+            return None, None
 
     def parse_rss_data(self, rss_data):
         if not rss_data:
@@ -119,6 +301,8 @@ class DouBanRSSParser:
             for item in items:
                 title = item.find('title').text
                 link = item.find('link').text
+                guid = item.findtext('guid') or link
+                pub_date = parse_pub_date(item.findtext('pubDate'))
                 
                 # 提取豆瓣ID
                 parsed_url = urlparse(link)
@@ -131,25 +315,50 @@ class DouBanRSSParser:
                 # 移除标题开头的“想看”（如果有的话）
                 title = title.replace('想看', '', 1) if title.startswith('想看') else title
 
-                parsed_items.append((title, douban_id))
+                parsed_items.append((title, douban_id, guid, pub_date))
             logging.info("成功解析RSS数据")
             return parsed_items
         except ET.ParseError as e:
             logging.error(f"解析RSS数据时发生错误: {e}")
             return []
 
-    def fetch_existing_douban_ids(self):
+    def pending_douban_ids(self, douban_ids):
+        """返回 RSS_MOVIES 和 RSS_TVS 中都还没有的豆瓣ID"""
         cursor = self.db_connection.cursor()
-        cursor.execute('SELECT douban_id FROM RSS_MOVIES')
-        existing_movie_ids = {row[0] for row in cursor.fetchall()}
-        cursor.execute('SELECT douban_id FROM RSS_TVS')
-        existing_tv_ids = {row[0] for row in cursor.fetchall()}
-        return existing_movie_ids.union(existing_tv_ids)
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS RSS_CANDIDATES (douban_id TEXT PRIMARY KEY)')
+        cursor.execute('DELETE FROM RSS_CANDIDATES')
+        cursor.executemany('INSERT OR IGNORE INTO RSS_CANDIDATES (douban_id) VALUES (?)', [(douban_id,) for douban_id in douban_ids])
+        rows = cursor.execute('''
+            SELECT douban_id FROM RSS_CANDIDATES AS c
+            WHERE NOT EXISTS (SELECT 1 FROM RSS_MOVIES AS m WHERE m.douban_id = c.douban_id)
+              AND NOT EXISTS (SELECT 1 FROM RSS_TVS AS t WHERE t.douban_id = c.douban_id)
+        ''').fetchall()
+        self.db_connection.commit()
+        return {row[0] for row in rows}
+
+    def unfinished_items(self, rss_url):
+        """订阅上次记录的条目中有既不在 RSS_MOVIES、RSS_TVS 中，也没有在缓存有效期内被缓存为未找到的项目时
+        （包括未找到缓存已过期、需要重新查询的项目），返回记录的全部条目"""
+        unfinished = self.db_connection.execute('''
+            SELECT 1 FROM RSS_FEED_ITEMS AS f
+            WHERE f.rss_url = ?
+              AND NOT EXISTS (SELECT 1 FROM RSS_MOVIES AS m WHERE m.douban_id = f.douban_id)
+              AND NOT EXISTS (SELECT 1 FROM RSS_TVS AS t WHERE t.douban_id = f.douban_id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM DOUBAN_SUBJECTS AS s WHERE s.douban_id = f.douban_id AND s.found = 0 AND s.fetched_at >= ?
+              )
+            LIMIT 1
+        ''', (rss_url, int(time.time() - self.miss_cache_seconds))).fetchone()
+        if not unfinished:
+            return []
+        return self.db_connection.execute(
+            'SELECT title, douban_id, guid, pub_date FROM RSS_FEED_ITEMS WHERE rss_url = ?', (rss_url,)
+        ).fetchall()
 
     def fetch_movie_details(self, title, douban_id):
         api_url = f'https://movie.douban.com/j/subject_suggest?q={title}'
         try:
-            response = requests.get(api_url, headers=self.pcheaders, timeout=10)
+            response = self.douban_get(api_url, headers=self.pcheaders, timeout=10)
             if response.status_code == 200:
                 api_data = response.json()
                 if api_data:
@@ -195,10 +404,10 @@ class DouBanRSSParser:
                                 'season': season
                             }
                     logging.warning(f"未找到豆瓣ID为 {douban_id} 的信息")
-                    return None
+                    return SUBJECT_NOT_FOUND
                 else:
                     logging.warning(f"未找到标题为 {title} 的信息")
-                    return None
+                    return SUBJECT_NOT_FOUND
             else:
                 logging.error(f"获取标题为 {title} 的详细信息失败，状态码: {response.status_code}")
                 return None
@@ -206,84 +415,274 @@ class DouBanRSSParser:
             logging.error(f"请求豆瓣API时发生错误: {e}")
             return None
 
-    def insert_into_db(self, movie_details):
-        cursor = self.db_connection.cursor()
-        table_name = 'RSS_MOVIES' if movie_details['media_type'] == '电影' else 'RSS_TVS'
-        
-        try:
-            if movie_details['media_type'] == '电影':
-                cursor.execute('''
-                    INSERT INTO RSS_MOVIES (title, douban_id, episode, year, img, url, sub_title)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (movie_details['title'], movie_details['douban_id'], movie_details['episode'], movie_details['year'], movie_details['img'], movie_details['url'], movie_details['sub_title']))
-            elif movie_details['media_type'] == '电视剧':
-                cursor.execute('''
-                    INSERT INTO RSS_TVS (title, douban_id, episode, year, img, url, sub_title, season)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (movie_details['title'], movie_details['douban_id'], movie_details['episode'], movie_details['year'], movie_details['img'], movie_details['url'], movie_details['sub_title'], movie_details['season']))
-            self.db_connection.commit()
-            logging.info(f"成功插入 {movie_details['title']} 到数据库")
-            logging.info("-" * 80)
-        except sqlite3.IntegrityError:
-            logging.warning(f"已存在相同的豆瓣ID {movie_details['douban_id']}，跳过插入")
-        except sqlite3.Error as e:
-            logging.error(f"插入数据库时发生错误: {e}")
+    def apply_changes(self, feeds, resolved, complete):
+        """在一个事务中写入订阅条目、新增或更新查询到的项目、删除不在任何订阅中的项目，返回各自的数量。
 
-    def delete_old_data(self, existing_douban_ids, new_douban_ids):
-        cursor = self.db_connection.cursor()
-        old_douban_ids = existing_douban_ids - new_douban_ids
-        for douban_id in old_douban_ids:
-            cursor.execute('DELETE FROM RSS_MOVIES WHERE douban_id = ?', (douban_id,))
-            cursor.execute('DELETE FROM RSS_TVS WHERE douban_id = ?', (douban_id,))
-        self.db_connection.commit()
-        if old_douban_ids:
-            logging.info(f"删除过时的数据: {old_douban_ids}")
-        else:
-            logging.info("没有过时的数据需要删除")
+        查询到的项目先写入临时表，再用集合操作与 RSS_MOVIES、RSS_TVS 比较；complete 为 False
+        （有订阅获取失败）时不删除"""
+        placeholders = ', '.join('?' * len(self.rss_urls))
+        with self.db_connection:
+            cursor = self.db_connection.cursor()
+            cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS RSS_STAGE (
+                    douban_id TEXT PRIMARY KEY,
+                    media_type TEXT,
+                    title TEXT,
+                    season INTEGER,
+                    episode TEXT,
+                    year TEXT,
+                    img TEXT,
+                    url TEXT,
+                    sub_title TEXT
+                )
+            ''')
+            cursor.execute('DELETE FROM RSS_STAGE')
+            cursor.executemany(
+                'INSERT OR REPLACE INTO RSS_STAGE (douban_id, media_type, title, season, episode, year, img, url, sub_title) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(d['douban_id'], d['media_type'], d['title'], d['season'], d['episode'], d['year'], d['img'], d['url'], d['sub_title'])
+                 for d in resolved]
+            )
+
+            # 有更新的订阅替换其条目记录，并清理已不在配置中的订阅
+            cursor.executemany('DELETE FROM RSS_FEED_ITEMS WHERE rss_url = ?', [(rss_url,) for rss_url in feeds])
+            cursor.executemany(
+                'INSERT OR REPLACE INTO RSS_FEED_ITEMS (rss_url, douban_id, title, guid, pub_date) VALUES (?, ?, ?, ?, ?)',
+                [(rss_url, douban_id, title, guid, pub_date)
+                 for rss_url, (items, _) in feeds.items() for title, douban_id, guid, pub_date in items]
+            )
+            cursor.execute(f"DELETE FROM RSS_FEED_ITEMS WHERE rss_url NOT IN ({placeholders})", self.rss_urls)
+
+            inserted = cursor.execute('''
+                SELECT COUNT(*) FROM RSS_STAGE AS s
+                WHERE NOT EXISTS (SELECT 1 FROM RSS_MOVIES AS m WHERE m.douban_id = s.douban_id AND s.media_type = '电影')
+                  AND NOT EXISTS (SELECT 1 FROM RSS_TVS AS t WHERE t.douban_id = s.douban_id AND s.media_type = '电视剧')
+            ''').fetchone()[0]
+
+            # 类型发生变化的项目从原来的表中删除
+            cursor.execute("DELETE FROM RSS_TVS WHERE douban_id IN (SELECT douban_id FROM RSS_STAGE WHERE media_type = '电影')")
+            cursor.execute("DELETE FROM RSS_MOVIES WHERE douban_id IN (SELECT douban_id FROM RSS_STAGE WHERE media_type = '电视剧')")
+
+            # 只更新内容有变化的行，rowcount 为新增与更新的行数之和
+            changed = cursor.execute('''
+                INSERT INTO RSS_MOVIES (title, douban_id, episode, year, img, url, sub_title, title_key)
+                SELECT title, douban_id, episode, year, img, url, sub_title, normalize_title(title) FROM RSS_STAGE WHERE media_type = '电影'
+                ON CONFLICT(douban_id) DO UPDATE SET
+                    title = excluded.title, title_key = excluded.title_key, episode = excluded.episode, year = excluded.year,
+                    img = excluded.img, url = excluded.url, sub_title = excluded.sub_title
+                WHERE (title, episode, year, img, url, sub_title)
+                    IS NOT (excluded.title, excluded.episode, excluded.year, excluded.img, excluded.url, excluded.sub_title)
+            ''').rowcount
+            changed += cursor.execute('''
+                INSERT INTO RSS_TVS (title, douban_id, episode, year, img, url, sub_title, season, title_key)
+                SELECT title, douban_id, episode, year, img, url, sub_title, season, normalize_title(title) FROM RSS_STAGE WHERE media_type = '电视剧'
+                ON CONFLICT(douban_id) DO UPDATE SET
+                    title = excluded.title, title_key = excluded.title_key, episode = excluded.episode, year = excluded.year,
+                    img = excluded.img, url = excluded.url, sub_title = excluded.sub_title, season = excluded.season
+                WHERE (title, episode, year, img, url, sub_title, season)
+                    IS NOT (excluded.title, excluded.episode, excluded.year, excluded.img, excluded.url, excluded.sub_title, excluded.season)
+            ''').rowcount
+
+            removed = 0
+            if complete:
+                current = f"SELECT douban_id FROM RSS_FEED_ITEMS WHERE rss_url IN ({placeholders})"
+                removed += cursor.execute(f"DELETE FROM RSS_MOVIES WHERE douban_id NOT IN ({current})", self.rss_urls).rowcount
+                removed += cursor.execute(f"DELETE FROM RSS_TVS WHERE douban_id NOT IN ({current})", self.rss_urls).rowcount
+
+            counts = {'inserted': inserted, 'updated': changed - inserted, 'removed': removed}
+            cursor.execute(
+                'INSERT INTO RSS_SYNC_LOG (synced_at, inserted, updated, removed) VALUES (?, ?, ?, ?)',
+                (int(time.time()), counts['inserted'], counts['updated'], counts['removed'])
+            )
+            cursor.execute('DELETE FROM RSS_SYNC_LOG WHERE id <= (SELECT MAX(id) FROM RSS_SYNC_LOG) - 100')
+        return counts
+
+    def select_new_items(self, rss_url, items):
+        """只保留上次处理位置之后发布的项目，以及未找到详情且缓存已过期的项目，没有发布时间的项目始终处理"""
+        _, _, last_guid, last_pub_date = self.load_feed_state(rss_url)
+        if last_pub_date is None:
+            return items
+        expired = self.expired_misses()
+        return [
+            item for item in items
+            if item[3] is None or item[3] > last_pub_date or (item[3] == last_pub_date and item[2] != last_guid)
+            or item[1] in expired
+        ]
+
+    def next_watermark(self, rss_url, items, failed_ids):
+        """新的处理位置：有项目获取详情失败时停在最早失败的项目之前，以便下次重试"""
+        dated = [item for item in items if item[3] is not None]
+        failed = [item for item in dated if item[1] in failed_ids]
+        if failed:
+            oldest = min(failed, key=lambda item: item[3])
+            return None, oldest[3] - 1
+        if not dated:
+            return self.load_feed_state(rss_url)[2:]
+        newest = max(dated, key=lambda item: item[3])
+        return newest[2], newest[3]
+
+    def fetch_feeds(self):
+        """同时获取全部订阅，返回 {订阅URL: (内容, (ETag, Last-Modified))}"""
+        states = {rss_url: self.load_feed_state(rss_url) for rss_url in self.rss_urls}
+        # 还没有记录条目的订阅需要获取完整内容，不能使用条件请求
+        recorded = {row[0] for row in self.db_connection.execute('SELECT DISTINCT rss_url FROM RSS_FEED_ITEMS')}
+        for rss_url in self.rss_urls:
+            if rss_url not in recorded:
+                states[rss_url] = (None, None) + states[rss_url][2:]
+        with ThreadPoolExecutor(max_workers=len(self.rss_urls)) as executor:
+            results = executor.map(lambda rss_url: self.fetch_rss_data(rss_url, *states[rss_url][:2]), self.rss_urls)
+            return dict(zip(self.rss_urls, results))
 
     def run(self):
-        rss_data = self.fetch_rss_data()
-        if rss_data:
-            items = self.parse_rss_data(rss_data)
+        """返回本次同步的新增、更新、删除数量，没有变化时返回 None"""
+        if not self.rss_urls:
+            logging.error("没有配置豆瓣订阅URL")
+            return None
+        feeds = {}
+        complete = True
+        for rss_url, (rss_data, validators) in self.fetch_feeds().items():
+            if rss_data is RSS_NOT_MODIFIED:
+                # 订阅未变化，但上次有项目未处理完（如因限速留到下次运行）或未找到的缓存已过期时，使用记录的条目继续处理
+                items = self.unfinished_items(rss_url)
+                if items:
+                    logging.info(f"RSS订阅未变化，继续处理上次未完成的项目: {rss_url}")
+                    feeds[rss_url] = (items, validators)
+                continue
+            items = self.parse_rss_data(rss_data) if rss_data else []
             if items:
-                # 获取数据库中已存在的豆瓣ID
-                existing_douban_ids = self.fetch_existing_douban_ids()
-                new_douban_ids = {douban_id for _, douban_id in items}
-                
-                # 删除数据库中不在新RSS数据中的过时数据
-                self.delete_old_data(existing_douban_ids, new_douban_ids)
-
-                logging.info("开始处理RSS订阅中的所有项目")
-                for title, douban_id in items:
-                    # 检查数据库中是否已存在相同的豆瓣ID
-                    if douban_id in existing_douban_ids:
-                        logging.info(f"跳过已存在的项目: 豆瓣ID {douban_id}")
-                        continue
-
-                    movie_details = self.fetch_movie_details(title, douban_id)  # 使用标题和豆瓣ID获取详细信息
-                    if movie_details:
-                        logging.info("-" * 80)
-                        logging.info(f"处理项目: {movie_details['title']}")
-                        logging.info(f"豆瓣ID: {movie_details['douban_id']}")
-                        logging.info(f"季数: {movie_details['season']}")
-                        logging.info(f"集数: {movie_details['episode']}")
-                        logging.info(f"年份: {movie_details['year']}")
-                        logging.info(f"类型: {movie_details['media_type']}")
-                        logging.info(f"图片URL: {movie_details['img']}")
-                        logging.info(f"URL: {movie_details['url']}")
-                        logging.info(f"副标题: {movie_details['sub_title']}")
-                        # 插入数据库
-                        self.insert_into_db(movie_details)
-                    
-                    # 随机休眠10到15秒，避免频繁请求
-                    sleep_time = random.uniform(10, 15)
-                    time.sleep(sleep_time)
+                feeds[rss_url] = (items, validators)
             else:
-                logging.warning("RSS订阅中没有找到项目")
-        else:
-            logging.error("未能获取RSS数据")
+                logging.warning(f"RSS订阅中没有找到项目: {rss_url}")
+                complete = False
+
+        if not feeds:
+            if complete:
+                logging.info("豆瓣订阅没有变化，跳过处理")
+            else:
+                logging.error("未能获取RSS数据")
+            return None
+        if not complete:
+            logging.warning("部分RSS订阅获取失败，本次不删除过时数据")
+
+        # 多个订阅中的相同豆瓣ID只查询一次
+        new_items = {}
+        for rss_url, (items, _) in feeds.items():
+            for item in self.select_new_items(rss_url, items):
+                new_items.setdefault(item[1], item)
+        # 数据库中已存在的豆瓣ID不再查询
+        pending_ids = self.pending_douban_ids(new_items)
+        skipped = len(new_items) - len(pending_ids)
+        new_items = [item for douban_id, item in new_items.items() if douban_id in pending_ids]
+        logging.info(f"{len(feeds)} 个RSS订阅有更新，{len(new_items)} 个新项目需要查询，跳过 {skipped} 个已存在的项目")
+
+        resolved = []
+        failed_ids = set()
+        for index, item in enumerate(new_items):
+            title, douban_id, _, _ = item
+            try:
+                movie_details = self.get_subject_details(title, douban_id)  # 使用标题和豆瓣ID获取详细信息
+            except RateLimitedError as e:
+                # 剩余项目留到下次运行时处理
+                logging.warning(f"{e}，剩余 {len(new_items) - index} 个项目下次运行时处理")
+                failed_ids.update(douban_id for _, douban_id, _, _ in new_items[index:])
+                break
+            if movie_details is SUBJECT_NOT_FOUND:
+                # 搜索结果中没有该条目，缓存过期后重新查询
+                continue
+            if movie_details:
+                logging.info("-" * 80)
+                logging.info(f"处理项目: {movie_details['title']}")
+                logging.info(f"豆瓣ID: {movie_details['douban_id']}")
+                logging.info(f"季数: {movie_details['season']}")
+                logging.info(f"集数: {movie_details['episode']}")
+                logging.info(f"年份: {movie_details['year']}")
+                logging.info(f"类型: {movie_details['media_type']}")
+                logging.info(f"图片URL: {movie_details['img']}")
+                logging.info(f"URL: {movie_details['url']}")
+                logging.info(f"副标题: {movie_details['sub_title']}")
+                resolved.append(movie_details)
+            else:
+                failed_ids.add(douban_id)
+
+        # 查询结果已逐条写入豆瓣条目缓存，中途退出后重新运行不会重复请求
+        try:
+            counts = self.apply_changes(feeds, resolved, complete)
+        except sqlite3.Error as e:
+            logging.error(f"写入数据库时发生错误: {e}")
+            return None
+        logging.info(f"豆瓣订阅同步完成：新增 {counts['inserted']} 个，更新 {counts['updated']} 个，删除 {counts['removed']} 个")
+
+        for rss_url, (items, validators) in feeds.items():
+            if any(item[1] in failed_ids for item in items):
+                # 有项目获取详情失败时不保存新的 ETag/Last-Modified，否则下次返回 304 后这些项目不会再重试
+                validators = (None, None)
+            self.save_feed_state(rss_url, validators, *self.next_watermark(rss_url, items, failed_ids))
+        return counts
+
+    def resolve_tmdb_ids(self):
+        """为还没有对应TMDB ID的订阅查询TMDB，每个豆瓣ID只查询一次，未找到的在 miss_cache_days 后重新查询"""
+        if self.config.get('tmdb', 'api_key', fallback='') in ('', 'your_tmdb_key'):
+            logging.info("没有配置TMDB API密钥，跳过查询订阅的TMDB ID")
+            return
+        resolved = 'SELECT douban_id FROM DOUBAN_TMDB_MAP WHERE tmdb_id IS NOT NULL OR resolved_at >= ?'
+        expire = int(time.time() - self.miss_cache_seconds)
+        pending = self.db_connection.execute(f'''
+            SELECT douban_id, title, year, 'movie', 1 FROM RSS_MOVIES WHERE douban_id NOT IN ({resolved})
+            UNION ALL
+            SELECT douban_id, title, year, 'tv', season FROM RSS_TVS WHERE douban_id NOT IN ({resolved})
+        ''', (expire, expire)).fetchall()
+        if not pending:
+            return
+        logging.info(f"查询 {len(pending)} 个订阅的TMDB ID")
+        mappings = []
+        for douban_id, title, year, media_type, season in pending:
+            tmdb_id = query_tmdb_api(title, year, media_type, self.config)
+            if tmdb_id is None and media_type == 'tv' and season and season > 1:
+                # 豆瓣中每季的年份是该季的播出年份，与TMDB中剧集的首播年份不同
+                tmdb_id = query_tmdb_api(title, '', media_type, self.config)
+            mappings.append((douban_id, media_type, tmdb_id, int(time.time())))
+        self.db_connection.executemany(
+            'INSERT OR REPLACE INTO DOUBAN_TMDB_MAP (douban_id, media_type, tmdb_id, resolved_at) VALUES (?, ?, ?, ?)', mappings
+        )
+        self.db_connection.commit()
+        logging.info(f"找到 {sum(1 for mapping in mappings if mapping[2] is not None)} 个订阅的TMDB ID")
+
+    def refresh_air_schedules(self):
+        """获取订阅电视剧各季的播出日期。已播完的季不再更新，尚未播完或集数少于豆瓣总集数的季每隔 schedule_refresh_hours 小时更新"""
+        if self.config.get('tmdb', 'api_key', fallback='') in ('', 'your_tmdb_key'):
+            return
+        episodes = 'SELECT 1 FROM TMDB_EPISODES AS e WHERE e.tmdb_id = s.tmdb_id AND e.season = s.season'
+        pending = self.db_connection.execute(f'''
+            SELECT DISTINCT d.tmdb_id, r.season
+            FROM RSS_TVS AS r
+            JOIN DOUBAN_TMDB_MAP AS d ON d.douban_id = r.douban_id AND d.tmdb_id IS NOT NULL
+            LEFT JOIN TMDB_SEASONS AS s ON s.tmdb_id = d.tmdb_id AND s.season = r.season
+            WHERE s.fetched_at IS NULL
+               OR (s.fetched_at < ? AND (
+                   NOT EXISTS ({episodes} AND e.air_date <= date('now', 'localtime') AND e.episode >= CAST(r.episode AS INTEGER))
+                   OR EXISTS ({episodes} AND (e.air_date IS NULL OR e.air_date > date('now', 'localtime')))
+               ))
+        ''', (int(time.time() - self.schedule_refresh_seconds),)).fetchall()
+        if not pending:
+            return
+        logging.info(f"更新 {len(pending)} 季电视剧的播出日期")
+        cursor = self.db_connection.cursor()
+        for tmdb_id, season in pending:
+            schedule = query_tmdb_season(tmdb_id, season, self.config)
+            if schedule is None:
+                continue
+            cursor.execute('DELETE FROM TMDB_EPISODES WHERE tmdb_id = ? AND season = ?', (tmdb_id, season))
+            cursor.executemany(
+                'INSERT OR REPLACE INTO TMDB_EPISODES (tmdb_id, season, episode, air_date) VALUES (?, ?, ?, ?)',
+                [(tmdb_id, season, episode, air_date) for episode, air_date in schedule]
+            )
+            cursor.execute(
+                'INSERT OR REPLACE INTO TMDB_SEASONS (tmdb_id, season, fetched_at) VALUES (?, ?, ?)',
+                (tmdb_id, season, int(time.time()))
+            )
+            self.db_connection.commit()
 
     def close_db(self):
+        self.session.close()
         self.db_connection.close()
         logging.info("关闭数据库连接")
 
@@ -292,4 +691,6 @@ if __name__ == "__main__":
     config_path = '/config/config.ini'  # 配置文件路径
     parser = DouBanRSSParser(config_path)
     parser.run()
+    parser.resolve_tmdb_ids()
+    parser.refresh_air_schedules()
     parser.close_db()
\ No newline at end of file
@@ -3,6 +3,9 @@ import re
 import sqlite3
 import configparser
 import logging
+import requests
+from media_parser import parse_library_filename, normalize_title, add_title_key
+from media_server import MediaServerNotifier, CHANGE_CREATED, CHANGE_DELETED
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s', encoding='utf-8')
@@ -12,7 +15,7 @@ def read_config(file_path):
     config.read(file_path, encoding='utf-8')
     return config
 
-def scan_directory(path):
+def scan_directory(path, paths=None):
     movies = []
     episodes = {}
 
@@ -20,28 +23,26 @@ def scan_directory(path):
         for file in files:
             # 将文件扩展名转换为小写
             if file.lower().endswith(('.mkv', '.mp4')):
-                # 匹配电影文件名模式
-                movie_match = re.match(r'^(.*) - \((\d{4})\) (\d+p)\.(mkv|mp4)$', file, re.IGNORECASE)
-                if movie_match:
-                    movie_name = movie_match.group(1).strip()
-                    year = movie_match.group(2)
+                if paths is not None:
+                    paths.add(os.path.join(root, file))
+                parsed = parse_library_filename(file)
+                if parsed is None:
+                    continue
+                if parsed[0] == 'movie':
+                    # 匹配电影文件名模式
+                    _, movie_name, year = parsed
                     movies.append((movie_name, year))
                     continue
 
                 # 匹配电视剧文件名模式
-                episode_match = re.match(r'^(.*) - S(\d+)E(\d+) - (.*)\.(mkv|mp4)$', file, re.IGNORECASE)
-                if episode_match:
-                    show_name = episode_match.group(1).strip()
-                    season = int(episode_match.group(2))
-                    episode = int(episode_match.group(3))
-
-                    if show_name not in episodes:
-                        episodes[show_name] = {}
-                    if season not in episodes[show_name]:
-                        episodes[show_name][season] = []
+                _, show_name, season, episode = parsed
+                if show_name not in episodes:
+                    episodes[show_name] = {}
+                if season not in episodes[show_name]:
+                    episodes[show_name][season] = []
 
-                    if episode not in episodes[show_name][season]:
-                        episodes[show_name][season].append(episode)
+                if episode not in episodes[show_name][season]:
+                    episodes[show_name][season].append(episode)
 
     return movies, episodes
 
@@ -80,6 +81,10 @@ def create_database(db_path):
     )
     ''')
 
+    # 标题匹配键，用于与豆瓣订阅、NFO、发布名称中的标题匹配
+    add_title_key(cursor, 'LIB_MOVIES')
+    add_title_key(cursor, 'LIB_TVS')
+
     conn.commit()
     conn.close()
     logging.info("数据库和表创建成功。")
@@ -97,8 +102,8 @@ def insert_or_update_movies(db_path, movies):
             logging.debug(f"电影 '{title} ({year})' 已存在于数据库中。")
         else:
             cursor.execute('''
-            INSERT INTO LIB_MOVIES (title, year) VALUES (?, ?)
-            ''', (title, year))
+            INSERT INTO LIB_MOVIES (title, year, title_key) VALUES (?, ?, ?)
+            ''', (title, year, normalize_title(title)))
             logging.info(f"已将电影 '{title} ({year})' 插入数据库。")
 
     conn.commit()
@@ -118,8 +123,8 @@ def insert_or_update_episodes(db_path, episodes):
             logging.debug(f"电视剧 '{show_name}' 已存在于数据库中。")
         else:
             cursor.execute('''
-            INSERT INTO LIB_TVS (title) VALUES (?)
-            ''', (show_name,))
+            INSERT INTO LIB_TVS (title, title_key) VALUES (?, ?)
+            ''', (show_name, normalize_title(show_name)))
             tv_id = cursor.lastrowid
             logging.info(f"已将电视剧 '{show_name}' 插入数据库。")
 
@@ -253,6 +258,38 @@ def update_tv_year(episodes_path, db_path):
     # 更新数据库
     update_database(db_path, shows)
 
+def notify_media_server(config, db_path, paths):
+    """与上次扫描的文件列表比较，将新增和删除的文件通知媒体服务器按路径刷新"""
+    notifier = MediaServerNotifier.from_config(config)
+    if not notifier.enabled:
+        return
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS LIB_FILES (path TEXT PRIMARY KEY)')
+    previous = {row[0] for row in cursor.execute('SELECT path FROM LIB_FILES')}
+    added = paths - previous
+    removed = previous - paths
+    cursor.executemany('DELETE FROM LIB_FILES WHERE path = ?', [(path,) for path in removed])
+    cursor.executemany('INSERT INTO LIB_FILES (path) VALUES (?)', [(path,) for path in added])
+    conn.commit()
+    conn.close()
+
+    if not previous:
+        # 首次扫描只记录文件列表，不通知
+        logging.info(f"已记录媒体库文件列表，共 {len(paths)} 个文件。")
+        return
+    notifier.queue([(path, CHANGE_CREATED) for path in added] + [(path, CHANGE_DELETED) for path in removed])
+    if added or removed:
+        logging.info(f"已将 {len(added) + len(removed)} 个路径加入媒体服务器待通知队列（新增 {len(added)}，删除 {len(removed)}）。")
+    # 本次扫描的变化已是一整批，扫描结束时直接发送；目录监控服务未运行时队列也不会一直积压，
+    # 发送失败的变化保留在队列中，由目录监控服务或下一次扫描重新发送
+    try:
+        sent = notifier.drain()
+        if sent:
+            logging.info(f"已通知媒体服务器刷新 {sent} 个路径。")
+    except (requests.RequestException, sqlite3.Error) as e:
+        logging.error(f"通知媒体服务器失败，变化保留在待通知队列中: {e}")
+
 def main():
     config = read_config('/config/config.ini')  # 配置文件路径
     db_path = config['database']['db_path']
@@ -263,8 +300,9 @@ def main():
     create_database(db_path)
 
     # 扫描目录
-    movies, episodes = scan_directory(movies_path)
-    _, more_episodes = scan_directory(episodes_path)
+    paths = set()
+    movies, episodes = scan_directory(movies_path, paths)
+    _, more_episodes = scan_directory(episodes_path, paths)
 
     # 合并电视剧结果
     for show, seasons in more_episodes.items():
@@ -290,5 +328,8 @@ def main():
     # 删除数据库中多余的电视剧记录
     delete_obsolete_episodes(db_path, episodes)
 
+    # 通知媒体服务器刷新新增和删除的文件
+    notify_media_server(config, db_path, paths)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,18 +1,37 @@
 import os
-import re
+import sys
+import errno
 import logging
 import requests
 import configparser
 import shutil
 import time
 import subprocess
-from collections import defaultdict
+import threading
+import functools
+import json
+import hashlib
+import mmap
+import ctypes
+import platform
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from file_ledger import FileLedger, directory_available, under_directory
+from poll_watcher import PollingWatcher, mount_type, needs_polling
+from path_mapping import parse_path_map, map_path
+from media_server import MediaServerNotifier, CHANGE_CREATED
+from transmission_client import TransmissionClient, TransmissionError, is_finished, torrent_file_paths
+from media_parser import extract_info, parse_release_name
 
 # 定义常量
 LOG_FILE_PATH = '/tmp/sync.log'
 FILES_RECORD_PATH = '/config/files_record.txt'
+PROGRESS_FILE_PATH = '/tmp/sync_progress.json'
+MEMORY_STATS_PATH = '/tmp/sync_stats.json'
 
 # 清空日志文件
 if os.path.exists(LOG_FILE_PATH):
@@ -38,8 +57,61 @@ stream_handler.setFormatter(stream_formatter)
 logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
-# 创建一个默认字典来存储缓存数据
-cache = defaultdict(dict)
+def estimate_size(obj):
+    """粗略估算容器及其内容占用的内存字节数"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key) + estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+class TieredCache:
+    """有容量上限的内存 LRU 缓存，未命中时读取数据库中的持久缓存"""
+
+    def __init__(self, name, maxsize, ttl, decode=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # 持久缓存中的 JSON 值还原为内存中使用的类型
+        self.decode = decode
+        self.store = None
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.store is None:
+            return None
+        value = self.store.cache_get(self.name, json.dumps(key, ensure_ascii=False), self.ttl)
+        if value is not None:
+            value = self.decode(value) if self.decode else value
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+        if self.store is not None:
+            self.store.cache_put(self.name, json.dumps(key, ensure_ascii=False), value)
+
+    def _remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'maxsize': self.maxsize, 'bytes': estimate_size(self.entries)}
+
+# TMDB 查询结果缓存：搜索结果保存 30 天，剧集名称每天更新一次
+METADATA_CACHE_TTL = 30 * 86400
+tmdb_cache = TieredCache('tmdb', 1024, METADATA_CACHE_TTL, decode=tuple)
+season_cache = TieredCache('season', 256, 86400, decode=lambda episodes: {int(number): name for number, name in episodes.items()})
 
 def read_config():
     config = configparser.ConfigParser()
@@ -49,8 +121,10 @@ def read_config():
 def get_tmdb_info(title, year, media_type):
     try:
         # 检查缓存中是否有数据
-        if (title, year) in cache[media_type]:
-            return cache[media_type][(title, year)]
+        key = (media_type, title, year)
+        cached = tmdb_cache.get(key)
+        if cached:
+            return cached
         
         config = read_config()
         TMDB_API_KEY = config['tmdb']['api_key']
@@ -68,191 +142,401 @@ def get_tmdb_info(title, year, media_type):
         for result in search_results:
             if media_type == 'movie' and str(result.get('release_date', '')).startswith(str(year)):
                 # 将结果存入缓存
-                cache[media_type][(title, year)] = (result['id'], result.get('title', ''))
+                tmdb_cache.put(key, (result['id'], result.get('title', '')))
                 return result['id'], result.get('title', '')
             elif media_type == 'tv' and result.get('first_air_date', '').startswith(str(year)):
                 # 将结果存入缓存
-                cache[media_type][(title, year)] = (result['id'], result.get('name', ''))
+                tmdb_cache.put(key, (result['id'], result.get('name', '')))
                 return result['id'], result.get('name', '')
     except requests.RequestException as e:
         logger.error(f"请求错误: {e}")
     return None, None
 
-def get_tv_episode_name(tmdb_id, season_number, episode_number):
+def get_tv_season_episodes(tmdb_id, season_number):
+    """获取一季所有剧集的名称，整季只请求一次 TMDB"""
+    key = (tmdb_id, int(season_number))
+    cached = season_cache.get(key)
+    if cached is not None:
+        return cached
     try:
         config = read_config()
         TMDB_API_KEY = config['tmdb']['api_key']
         TMDB_BASE_URL = config['tmdb']['base_url']
-        url = f"{TMDB_BASE_URL}/tv/{tmdb_id}/season/{season_number}/episode/{episode_number}"
+        url = f"{TMDB_BASE_URL}/tv/{tmdb_id}/season/{int(season_number)}"
         params = {
             'api_key': TMDB_API_KEY,
             'language': 'zh-CN'
         }
         response = requests.get(url, params=params, timeout=10)
         response.raise_for_status()
-        episode_info = response.json()
-        return episode_info.get('name', f"第{episode_number}集")
+        episodes = {episode.get('episode_number'): episode.get('name') for episode in response.json().get('episodes', [])}
+        # 将结果存入缓存
+        season_cache.put(key, episodes)
+        return episodes
     except requests.RequestException as e:
         logger.error(f"请求错误: {e}")
-    return f"第{episode_number}集"
-
-def extract_info(filename, folder_name=None):
-    def extract_movie_info(filename, folder_name=None):
-        # 文件名中的中文名称模式
-        chinese_name_pattern_filename = r'([\u4e00-\u9fa5A-Za-z0-9：]+)(?=\.)'
-        # 文件夹名称中的中文名称模式
-        chinese_name_pattern_folder = r'】([\u4e00-\u9fa5A-Za-z0-9：$$(). ]+)'
-        english_name_pattern = r'([A-Za-z0-9\.\s]+)(?=\.\d{4}(?:\.|$))'
-        year_pattern = r'(\d{4})(?=\.|$)'
-        quality_pattern = r'(\d{1,4}[pPkK])'
-        suffix_pattern = r'\.(\w+)$'
-
-        # 尝试从文件名中提取中文名称
-        chinese_name = re.search(chinese_name_pattern_filename, filename)
-        if chinese_name and re.search(r'[\u4e00-\u9fa5]', chinese_name.group(1)):
-            chinese_name = chinese_name.group(1)
-        else:
-            chinese_name = None
+    return {}
 
-        # 如果文件名中未找到中文名称且提供了文件夹名称，则尝试从文件夹名称中提取
-        if not chinese_name and folder_name:
-            chinese_name = re.search(chinese_name_pattern_folder, folder_name)
-            if chinese_name and re.search(r'[\u4e00-\u9fa5]', chinese_name.group(1)):
-                chinese_name = chinese_name.group(1)
-            else:
-                chinese_name = None
-
-        # 提取英文名称
-        english_name = re.search(english_name_pattern, filename)
-        english_name = english_name.group(1).strip() if english_name else None
-        if english_name:
-            english_name = english_name.replace('.', ' ').replace('-', ' ')
-
-        # 提取年份
-        year = re.search(year_pattern, filename)
-        year = year.group() if year else None
-
-        # 提取视频质量
-        quality = re.search(quality_pattern, filename)
-        quality = quality.group().upper() if quality else None
-
-        # 提取文件后缀名
-        suffix = re.search(suffix_pattern, filename)
-        suffix = suffix.group(1) if suffix else None
-
-        # 构建结果字典
-        result = {
-            '名称': chinese_name if chinese_name else english_name,
-            '发行年份': year,
-            '视频质量': quality,
-            '后缀名': suffix
+def get_tv_episode_name(tmdb_id, season_number, episode_number):
+    episode_name = get_tv_season_episodes(tmdb_id, season_number).get(int(episode_number))
+    return episode_name or f"第{episode_number}集"
+
+# FICLONE ioctl 请求号，用于在 btrfs/xfs 上创建写时复制的克隆
+FICLONE = 0x40049409
+TRANSFER_ACTIONS = ('move', 'copy', 'hardlink', 'reflink', 'auto')
+
+def temp_path_for(dst):
+    """目标目录下的隐藏临时文件名，写入完成后再原子重命名，避免媒体库扫描到不完整文件"""
+    return os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+def same_filesystem(src, dst):
+    try:
+        return os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev
+    except OSError:
+        return False
+
+def reflink_file(src, tmp):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, tmp)
+
+class BandwidthLimiter:
+    """所有转移线程共享的令牌桶带宽限制，速率为 0 时不限速"""
+
+    def __init__(self, bytes_per_second=0):
+        self.lock = threading.Lock()
+        self.set_rate(bytes_per_second)
+
+    def set_rate(self, bytes_per_second):
+        with self.lock:
+            self.rate = max(0, bytes_per_second)
+            # 最多允许 1 秒的突发流量
+            self.allowance = self.rate
+            self.last = time.monotonic()
+
+    def consume(self, nbytes):
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate) - nbytes
+            self.last = now
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class TransferProgress:
+    """记录正在进行的文件复制进度，定期写入 JSON 文件供 WEB 管理页面读取"""
+
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.transfers = {}
+        self.last_flush = 0
+        self.next_key = 0
+
+    def begin(self, src, dst, total):
+        with self.lock:
+            self.next_key += 1
+            key = self.next_key
+            now = time.monotonic()
+            self.transfers[key] = {'src': src, 'dst': dst, 'total': total, 'done': 0, 'started': now, 'sample_time': now, 'sample_done': 0, 'speed': 0}
+        self.flush(force=True)
+        return key
+
+    def update(self, key, nbytes):
+        with self.lock:
+            transfer = self.transfers[key]
+            transfer['done'] += nbytes
+            now = time.monotonic()
+            if now - transfer['sample_time'] >= self.interval:
+                # 按最近一个采样周期计算瞬时速度
+                transfer['speed'] = (transfer['done'] - transfer['sample_done']) / (now - transfer['sample_time'])
+                transfer['sample_time'], transfer['sample_done'] = now, transfer['done']
+        self.flush()
+
+    def finish(self, key):
+        with self.lock:
+            transfer = self.transfers.pop(key, None)
+        if transfer:
+            elapsed = max(time.monotonic() - transfer['started'], 1e-6)
+            logger.info(f"复制完成: {transfer['dst']}，平均速度 {transfer['done'] / elapsed / 1048576:.1f} MB/s")
+        self.flush(force=True)
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {
+                    'src': transfer['src'],
+                    'dst': transfer['dst'],
+                    'total': transfer['total'],
+                    'done': transfer['done'],
+                    'bytes_per_second': round(transfer['speed']),
+                }
+                for transfer in self.transfers.values()
+            ]
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_flush < self.interval:
+            return
+        self.last_flush = now
+        transfers = self.snapshot()
+        data = {
+            'updated': int(time.time()),
+            'bytes_per_second': sum(transfer['bytes_per_second'] for transfer in transfers),
+            'transfers': transfers,
         }
+        tmp = f"{self.path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.debug(f"写入转移进度失败: {e}")
+
+# 转移引擎设置，启动时由 configure_transfer 根据配置文件更新
+transfer_settings = {
+    'chunk_size': 8 * 1024 * 1024,
+    'nice': 10,
+    'io_class': 'best-effort',
+    'io_level': 7,
+    'verify': 'off',
+}
+bandwidth_limiter = BandwidthLimiter()
+transfer_progress = TransferProgress(PROGRESS_FILE_PATH)
+
+# 复制校验方式：sample 抽样回读、full 完整回读，其他值不校验
+VERIFY_MODES = ('sample', 'full')
+VERIFY_SAMPLES = 8
+VERIFY_SAMPLE_SIZE = 64 * 1024
+
+class VerificationError(Exception):
+    """复制后回读校验不一致"""
+
+# ioprio_set 系统调用号及 IO 调度类别
+IOPRIO_SYSCALLS = {'x86_64': 251, 'aarch64': 30, 'i686': 289, 'armv7l': 314}
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+def configure_transfer(config):
+    bandwidth_limit = config.getfloat('downloadtransfer', 'bandwidth_limit', fallback=0)
+    bandwidth_limiter.set_rate(int(bandwidth_limit * 1024 * 1024))
+    chunk_mb = max(1, config.getint('downloadtransfer', 'transfer_chunk_mb', fallback=8))
+    transfer_settings['chunk_size'] = chunk_mb * 1024 * 1024
+    transfer_settings['nice'] = config.getint('downloadtransfer', 'transfer_nice', fallback=10)
+    transfer_settings['io_class'] = config.get('downloadtransfer', 'transfer_io_class', fallback='best-effort')
+    transfer_settings['verify'] = config.get('downloadtransfer', 'verify', fallback='off').strip().lower()
+    if bandwidth_limit:
+        logger.info(f"文件转移限速: {bandwidth_limit} MB/s")
+
+def apply_transfer_priority():
+    """降低当前转移线程的 CPU 与 IO 优先级，避免影响做种和播放"""
+    thread_id = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, thread_id, transfer_settings['nice'])
+    except (AttributeError, OSError) as e:
+        logger.debug(f"设置线程 nice 值失败: {e}")
+    io_class = IOPRIO_CLASSES.get(transfer_settings['io_class'])
+    syscall_number = IOPRIO_SYSCALLS.get(platform.machine())
+    if not io_class or not syscall_number:
+        return
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        # who 为 0 表示当前线程
+        ioprio = (io_class << IOPRIO_CLASS_SHIFT) | (0 if io_class == 3 else transfer_settings['io_level'])
+        if libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, ioprio) != 0:
+            logger.debug(f"设置线程 IO 优先级失败: errno {ctypes.get_errno()}")
+    except OSError as e:
+        logger.debug(f"设置线程 IO 优先级失败: {e}")
+
+def copy_with_buffer(fsrc, fdst, offset, size, key, digest=None, samples=None):
+    """使用页对齐的大缓冲区在用户态复制剩余数据。传入 digest 时边复制边计算哈希，
+    samples 为需要记录校验值的分块起始位置，用于复制后的抽样回读"""
+    chunk_size = transfer_settings['chunk_size']
+    buffer = mmap.mmap(-1, chunk_size)
+    view = memoryview(buffer)
+    try:
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        while offset < size:
+            copied = fsrc.readinto(view)
+            if not copied:
+                break
+            fdst.write(view[:copied])
+            if digest is not None:
+                digest.update(view[:copied])
+            if samples is not None and offset in samples:
+                # 与回读时一致，只计算本次实际复制的数据，缓冲区中剩余的旧数据不参与计算
+                samples[offset] = hashlib.blake2b(view[:min(copied, VERIFY_SAMPLE_SIZE)], digest_size=16).digest()
+            offset += copied
+            transfer_progress.update(key, copied)
+            bandwidth_limiter.consume(copied)
+    finally:
+        view.release()
+        buffer.close()
+    return offset
+
+def sample_offsets(size):
+    """抽样校验的位置：首尾分块以及均匀分布的若干中间分块"""
+    chunk_size = transfer_settings['chunk_size']
+    chunks = (size + chunk_size - 1) // chunk_size
+    if not chunks:
+        return set()
+    step = max(1, chunks // VERIFY_SAMPLES)
+    return {index * chunk_size for index in list(range(0, chunks, step)) + [chunks - 1]}
+
+def drop_page_cache(fd):
+    """刷写并丢弃文件的页缓存，使随后的回读真正从磁盘或网络共享读取"""
+    os.fsync(fd)
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
 
-        # 如果从文件名中未能提取到年份信息，从文件夹名称中尝试提取
-        if not year and folder_name:
-            folder_year = re.search(year_pattern, folder_name)
-            if folder_year:
-                result['发行年份'] = folder_year.group()
-
-        return result
-
-    def extract_tv_info(filename, folder_name=None):
-        # 文件名中的中文名称模式
-        chinese_name_pattern_filename = r'([\u4e00-\u9fa5A-Za-z0-9：]+)(?=\.)'
-        # 文件夹名称中的中文名称模式
-        chinese_name_pattern_folder = r'】([\u4e00-\u9fa5A-Za-z0-9：$$(). ]+)'
-        english_name_pattern = r'([A-Za-z0-9\.\s]+)(?=\.(?:S\d{1,2}|E\d{1,2}|EP\d{1,2}))'
-        season_pattern = r'S(\d{1,2})'
-        episode_pattern = r'(?:E|EP)(\d{1,2})'
-        year_pattern = r'(\d{4})'
-        quality_pattern = r'(\d{1,4}[pPkK])'
-        suffix_pattern = r'\.(\w+)$'
-
-        # 尝试从文件名中提取中文名称
-        chinese_name = re.search(chinese_name_pattern_filename, filename)
-        if chinese_name and re.search(r'[\u4e00-\u9fa5]', chinese_name.group(1)):
-            chinese_name = chinese_name.group(1)
+def verify_copy(tmp, checksum, samples):
+    """回读目标文件校验：full 模式比较完整哈希，sample 模式只比较抽样分块"""
+    with open(tmp, 'rb') as f:
+        if samples is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for block in iter(functools.partial(f.read, transfer_settings['chunk_size']), b''):
+                digest.update(block)
+            if digest.hexdigest() != checksum:
+                raise VerificationError(f"完整回读校验失败: {tmp}")
         else:
-            chinese_name = None
+            for offset, expected in samples.items():
+                f.seek(offset)
+                if hashlib.blake2b(f.read(VERIFY_SAMPLE_SIZE), digest_size=16).digest() != expected:
+                    raise VerificationError(f"抽样回读校验失败（偏移 {offset}）: {tmp}")
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
 
-        # 如果文件名中未找到中文名称且提供了文件夹名称，则尝试从文件夹名称中提取
-        if not chinese_name and folder_name:
-            chinese_name = re.search(chinese_name_pattern_folder, folder_name)
-            if chinese_name and re.search(r'[\u4e00-\u9fa5]', chinese_name.group(1)):
-                chinese_name = chinese_name.group(1)
+def copy_file_data(src, tmp):
+    """分块复制文件数据：优先 copy_file_range（内核内复制，支持 NFS/SMB 服务端复制），其次 sendfile，
+    最后使用对齐缓冲区在用户态复制。每块复制后更新进度并按带宽限制限速。
+    开启校验时数据统一经用户态缓冲区复制，复制的同时计算哈希，写入后回读校验，返回文件哈希"""
+    chunk_size = transfer_settings['chunk_size']
+    verify = transfer_settings['verify']
+    checksum = samples = None
+    with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        key = transfer_progress.begin(src, tmp, size)
+        try:
+            offset = 0
+            if verify in VERIFY_MODES:
+                digest = hashlib.blake2b(digest_size=16)
+                samples = dict.fromkeys(sample_offsets(size)) if verify == 'sample' else None
+                copy_with_buffer(fsrc, fdst, offset, size, key, digest, samples)
+                checksum = digest.hexdigest()
+                fdst.flush()
+                drop_page_cache(fdst.fileno())
             else:
-                chinese_name = None
-
-        # 提取英文名称
-        english_name = re.search(english_name_pattern, filename)
-        english_name = english_name.group(1).strip() if english_name else None
-        if english_name:
-            english_name = english_name.replace('.', ' ').replace('-', ' ')
-
-        # 提取季数
-        season = re.search(season_pattern, filename)
-        season_number = season.group(1) if season else None
-
-        # 提取集数
-        episode = re.search(episode_pattern, filename)
-        episode_number = episode.group(1) if episode else None
-
-        # 提取年份
-        year = re.search(year_pattern, filename)
-        year = year.group() if year else None
-
-        # 提取视频质量
-        quality = re.search(quality_pattern, filename)
-        quality = quality.group().upper() if quality else None
-
-        # 提取文件后缀名
-        suffix = re.search(suffix_pattern, filename)
-        suffix = suffix.group(1) if suffix else None
-
-        # 构建结果字典
-        result = {
-            '名称': chinese_name if chinese_name else english_name,
-            '发行年份': year,
-            '视频质量': quality,
-            '后缀名': suffix
-        }
+                for method in ('copy_file_range', 'sendfile'):
+                    if not hasattr(os, method):
+                        continue
+                    try:
+                        while offset < size:
+                            count = min(chunk_size, size - offset)
+                            if method == 'sendfile':
+                                os.lseek(fdst.fileno(), offset, os.SEEK_SET)
+                                copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, count)
+                            else:
+                                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), count, offset, offset)
+                            if copied == 0:
+                                break
+                            offset += copied
+                            transfer_progress.update(key, copied)
+                            bandwidth_limiter.consume(copied)
+                        break
+                    except OSError as e:
+                        logger.debug(f"{method} 不可用，尝试下一种复制方式: {e}")
+                if offset < size:
+                    copy_with_buffer(fsrc, fdst, offset, size, key)
+        finally:
+            transfer_progress.finish(key)
+    if checksum:
+        verify_copy(tmp, checksum, samples)
+    shutil.copystat(src, tmp)
+    return checksum
 
-        # 如果有集数信息，添加季数（如果没有的话默认为01）和集数
-        if episode_number:
-            if not season_number:
-                season_number = '01'  # 如果没有季信息，默认使用01季
-            result.update({
-                '季': season_number,
-                '集': episode_number
-            })
-
-        # 如果从文件名中未能提取到年份信息，从文件夹名称中尝试提取
-        if not year and folder_name:
-            folder_year = re.search(year_pattern, folder_name)
-            if folder_year:
-                result['发行年份'] = folder_year.group()
-
-        return result
-
-    # 判断是电影还是电视剧
-    is_tv = re.search(r'(?:S\d{1,2}|E\d{1,2}|EP\d{1,2})', filename)
-    if is_tv:
-        return extract_tv_info(filename, folder_name)
-    else:
-        return extract_movie_info(filename, folder_name)
+def write_temp_file(src, tmp, action, same_fs):
+    """按指定方式将源文件写入临时文件，返回 (实际使用的方式, 复制时计算的文件哈希)"""
+    if action in ('hardlink', 'auto') and same_fs:
+        try:
+            os.link(src, tmp)
+            return 'hardlink', None
+        except OSError as e:
+            if action == 'hardlink':
+                logger.warning(f"无法创建硬链接，改为复制: {e}")
+            else:
+                logger.debug(f"无法创建硬链接: {e}")
+    elif action == 'hardlink':
+        logger.warning(f"源文件与目标目录不在同一文件系统，无法创建硬链接，改为复制: {src}")
+
+    if action in ('reflink', 'auto') and same_fs:
+        try:
+            reflink_file(src, tmp)
+            return 'reflink', None
+        except (OSError, ImportError) as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if action == 'reflink':
+                logger.warning(f"文件系统不支持 reflink，改为复制: {e}")
+    elif action == 'reflink':
+        logger.warning(f"源文件与目标目录不在同一文件系统，无法使用 reflink，改为复制: {src}")
+
+    return 'copy', copy_file_data(src, tmp)
+
+def place_file(src, dst, action):
+    """将文件放置到目标路径，所有方式都先写临时文件再原子重命名，返回 (实际使用的方式, 文件哈希)"""
+    same_fs = same_filesystem(src, dst)
+    if action == 'move' and same_fs:
+        # 同一文件系统内的移动本身就是原子的重命名
+        try:
+            os.replace(src, dst)
+            return 'move', None
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # 同一文件系统的两个绑定挂载（如 Docker 中的 /Downloads 和 /Media）或 overlay 挂载之间不能重命名，改为复制后删除源文件
+            logger.debug(f"无法直接重命名，改为复制: {e}")
+            same_fs = False
+    tmp = temp_path_for(dst)
+    try:
+        method, checksum = write_temp_file(src, tmp, 'copy' if action == 'move' else action, same_fs)
+        os.replace(tmp, dst)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if action == 'move':
+        # 跨文件系统移动在复制（及校验）成功后才删除源文件
+        os.remove(src)
+        return 'move', checksum
+    return method, checksum
 
 def move_or_copy_file(src, dst, action):
+    """转移文件，返回 (是否成功, 复制时计算的文件哈希)"""
+    if action not in TRANSFER_ACTIONS:
+        logger.error(f"未知操作: {action}")
+        return False, None
     try:
-        if action == 'move':
-            shutil.move(src, dst)
+        method, checksum = place_file(src, dst, action)
+        if method == 'move':
             logger.info(f"文件已移动: {src} -> {dst}")
-        elif action == 'copy':
-            shutil.copy2(src, dst)
+        elif method == 'copy':
             logger.info(f"文件已复制: {src} -> {dst}")
+        elif method == 'hardlink':
+            logger.info(f"文件已硬链接: {src} -> {dst}")
         else:
-            logger.error(f"未知操作: {action}")
+            logger.info(f"文件已克隆（reflink）: {src} -> {dst}")
+        if checksum:
+            logger.info(f"校验通过（{transfer_settings['verify']}）: {checksum}")
+        return True, checksum
     except Exception as e:
         logger.error(f"文件操作失败: {e}")
+        return False, None
 
 def is_common_video_file(filename):
     common_video_extensions = ['.mkv', '.mp4', '.avi', '.mov']
@@ -260,22 +544,23 @@ def is_common_video_file(filename):
     return extension in common_video_extensions
 
 def is_unfinished_download_file(filename):
-    unfinished_extensions = ['.xltd', '.!qB', '.part']
+    unfinished_extensions = ['.xltd', '.!qb', '.part', '.crdownload', '.tmp', '.aria2']
     extension = os.path.splitext(filename)[1].lower()
     return extension in unfinished_extensions
 
-def load_processed_files():
-    processed_filenames = set()
-    if os.path.exists(FILES_RECORD_PATH):
-        with open(FILES_RECORD_PATH, 'r') as f:
-            for line in f.read().splitlines():
-                processed_filenames.add(line.split('/')[-1])
-    return processed_filenames
+def has_unfinished_marker(file_path):
+    """下载器在文件旁写入的控制文件（如 aria2 的 .aria2）存在时，说明文件仍在下载"""
+    return any(os.path.exists(file_path + marker) for marker in ('.aria2', '.part', '.!qB'))
 
-def save_processed_files(processed_filenames):
-    with open(FILES_RECORD_PATH, 'w') as f:
-        for filename in processed_filenames:
-            f.write(filename + '\n')
+def open_ledger(directories):
+    config = read_config()
+    ledger = FileLedger(config['database']['db_path'], FILES_RECORD_PATH)
+    if ledger.migrated:
+        logger.info(f"已将 {ledger.migrated} 条旧版处理记录迁移到数据库")
+    removed = ledger.prune(config.getint('downloadtransfer', 'record_retention_days', fallback=30), directories)
+    if removed:
+        logger.info(f"已清理 {removed} 条失效的处理记录")
+    return ledger
 
 def refresh_media_library():
     # 刷新媒体库
@@ -285,161 +570,874 @@ def refresh_media_library():
     # 刷新媒体库tmdb_id
     subprocess.run(['python', 'tmdb_id.py'])
 
-def process_file(file_path, processed_filenames):
-    try:
-        config = read_config()
-        excluded_filenames = config['downloadtransfer']['excluded_filenames'].split(',')
-        action = config['downloadtransfer']['action']
-        movie_directory = config['mediadir']['movies_path']
-        episode_directory = config['mediadir']['episodes_path']
+# 通知媒体服务器按路径刷新，启动时根据 [mediaserver] 配置创建
+media_notifier = None
 
-        filename = os.path.basename(file_path)
-        folder_name = os.path.basename(os.path.dirname(file_path))
+# 媒体库刷新在多个工作线程间共享，需要加锁
+refresh_lock = threading.Lock()
 
-        if not is_common_video_file(filename) and is_unfinished_download_file(filename):
-            logger.debug(f"跳过下载未完成文件：{file_path}")
-            return
+class WatchRoot:
+    """一个下载监听目录及其转移规则"""
 
-        extension = os.path.splitext(filename)[1].lower()
-        if filename in excluded_filenames:
-            logger.debug(f"跳过文件（文件名在排除列表中）: {file_path}")
-            return
-        if '【更多' in filename:
-            logger.debug(f"跳过文件（包含特定字符）: {file_path}")
-            return
+    def __init__(self, name, directory, action, excluded_filenames, movies_path, episodes_path, lane=None):
+        self.name = name
+        self.directory = os.path.normpath(directory)
+        self.action = action
+        self.excluded_filenames = excluded_filenames
+        self.movies_path = movies_path
+        self.episodes_path = episodes_path
+        self.lane = lane
+
+    def contains(self, file_path):
+        return file_path == self.directory or file_path.startswith(self.directory.rstrip('/') + '/')
+
+def read_watch_roots(config):
+    """读取监听目录列表。[downloadtransfer] watch_roots 列出的每个名称对应一个 [watch:名称] 配置段，
+    未设置的选项沿用 [downloadtransfer] 与 [mediadir] 中的配置；未配置 watch_roots 时只监听 directory"""
+    defaults = config['downloadtransfer']
+    names = [name.strip() for name in defaults.get('watch_roots', '').split(',') if name.strip()]
+    sections = [(name, config[f'watch:{name}']) for name in names if config.has_section(f'watch:{name}')]
+    for name in names:
+        if not config.has_section(f'watch:{name}'):
+            logger.warning(f"未找到监听目录配置段 [watch:{name}]，已忽略")
+    if not sections:
+        sections = [('default', defaults)]
+    roots = []
+    for name, section in sections:
+        roots.append(WatchRoot(
+            name,
+            section['directory'],
+            section.get('action', defaults.get('action', 'copy')),
+            section.get('excluded_filenames', defaults.get('excluded_filenames', '')).split(','),
+            section.get('movies_path', config['mediadir']['movies_path']),
+            section.get('episodes_path', config['mediadir']['episodes_path']),
+            section.get('lane') or None,
+        ))
+    return roots
+
+def find_watch_root(roots, file_path):
+    """返回文件所属的监听目录，嵌套时取最深的一个"""
+    matches = [root for root in roots if root.contains(file_path)]
+    return max(matches, key=lambda root: len(root.directory)) if matches else None
+
+def schedule_retry(ledger, file_path, reason):
+    attempts, delay = ledger.schedule_retry(file_path, reason)
+    logger.info(f"已加入重试队列（第 {attempts} 次失败，{delay // 60} 分钟后重试）: {file_path}")
+
+def discard_retry(ledger, file_path):
+    """按规则跳过、不再需要处理的文件移出重试队列，否则会被定期重新加入转移队列"""
+    if ledger.retry_state(file_path):
+        ledger.clear_retry(file_path)
+        logger.info(f"文件无需处理，移出重试队列: {file_path}")
+
+def inspect_file(file_path, excluded_filenames, ledger):
+    """过滤并解析单个文件，需要转移时返回解析结果"""
+    filename = os.path.basename(file_path)
+    folder_name = os.path.basename(os.path.dirname(file_path))
 
-        result = extract_info(filename, folder_name)
-        if result:
-            logger.info(f"文件名: {filename}")
-            logger.info(f"解析结果: {result}")
+    if not is_common_video_file(filename) and is_unfinished_download_file(filename):
+        logger.debug(f"跳过下载未完成文件：{file_path}")
+        discard_retry(ledger, file_path)
+        return None
+    if filename in excluded_filenames:
+        logger.debug(f"跳过文件（文件名在排除列表中）: {file_path}")
+        discard_retry(ledger, file_path)
+        return None
+    if '【更多' in filename:
+        logger.debug(f"跳过文件（包含特定字符）: {file_path}")
+        discard_retry(ledger, file_path)
+        return None
+    if ledger.contains(file_path):
+        logger.debug(f"文件已处理，跳过: {filename}")
+        discard_retry(ledger, file_path)
+        return None
+    retry = ledger.retry_state(file_path)
+    if retry and retry[0] > time.time():
+        # 等待下次重试，不重复解析和查询 TMDB
+        logger.debug(f"文件在重试队列中，跳过: {filename}")
+        return None
 
+    result = extract_info(filename, folder_name)
+    if retry and retry[1]:
+        # 使用 WEB 页面手动指定的名称和年份
+        result['名称'] = retry[1]
+        result['发行年份'] = retry[2] or result['发行年份']
+    if not result or not result['名称']:
+        logger.warning(f"无法解析文件名: {filename}")
+        schedule_retry(ledger, file_path, '无法解析文件名')
+        return None
+    logger.info(f"文件名: {filename}")
+    logger.info(f"解析结果: {result}")
+    return result
+
+def transfer_one(file_path, target_file_path, nfo_target_path, action, ledger):
+    """转移单个视频文件及同名NFO文件，成功后写入处理记录"""
+    identity = ledger.identify(file_path)
+    success, checksum = move_or_copy_file(file_path, target_file_path, action)
+    if not success:
+        schedule_retry(ledger, file_path, '文件转移失败')
+        return False
+    # 记录已处理的文件
+    ledger.record(file_path, target_file_path, identity, checksum)
+    ledger.clear_retry(file_path)
+    if media_notifier:
+        media_notifier.queue([(target_file_path, CHANGE_CREATED)])
+
+    nfo_file_path = os.path.splitext(file_path)[0] + '.nfo'
+    if os.path.exists(nfo_file_path):
+        move_or_copy_file(nfo_file_path, nfo_target_path, action)
+        logger.info(f"转移NFO文件: {nfo_file_path} -> {nfo_target_path}")
+    return True
+
+def transfer_group(media_type, name, year, items, root, config, ledger):
+    """转移同一部影片或同一部剧集的一组文件，TMDB 信息与目录只处理一次，返回成功转移的文件路径"""
+    action = root.action
+    target_directory = root.episodes_path if media_type == 'tv' else root.movies_path
+
+    tmdb_id, tmdb_name = get_tmdb_info(name, year, media_type)
+    if not tmdb_id:
+        logger.warning(f"未能获取到 TMDB ID: {name} ({year})")
+        for file_path, _ in items:
+            schedule_retry(ledger, file_path, f"未能获取到 TMDB ID: {name} ({year})")
+        return []
+    logger.info(f"获取到 TMDB ID: {tmdb_id}，名称：{tmdb_name}，共 {len(items)} 个文件")
+
+    title = tmdb_name if tmdb_name else name
+    target_base_dir = os.path.join(target_directory, f"{title} ({year})")
+
+    plans = []
+    for file_path, result in items:
+        if media_type == 'tv':
+            season_number = result['季']
+            episode_number = result['集']
+            target_dir = os.path.join(target_base_dir, f"Season {int(season_number)}")
+            episode_name = get_tv_episode_name(tmdb_id, season_number, episode_number)
+            base_name = f"{title} - S{season_number}E{episode_number.zfill(2)} - {episode_name}"
+        else:
+            target_dir = target_base_dir
+            base_name = f"{title} - ({year}) {result['视频质量']}"
+        plans.append((file_path, target_dir, base_name, result['后缀名']))
+
+    for target_dir in dict.fromkeys(plan[1] for plan in plans):
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+            logger.info(f"创建目录: {target_dir}")
+
+    workers = min(len(plans), config.getint('downloadtransfer', 'device_concurrency', fallback=1))
+    with ThreadPoolExecutor(max_workers=max(1, workers), initializer=apply_transfer_priority) as executor:
+        futures = [
+            executor.submit(
+                transfer_one,
+                file_path,
+                os.path.join(target_dir, f"{base_name}.{suffix}"),
+                os.path.join(target_dir, f"{base_name}.nfo"),
+                action,
+                ledger
+            )
+            for file_path, target_dir, base_name, suffix in plans
+        ]
+        transferred = []
+        for (file_path, _, _, _), future in zip(plans, futures):
+            # 单个文件出错不影响同组其他文件的处理记录
+            try:
+                if future.result():
+                    transferred.append(file_path)
+            except Exception as e:
+                logger.error(f"转移文件时发生错误: {file_path}, 错误: {e}")
+                schedule_retry(ledger, file_path, f"文件转移出错: {e}")
+        return transferred
+
+def process_files(file_paths, roots, ledger, tracker=None):
+    """处理同一文件夹下的一批文件：按名称分组，每组只查询一次 TMDB，全部转移完成后只刷新一次媒体库"""
+    config = read_config()
+
+    groups = {}
+    # 文件路径 -> (大小, 修改时间)
+    settled = {}
+    # 按规则跳过（已处理、排除列表等）的文件
+    checked = []
+    for file_path in file_paths:
+        if tracker and tracker.is_tracking(file_path) or has_unfinished_marker(file_path):
+            # 文件仍在写入，交由下载完成检测处理；在重试队列中的文件推迟下次重试，避免每次检查都重新入队
+            if ledger.retry_state(file_path):
+                schedule_retry(ledger, file_path, '文件仍在写入')
+            continue
+        root = find_watch_root(roots, file_path)
+        if root is None:
+            logger.warning(f"文件不在任何监听目录中，跳过: {file_path}")
+            discard_retry(ledger, file_path)
+            continue
+        try:
+            stat = os.stat(file_path)
+            settled[file_path] = (stat.st_size, stat.st_mtime_ns)
+            result = inspect_file(file_path, root.excluded_filenames, ledger)
+        except Exception as e:
+            logger.error(f"处理文件时发生错误: {file_path}, 错误: {e}")
+            continue
+        if not result:
+            # 无法解析或等待重试的文件已在重试队列中，重启后仍需核对
+            if ledger.retry_state(file_path) is None:
+                checked.append(file_path)
+        else:
             media_type = 'tv' if '季' in result and '集' in result else 'movie'
-            target_directory = episode_directory if media_type == 'tv' else movie_directory
-
-            tmdb_id, tmdb_name = get_tmdb_info(result['名称'], result['发行年份'], media_type)
-            if tmdb_id:
-                logger.info(f"获取到 TMDB ID: {tmdb_id}，名称：{tmdb_name}")
-
-                title = tmdb_name if tmdb_name else result['名称']
-                year = result['发行年份']
-                target_base_dir = os.path.join(target_directory, f"{title} ({year})")
-
-                if not os.path.exists(target_base_dir):
-                    os.makedirs(target_base_dir)
-                    logger.info(f"创建目录: {target_base_dir}")
-
-                if media_type == 'tv':
-                    season_number = result['季']
-                    episode_number = result['集']
-                    season_dir = os.path.join(target_base_dir, f"Season {int(season_number)}")
-                    if not os.path.exists(season_dir):
-                        os.makedirs(season_dir)
-                        logger.info(f"创建目录: {season_dir}")
-
-                    episode_name = get_tv_episode_name(tmdb_id, season_number, episode_number)
-                    new_filename = f"{title} - S{season_number}E{episode_number.zfill(2)} - {episode_name}.{result['后缀名']}"
-                    target_file_path = os.path.join(season_dir, new_filename)
-                else:
-                    new_filename = f"{title} - ({year}) {result['视频质量']}.{result['后缀名']}"
-                    target_file_path = os.path.join(target_base_dir, new_filename)
+            groups.setdefault((root, media_type, result['名称'], result['发行年份']), []).append((file_path, result))
+
+    transferred = []
+    for (root, media_type, name, year), items in groups.items():
+        try:
+            transferred += transfer_group(media_type, name, year, items, root, config, ledger)
+        except Exception as e:
+            logger.error(f"处理文件时发生错误: {name} ({year}), 错误: {e}")
+
+    # 记录核对进度，重启后不再重复核对；转移失败的文件不记录，重启后重新核对
+    for file_path in checked + transferred:
+        ledger.checkpoint(file_path, *settled[file_path])
+
+    if transferred:
+        logger.info(f"文件处理完成，共转移 {len(transferred)} 个文件，刷新本地数据库")
+        with refresh_lock:
+            refresh_media_library()
+
+def process_queued_file(file_path, transfer_queue, roots, ledger, tracker):
+    """处理队列中的文件，同一文件夹下仍在等待的文件合并为一批"""
+    siblings = transfer_queue.take_siblings(file_path)
+    try:
+        process_files([file_path] + siblings, roots, ledger, tracker)
+    finally:
+        transfer_queue.done(siblings)
+
+def device_of(file_path):
+    try:
+        return os.stat(os.path.dirname(file_path)).st_dev
+    except OSError:
+        return 0
+
+# 任务优先级：实时事件优先于启动时的存量文件
+PRIORITY_LIVE = 0
+PRIORITY_BACKLOG = 1
+
+class TransferQueue:
+    """按路径去重的任务队列，工作线程池按设备分道消费，避免同一块磁盘被并发读写"""
+
+    def __init__(self, worker, workers=2, lane_limit=1, lane_of=None):
+        self.worker = worker
+        # 文件所属的队列，默认按设备划分，监控目录可以指定独立的通道
+        self.lane_of = lane_of or device_of
+        self.workers = max(1, workers)
+        self.lane_limit = max(1, lane_limit)
+        self.condition = threading.Condition()
+        # 每个设备一条队列，按优先级分别保存等待处理的文件路径
+        self.lanes = defaultdict(lambda: (deque(), deque()))
+        # 各设备当前正在处理的任务数
+        self.lane_active = defaultdict(int)
+        # 等待中的路径 -> (优先级, 设备)，以及处理中的路径，用于去重
+        self.pending = {}
+        self.running = set()
+        # 与当前文件合并处理、已从队列中取出的同目录文件 -> 设备
+        self.taken = {}
+        # 处理过程中再次收到事件的路径，处理完成后重新入队
+        self.requeue = set()
+        self.threads = []
+        self.stopped = False
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"transfer-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"文件转移工作线程已启动，线程数: {self.workers}，单设备并发数: {self.lane_limit}")
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def put(self, file_path, priority=PRIORITY_LIVE):
+        """加入队列，立即返回，不阻塞调用方（监控线程）"""
+        with self.condition:
+            if file_path in self.pending:
+                queued_priority, device = self.pending[file_path]
+                if priority >= queued_priority:
+                    return False
+                # 存量文件收到实时事件时提升为实时任务
+                self.lanes[device][queued_priority].remove(file_path)
+            elif file_path in self.running:
+                self.requeue.add(file_path)
+                return False
+            else:
+                device = self.lane_of(file_path)
+            self.pending[file_path] = (priority, device)
+            self.lanes[device][priority].append(file_path)
+            self.condition.notify()
+        return True
+
+    def take_siblings(self, file_path):
+        """取出同一文件夹下仍在等待的文件，与当前文件合并为一批处理（如整季剧集）"""
+        folder = os.path.dirname(file_path)
+        siblings = []
+        with self.condition:
+            for sibling, (priority, device) in list(self.pending.items()):
+                if os.path.dirname(sibling) == folder:
+                    del self.pending[sibling]
+                    self.lanes[device][priority].remove(sibling)
+                    # 与当前文件一样视为处理中，处理期间再次收到的事件在 done() 后重新入队
+                    self.running.add(sibling)
+                    self.taken[sibling] = device
+                    siblings.append(sibling)
+        return siblings
+
+    def done(self, siblings):
+        """合并处理的一批文件完成后，释放 take_siblings() 取出的文件"""
+        with self.condition:
+            for sibling in siblings:
+                self._release(sibling, self.taken.pop(sibling))
+            self.condition.notify_all()
 
-                if filename in processed_filenames:
-                    logger.debug(f"文件已处理，跳过: {filename}")
+    def _release(self, file_path, device):
+        """处理完成后移出处理中的路径，处理期间再次收到事件的路径重新入队（调用方需持有锁）"""
+        self.running.discard(file_path)
+        if file_path in self.requeue:
+            self.requeue.discard(file_path)
+            self.pending[file_path] = (PRIORITY_LIVE, device)
+            self.lanes[device][PRIORITY_LIVE].append(file_path)
+
+    def _next_task(self):
+        """取出一个可执行的任务，所在设备并发数已满的队列暂不调度"""
+        for priority in (PRIORITY_LIVE, PRIORITY_BACKLOG):
+            for device, lanes in self.lanes.items():
+                if lanes[priority] and self.lane_active[device] < self.lane_limit:
+                    file_path = lanes[priority].popleft()
+                    del self.pending[file_path]
+                    self.running.add(file_path)
+                    self.lane_active[device] += 1
+                    return device, file_path
+        return None
+
+    def _run(self):
+        apply_transfer_priority()
+        while True:
+            with self.condition:
+                task = self._next_task()
+                while task is None and not self.stopped:
+                    self.condition.wait()
+                    task = self._next_task()
+                if task is None:
                     return
+            device, file_path = task
+            try:
+                self.worker(file_path)
+            except Exception as e:
+                logger.error(f"处理队列任务时发生错误: {file_path}, 错误: {e}")
+            finally:
+                with self.condition:
+                    self.lane_active[device] -= 1
+                    self._release(file_path, device)
+                    self.condition.notify_all()
 
-                move_or_copy_file(file_path, target_file_path, action)
-                processed_filenames.add(filename)
+# 下载暂停超过该时长后不再跟踪
+TRACKING_TTL = 86400
 
-                video_dir = os.path.dirname(file_path)
-                nfo_filename = os.path.splitext(filename)[0] + '.nfo'
-                nfo_file_path = os.path.join(video_dir, nfo_filename)
-                if os.path.exists(nfo_file_path):
-                    new_nfo_filename = f"{title} - S{season_number}E{episode_number.zfill(2)} - {episode_name}.nfo" if media_type == 'tv' else f"{title} - ({year}) {result['视频质量']}.nfo"
-                    nfo_target_path = os.path.join(target_base_dir if media_type == 'movie' else season_dir, new_nfo_filename)
-                    move_or_copy_file(nfo_file_path, nfo_target_path, action)
-                    logger.info(f"转移NFO文件: {nfo_file_path} -> {nfo_target_path}")
+class CompletionTracker:
+    """合并同一路径的文件事件，确认下载完成且大小、修改时间稳定后再加入转移队列"""
 
-                logger.info(f"文件处理完成，刷新本地数据库")
-                refresh_media_library()
+    def __init__(self, transfer_queue, stable_seconds=10, closed_seconds=2, poll_interval=1):
+        self.transfer_queue = transfer_queue
+        # 未收到关闭写入事件时，文件需要保持不变的时长
+        self.stable_seconds = stable_seconds
+        # 收到 IN_CLOSE_WRITE / IN_MOVED_TO 后，文件需要保持不变的时长
+        self.closed_seconds = min(closed_seconds, stable_seconds)
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        # 路径 -> {'size', 'mtime', 'stable_since', 'closed'}
+        self.candidates = {}
+        self.stop_event = threading.Event()
+        self.thread = None
 
-                # 保存已处理的文件列表
-                save_processed_files(processed_filenames)
+    def touch(self, file_path, closed=False):
+        """记录一次文件事件，只更新内存状态，不做任何 IO"""
+        with self.lock:
+            state = self.candidates.get(file_path)
+            if state is None:
+                state = self.candidates[file_path] = {'size': None, 'mtime': None, 'stable_since': time.monotonic(), 'closed': False}
+            if closed:
+                state['closed'] = True
             else:
-                logger.warning(f"未能获取到 TMDB ID: {result['名称']} ({result['发行年份']})")
-        else:
-            logger.warning(f"无法解析文件名: {filename}")
-    except Exception as e:
-        logger.error(f"处理文件时发生错误: {file_path}, 错误: {e}")
+                state['stable_since'] = time.monotonic()
+
+    def forget(self, file_path):
+        with self.lock:
+            self.candidates.pop(file_path, None)
+
+    def is_tracking(self, file_path):
+        with self.lock:
+            return file_path in self.candidates
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="completion-tracker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            self.check()
+
+    def check(self):
+        now = time.monotonic()
+        with self.lock:
+            paths = list(self.candidates.items())
+        for file_path, state in paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                self.forget(file_path)
+                continue
+            with self.lock:
+                if (stat.st_size, stat.st_mtime) != (state['size'], state['mtime']):
+                    # 文件仍在变化，重新开始计时
+                    state['size'], state['mtime'] = stat.st_size, stat.st_mtime
+                    state['stable_since'] = now
+                    continue
+                window = self.closed_seconds if state['closed'] else self.stable_seconds
+                if now - state['stable_since'] < window:
+                    continue
+            if has_unfinished_marker(file_path):
+                if now - state['stable_since'] > TRACKING_TTL:
+                    # 长时间暂停的下载不再跟踪，恢复下载后会重新收到文件事件
+                    self.forget(file_path)
+                continue
+            self.forget(file_path)
+            logger.info(f"下载文件已完成: {file_path}，加入转移队列")
+            self.transfer_queue.put(file_path)
 
 class CustomFileHandler(FileSystemEventHandler):
-    def __init__(self):
-        self.original_filenames = {}
-        self.unfinished_files = set()
-        self.processed_files = load_processed_files()
+    def __init__(self, tracker, ledger):
+        self.tracker = tracker
+        self.ledger = ledger
+
+    def _track(self, file_path, closed=False):
+        filename = os.path.basename(file_path)
+        if not is_common_video_file(filename) or is_unfinished_download_file(filename):
+            return
+        if self.ledger.contains(file_path, deep=False):
+            logger.debug(f"文件已处理，跳过: {filename}")
+            return
+        self.tracker.touch(file_path, closed)
 
     def on_created(self, event):
         if event.is_directory:
             return
-        file_path = event.src_path
-        filename = os.path.basename(file_path)
-        if is_unfinished_download_file(filename):
-            self.unfinished_files.add(file_path)
-            logger.debug(f"发现下载未完成文件: {file_path}，开始监控")
-        else:
-            logger.debug(f"新文件创建: {file_path}")
-            process_file(file_path, self.processed_files)
+        logger.debug(f"新文件创建: {event.src_path}")
+        self._track(event.src_path)
 
     def on_modified(self, event):
         if event.is_directory:
             return
-        file_path = event.src_path
-        filename = os.path.basename(file_path)
-        if file_path in self.unfinished_files:
-            if not is_unfinished_download_file(filename):
-                self.unfinished_files.remove(file_path)
-                logger.info(f"下载文件已完成: {file_path}，开始处理")
-                process_file(file_path, self.processed_files)
-        else:
-            logger.debug(f"文件修改: {file_path}")
-            if filename not in self.processed_files:
-                process_file(file_path, self.processed_files)
-            else:
-                logger.debug(f"文件已处理，跳过: {filename}")
+        self._track(event.src_path)
+
+    def on_closed(self, event):
+        # inotify IN_CLOSE_WRITE：写入方已关闭文件
+        if event.is_directory:
+            return
+        self._track(event.src_path, closed=True)
 
     def on_moved(self, event):
+        # inotify IN_MOVED_TO：下载器完成后将临时文件重命名为最终文件名
         if event.is_directory:
             return
-        old_file_path = event.src_path
-        new_file_path = event.dest_path
-        logger.debug(f"文件重命名: {old_file_path} -> {new_file_path}")
-        if os.path.basename(new_file_path) not in self.processed_files:
-            process_file(new_file_path, self.processed_files)
+        logger.debug(f"文件重命名: {event.src_path} -> {event.dest_path}")
+        self.tracker.forget(event.src_path)
+        self._track(event.dest_path, closed=True)
+
+def walk_video_files(directory):
+    """递归遍历目录，返回视频文件的 (路径, stat)"""
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and is_common_video_file(entry.name):
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"无法读取目录: {current}, 错误: {e}")
+
+class StartupReconciler:
+    """在后台核对下载目录中已存在的文件，按修改时间从新到旧交给工作线程处理，并记录进度。
+
+    启动时仍在下载的文件（最近修改过、大小或修改时间在核对期间发生变化、存在下载控制文件）
+    交给下载完成检测，确认稳定后再转移"""
+
+    def __init__(self, directory, transfer_queue, ledger, tracker):
+        self.directory = directory
+        self.transfer_queue = transfer_queue
+        self.ledger = ledger
+        self.tracker = tracker
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="startup-reconciler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        started = time.monotonic()
+        checkpoints = self.ledger.load_checkpoints()
+        backlog = []
+        seen = set()
+        skipped = 0
+        for file_path, stat in walk_video_files(self.directory):
+            seen.add(file_path)
+            if checkpoints.get(file_path) == (stat.st_size, stat.st_mtime_ns):
+                skipped += 1
+                continue
+            backlog.append((stat.st_mtime_ns, stat.st_size, file_path))
+        # 删除本目录下已不存在文件的进度记录；目录不可用（如网络共享未挂载）时保留全部进度
+        if directory_available(self.directory):
+            self.ledger.drop_checkpoints({path for path in checkpoints if under_directory(path, self.directory)} - seen)
+        else:
+            logger.warning(f"目录不存在或为空，保留已有的核对进度: {self.directory}")
+        backlog.sort(reverse=True)
+        settling = 0
+        for mtime_ns, size, file_path in backlog:
+            if not self.is_settled(file_path, size, mtime_ns):
+                settling += 1
+                self.tracker.touch(file_path)
+                continue
+            self.transfer_queue.put(file_path, PRIORITY_BACKLOG)
+        logger.info(f"启动核对：共 {len(seen)} 个视频文件，{skipped} 个上次已核对，{len(backlog) - settling} 个加入后台队列，"
+                    f"{settling} 个仍在写入、等待下载完成，耗时 {time.monotonic() - started:.1f} 秒")
+
+    def is_settled(self, file_path, size, mtime_ns):
+        """第二次读取文件状态：与遍历时一致且已有 stable_seconds 未修改时，认为文件已下载完成"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return True
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            return False
+        if time.time() - stat.st_mtime < self.tracker.stable_seconds:
+            return False
+        return not has_unfinished_marker(file_path)
+
+class RetryScheduler:
+    """定期将重试队列中到期的文件交给工作线程重新处理"""
+
+    def __init__(self, transfer_queue, ledger, interval=60):
+        self.transfer_queue = transfer_queue
+        self.ledger = ledger
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"检查重试队列时发生错误: {e}")
+
+    def check(self):
+        for file_path in self.ledger.due_retries():
+            if not os.path.exists(file_path):
+                self.ledger.clear_retry(file_path)
+                logger.info(f"文件已不存在，移出重试队列: {file_path}")
+                continue
+            logger.info(f"重试处理文件: {file_path}")
+            self.transfer_queue.put(file_path, PRIORITY_BACKLOG)
+
+def read_rss_bytes():
+    """读取当前进程的常驻内存大小，非 Linux 系统返回 None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def memory_stats(tracker, transfer_queue):
+    """统计各项内存状态的条目数和估算字节数"""
+    parse_info = parse_release_name.cache_info()
+    with tracker.lock:
+        tracking = {'entries': len(tracker.candidates), 'bytes': estimate_size(tracker.candidates)}
+    with transfer_queue.condition:
+        queued = {'entries': len(transfer_queue.pending), 'bytes': estimate_size(transfer_queue.pending)}
+    return {
+        'updated': int(time.time()),
+        'rss_bytes': read_rss_bytes(),
+        'caches': {
+            'tmdb': tmdb_cache.stats(),
+            'season': season_cache.stats(),
+            # lru_cache 无法遍历条目，只统计数量
+            'parse': {'entries': parse_info.currsize, 'maxsize': parse_info.maxsize, 'bytes': None},
+            'tracking': tracking,
+            'queue': queued,
+        },
+    }
+
+def write_memory_stats(tracker, transfer_queue):
+    """写入内存统计文件供 WEB 管理页面读取"""
+    tmp = MEMORY_STATS_PATH + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(memory_stats(tracker, transfer_queue), f)
+        os.replace(tmp, MEMORY_STATS_PATH)
+    except OSError as e:
+        logger.debug(f"写入内存统计失败: {e}")
+
+class TransmissionTrigger:
+    """通过 Transmission RPC 判断下载完成，只把完成的种子中的视频文件加入转移队列，不再监控整个下载目录。
+    定期用 torrent-get 查询最近有变化的种子的 percentDone，也可以接收 Transmission 下载完成脚本的回调"""
+
+    def __init__(self, client, transfer_queue, path_map=None, interval=10, callback_port=0, full_sync_every=60):
+        self.client = client
+        self.transfer_queue = transfer_queue
+        self.path_map = path_map or []
+        self.interval = interval
+        self.callback_port = callback_port
+        # 每隔若干次轮询查询一次全部种子，清理已删除种子的记录
+        self.full_sync_every = full_sync_every
+        self.lock = threading.Lock()
+        # 已加入转移队列的种子 hash
+        self.finished = set()
+        self.polls = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="transmission-trigger", daemon=True)
+        self.thread.start()
+        if self.callback_port:
+            self.server = ThreadingHTTPServer(('', self.callback_port), self._callback_handler())
+            threading.Thread(target=self.server.serve_forever, name="transmission-callback", daemon=True).start()
+            logger.info(f"已在端口 {self.callback_port} 接收 Transmission 下载完成回调")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except (requests.RequestException, TransmissionError, ValueError) as e:
+                logger.error(f"查询 Transmission 失败: {e}")
+            if self.stop_event.wait(self.interval):
+                break
+
+    def poll(self):
+        initial = self.polls == 0
+        full = self.polls % self.full_sync_every == 0
+        self.polls += 1
+        torrents, _ = self.client.get_torrents(None if full else 'recently-active')
+        finished = set()
+        for torrent in torrents:
+            if not is_finished(torrent):
+                # 重新校验或追加下载文件的种子，完成后需要再次处理
+                with self.lock:
+                    self.finished.discard(torrent['hashString'])
+                continue
+            finished.add(torrent['hashString'])
+            # 启动时已完成的种子按存量文件处理，已转移过的文件由处理记录过滤
+            self.dispatch(torrent, PRIORITY_BACKLOG if initial else PRIORITY_LIVE)
+        if full:
+            with self.lock:
+                self.finished &= finished
+
+    def on_torrent_done(self, torrent_hash):
+        """下载完成回调：按 hash 查询该种子的文件列表并加入转移队列"""
+        torrents, _ = self.client.get_torrents([torrent_hash])
+        for torrent in torrents:
+            if is_finished(torrent):
+                self.dispatch(torrent, PRIORITY_LIVE)
+
+    def dispatch(self, torrent, priority):
+        with self.lock:
+            if torrent['hashString'] in self.finished:
+                return
+            self.finished.add(torrent['hashString'])
+        file_paths = [map_path(file_path, self.path_map) for file_path in torrent_file_paths(torrent)]
+        video_paths = [file_path for file_path in file_paths if is_common_video_file(os.path.basename(file_path))]
+        if not video_paths:
+            return
+        logger.info(f"种子下载完成: {torrent['name']}，{len(video_paths)} 个视频文件加入转移队列")
+        for file_path in video_paths:
+            self.transfer_queue.put(file_path, priority)
+
+    def _callback_handler(self):
+        trigger = self
+
+        class CallbackHandler(BaseHTTPRequestHandler):
+            # 下载完成脚本示例：curl -d "hash=$TR_TORRENT_HASH" http://地址:端口/torrent-done
+            def do_POST(self):
+                if urlparse(self.path).path != '/torrent-done':
+                    self.send_error(404)
+                    return
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8', 'replace')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    torrent_hash = json.loads(body or '{}').get('hash')
+                else:
+                    torrent_hash = (parse_qs(body).get('hash') or parse_qs(urlparse(self.path).query).get('hash') or [None])[0]
+                if not torrent_hash:
+                    self.send_error(400, 'missing hash')
+                    return
+                self.send_response(202)
+                self.end_headers()
+                try:
+                    trigger.on_torrent_done(torrent_hash)
+                except (requests.RequestException, TransmissionError, ValueError) as e:
+                    logger.error(f"处理 Transmission 回调失败: {e}")
+
+            def log_message(self, format, *args):
+                logger.debug(f"Transmission 回调: {format % args}")
+
+        return CallbackHandler
+
+def create_transmission_trigger(transfer_queue):
+    config = read_config()
+    client = TransmissionClient(
+        config.get('download_mgmt', 'download_mgmt_url'),
+        config.get('download_mgmt', 'rpc_username', fallback=None),
+        config.get('download_mgmt', 'rpc_password', fallback=None),
+    )
+    return TransmissionTrigger(
+        client,
+        transfer_queue,
+        parse_path_map(config.get('download_mgmt', 'path_map', fallback='')),
+        config.getfloat('downloadtransfer', 'transmission_poll_interval', fallback=10),
+        config.getint('downloadtransfer', 'transmission_callback_port', fallback=0),
+    )
+
+def create_observers(roots, event_handler):
+    """根据配置和挂载类型选择监控方式：网络文件系统收不到 inotify 事件，改为轮询。
+    所有使用 inotify 的目录共用一个 Observer，所有轮询的目录共用一个 PollingWatcher"""
+    config = read_config()
+    watch_mode = config.get('downloadtransfer', 'watch_mode', fallback='auto').strip().lower()
+    observer = poller = None
+    for root in roots:
+        if watch_mode == 'poll' or watch_mode == 'auto' and needs_polling(root.directory):
+            if poller is None:
+                min_interval = config.getfloat('downloadtransfer', 'poll_min_interval', fallback=2)
+                max_interval = config.getfloat('downloadtransfer', 'poll_max_interval', fallback=30)
+                poller = PollingWatcher(min_interval, max_interval, file_filter=is_common_video_file)
+            logger.info(f"目录 {root.directory} 的文件系统类型为 {mount_type(root.directory)}，使用轮询方式监控")
+            poller.schedule(event_handler, root.directory, recursive=True)
         else:
-            logger.debug(f"文件已处理，跳过: {os.path.basename(new_file_path)}")
-
-def start_monitoring(directory):
-    logger.info(f"开始监控目录: {directory}")
-    event_handler = CustomFileHandler()
-    observer = Observer()
-    observer.schedule(event_handler, directory, recursive=True)
-    observer.start()
+            if observer is None:
+                observer = Observer()
+            observer.schedule(event_handler, root.directory, recursive=True)
+    return [watcher for watcher in (observer, poller) if watcher is not None]
+
+def create_transfer_queue(roots):
+    config = read_config()
+    workers = config.getint('downloadtransfer', 'workers', fallback=2)
+    lane_limit = config.getint('downloadtransfer', 'device_concurrency', fallback=1)
+
+    def lane_of(file_path):
+        # 指定了通道的监听目录使用独立队列，否则按设备划分
+        root = find_watch_root(roots, file_path)
+        return f"lane:{root.lane}" if root and root.lane else device_of(file_path)
+
+    return TransferQueue(None, workers, lane_limit, lane_of)
+
+def start_media_notifier():
+    global media_notifier
+    notifier = MediaServerNotifier.from_config(read_config())
+    if not notifier.enabled:
+        return None
+    notifier.start(
+        on_sent=lambda sent: logger.info(f"已通知媒体服务器刷新 {sent} 个路径"),
+        on_error=lambda e: logger.error(f"通知媒体服务器失败: {e}"),
+    )
+    logger.info(f"媒体服务器刷新通知已启用: {notifier.server_type} {notifier.server_url}")
+    media_notifier = notifier
+    return notifier
+
+def start_monitoring(roots):
+    for root in roots:
+        logger.info(f"开始监控目录 [{root.name}]: {root.directory}，动作: {root.action}")
+    watch_directories = [root.directory for root in roots]
+    ledger = open_ledger(watch_directories)
+    tmdb_cache.store = season_cache.store = ledger
+    configure_transfer(read_config())
+    notifier = start_media_notifier()
+    retention_days = read_config().getint('downloadtransfer', 'record_retention_days', fallback=30)
+    transfer_queue = create_transfer_queue(roots)
+    stable_seconds = read_config().getint('downloadtransfer', 'stable_seconds', fallback=10)
+    tracker = CompletionTracker(transfer_queue, stable_seconds)
+    transfer_queue.worker = functools.partial(process_queued_file, transfer_queue=transfer_queue, roots=roots, ledger=ledger, tracker=tracker)
+    transfer_queue.start()
+    observers = []
+    transmission = None
+    if read_config().get('downloadtransfer', 'trigger', fallback='watch').strip().lower() == 'transmission':
+        # 由 Transmission 告知下载完成的种子，启动时的首次查询同时处理存量文件
+        logger.info("使用 Transmission RPC 判断下载完成")
+        transmission = create_transmission_trigger(transfer_queue)
+        transmission.start()
+    else:
+        tracker.start()
+        event_handler = CustomFileHandler(tracker, ledger)
+        observers = create_observers(roots, event_handler)
+        for observer in observers:
+            observer.start()
+        # 在后台处理已存在的文件
+        for root in roots:
+            StartupReconciler(root.directory, transfer_queue, ledger, tracker).start()
+    retry_scheduler = RetryScheduler(transfer_queue, ledger)
+    retry_scheduler.start()
     try:
-        # 处理已存在的文件
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if is_common_video_file(file_path) or is_unfinished_download_file(file_path):
-                    filename = os.path.basename(file_path)
-                    if filename not in event_handler.processed_files:
-                        process_file(file_path, event_handler.processed_files)
+        last_prune = last_stats = time.monotonic()
         while True:
             time.sleep(1)
+            # 每分钟更新一次内存统计
+            if time.monotonic() - last_stats > 60:
+                write_memory_stats(tracker, transfer_queue)
+                last_stats = time.monotonic()
+            # 每天清理一次超过保留期且源文件已不存在的处理记录和过期的元数据缓存
+            if time.monotonic() - last_prune > 86400:
+                ledger.prune(retention_days, watch_directories)
+                ledger.prune_cache(METADATA_CACHE_TTL)
+                last_prune = time.monotonic()
     except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
+        for observer in observers:
+            observer.stop()
+    for observer in observers:
+        observer.join()
+    if transmission:
+        transmission.stop()
+    retry_scheduler.stop()
+    tracker.stop()
+    transfer_queue.stop()
+    if notifier:
+        notifier.stop()
+    ledger.close()
     logger.info("实时监控已停止")
 
 if __name__ == "__main__":
     config = read_config()
-    directory = config['downloadtransfer']['directory']
-    start_monitoring(directory)
\ No newline at end of file
+    start_monitoring(read_watch_roots(config))
\ No newline at end of file
@@ -5,6 +5,7 @@ import xml.etree.ElementTree as ET
 import logging
 import configparser
 import requests
+from media_parser import normalize_title
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s', encoding='utf-8')
@@ -16,6 +17,38 @@ def read_config(config_file):
     config.read(config_file)
     return config
 
+def create_tmdb_tables(cursor):
+    """创建 rss.py 写入、check_rss.py 读取的TMDB相关表（如果不存在），两个脚本的运行顺序不固定"""
+    # 豆瓣ID对应的TMDB ID，订阅核对时按TMDB ID与媒体库匹配，tmdb_id 为空表示未找到
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS DOUBAN_TMDB_MAP (
+            douban_id TEXT PRIMARY KEY,
+            media_type TEXT NOT NULL,
+            tmdb_id INTEGER,
+            resolved_at INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_douban_tmdb_map_tmdb ON DOUBAN_TMDB_MAP (tmdb_id)')
+
+    # TMDB中订阅电视剧每一季的播出日期，air_date 为空表示尚未确定
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS TMDB_SEASONS (
+            tmdb_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            fetched_at INTEGER NOT NULL,
+            PRIMARY KEY (tmdb_id, season)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS TMDB_EPISODES (
+            tmdb_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            episode INTEGER NOT NULL,
+            air_date TEXT,
+            PRIMARY KEY (tmdb_id, season, episode)
+        )
+    ''')
+
 def parse_nfo(file_path):
     """解析NFO文件，返回title, year和tmdb id"""
     logging.debug(f"解析NFO文件: {file_path}")
@@ -25,7 +58,7 @@ def parse_nfo(file_path):
         
         # 查找<title>元素
         title_element = root.find('title')
-        title = title_element.text.strip().lower() if title_element is not None else None
+        title = title_element.text.strip() if title_element is not None and title_element.text else None
         
         # 查找<year>元素
         year_element = root.find('year')
@@ -41,23 +74,21 @@ def parse_nfo(file_path):
         logging.error(f"解析 {file_path} 时出错: {e}")
         return None, None, None
 
-def find_and_parse_nfo_files(directory, title, year):
-    """在给定目录中查找所有NFO文件并解析它们，返回匹配的tmdb_id"""
-    logging.info(f"在目录 {directory} 中查找所有NFO文件，标题: {title}, 年份: {year}")
-    title = title.lower().strip()
-    year = str(year).strip()  # 确保 year 是字符串类型
+def load_nfo_index(directory):
+    """遍历目录中的所有NFO文件，返回 {(标题匹配键, 年份): tmdb_id}，每个目录只解析一次"""
+    logging.info(f"在目录 {directory} 中查找所有NFO文件")
+    index = {}
     for root, dirs, files in os.walk(directory):
         for file in files:
             if file.endswith('.nfo'):
                 file_path = os.path.join(root, file)
                 parsed_title, parsed_year, tmdb_id = parse_nfo(file_path)
-                if parsed_title == title and parsed_year == year:
-                    logging.info(f"找到匹配的NFO文件: {file_path}, tmdb_id: {tmdb_id}")
-                    return tmdb_id
-                else:
-                    logging.debug(f"不匹配的NFO文件: {file_path}, 解析标题: {parsed_title}, 解析年份: {parsed_year}")
-    logging.info(f"未找到匹配的NFO文件，标题: {title}, 年份: {year}")
-    return None
+                title_key = normalize_title(parsed_title)
+                # 标题为空白时没有匹配键，不加入索引，以免与同样没有匹配键的记录误配
+                if title_key and tmdb_id:
+                    index.setdefault((title_key, parsed_year), tmdb_id)
+    logging.info(f"找到 {len(index)} 个包含tmdb_id的NFO文件")
+    return index
 
 def query_tmdb_api(title, year, media_type, config):
     """通过TMDB API查询获取tmdb_id"""
@@ -91,6 +122,29 @@ def query_tmdb_api(title, year, media_type, config):
     logging.info(f"未找到匹配的tmdb_id, 标题: {title}, 年份: {year}")
     return None
 
+def query_tmdb_season(tmdb_id, season, config):
+    """通过TMDB API查询电视剧某一季每集的播出日期，返回 [(集数, 播出日期)]，查询出错时返回 None"""
+    url = f"{config['tmdb']['base_url']}/tv/{tmdb_id}/season/{season}"
+    params = {
+        'api_key': config['tmdb']['api_key'],
+        'language': 'zh-CN'
+    }
+    logging.info(f"通过TMDB API查询 {tmdb_id} 第{season}季的播出日期")
+    try:
+        response = requests.get(url, params=params, timeout=10)
+        if response.status_code == 404:
+            logging.info(f"TMDB中没有 {tmdb_id} 第{season}季")
+            return []
+        response.raise_for_status()
+        return [
+            (episode['episode_number'], episode.get('air_date') or None)
+            for episode in response.json().get('episodes', [])
+            if episode.get('episode_number')
+        ]
+    except Exception as e:
+        logging.error(f"查询TMDB API时出错: {e}")
+        return None
+
 def update_database(db_path, table, title, year, tmdb_id):
     """更新数据库中的tmdb_id字段"""
     conn = sqlite3.connect(db_path)
@@ -127,7 +181,7 @@ def fetch_data_without_tmdb_id(db_path, table):
     logging.debug(f"从数据库 {db_path} 获取没有tmdb_id的数据, 表: {table}")
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
-    cursor.execute(f"SELECT title, year FROM {table} WHERE tmdb_id IS NULL OR tmdb_id = ''")
+    cursor.execute(f"SELECT title, year, title_key FROM {table} WHERE tmdb_id IS NULL OR tmdb_id = ''")
     rows = cursor.fetchall()
     conn.close()
     logging.debug(f"获取到 {len(rows)} 条没有tmdb_id的数据")
@@ -147,20 +201,26 @@ def main():
     episodes_without_tmdb_id = fetch_data_without_tmdb_id(db_path, 'LIB_TVS')
 
     # 处理电影记录
-    for title, year in movies_without_tmdb_id:
+    movie_nfos = load_nfo_index(movies_path) if movies_without_tmdb_id else {}
+    for title, year, title_key in movies_without_tmdb_id:
         logging.info(f"处理电影记录, 标题: {title}, 年份: {year}")
         # 尝试从NFO文件中读取tmdb_id
-        tmdb_id = find_and_parse_nfo_files(movies_path, title, year)
+        tmdb_id = movie_nfos.get((title_key, str(year).strip()))
+        if tmdb_id:
+            logging.info(f"找到匹配的NFO文件, tmdb_id: {tmdb_id}")
         if not tmdb_id:
             # 调用TMDB API获取tmdb_id
             tmdb_id = query_tmdb_api(title, year, 'movie', config)
         update_database(db_path, 'LIB_MOVIES', title, year, tmdb_id)
 
     # 处理电视剧记录
-    for title, year in episodes_without_tmdb_id:
+    episode_nfos = load_nfo_index(episodes_path) if episodes_without_tmdb_id else {}
+    for title, year, title_key in episodes_without_tmdb_id:
         logging.info(f"处理电视剧记录, 标题: {title}, 年份: {year}")
         # 尝试从NFO文件中读取tmdb_id
-        tmdb_id = find_and_parse_nfo_files(episodes_path, title, year)
+        tmdb_id = episode_nfos.get((title_key, str(year).strip()))
+        if tmdb_id:
+            logging.info(f"找到匹配的NFO文件, tmdb_id: {tmdb_id}")
         if not tmdb_id:
             # 调用TMDB API获取tmdb_id
             tmdb_id = query_tmdb_api(title, year, 'tv', config)
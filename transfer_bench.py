@@ -0,0 +1,52 @@
+import os
+import sys
+import shutil
+import tempfile
+import sync
+
+# (说明, 文件大小)，覆盖小于抽样分块、不是分块整数倍、恰好为分块整数倍的文件
+SIZES = [
+    ('空文件', 0),
+    ('小于 64 KiB（NFO、字幕）', 1000),
+    ('恰好 64 KiB', sync.VERIFY_SAMPLE_SIZE),
+    ('不是 64 KiB 的整数倍', 1049076),
+    ('恰好 1 MiB 的整数倍', 3 * 1024 * 1024),
+]
+# 较小的分块让中等大小的文件也有多个抽样位置，最后一个分块不满
+CHUNK_SIZES = [1024 * 1024, 8 * 1024 * 1024]
+
+def check_verified_copy():
+    """抽样和完整回读校验下复制各种大小的文件，校验应通过且内容一致"""
+    directory = tempfile.mkdtemp()
+    sync.transfer_progress.path = os.path.join(directory, 'progress.json')
+    failures = total = 0
+    try:
+        for verify in sync.VERIFY_MODES:
+            for chunk_size in CHUNK_SIZES:
+                sync.transfer_settings.update(verify=verify, chunk_size=chunk_size)
+                for description, size in SIZES:
+                    total += 1
+                    src = os.path.join(directory, 'source.mkv')
+                    tmp = os.path.join(directory, 'target.mkv.tmp')
+                    data = os.urandom(size)
+                    with open(src, 'wb') as f:
+                        f.write(data)
+                    try:
+                        sync.copy_file_data(src, tmp)
+                        with open(tmp, 'rb') as f:
+                            if f.read() != data:
+                                raise sync.VerificationError("复制后的内容不一致")
+                    except sync.VerificationError as e:
+                        failures += 1
+                        print(f"复制校验失败: {description}（{size} 字节，{verify}，分块 {chunk_size // 1024 // 1024} MiB）: {e}")
+                    finally:
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+    finally:
+        shutil.rmtree(directory)
+    print(f"复制校验：{total - failures}/{total} 条通过")
+    return failures
+
+if __name__ == "__main__":
+    failed = check_verified_copy()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,226 @@
+import sys
+import json
+import time
+import socket
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from transmission_client import TransmissionClient, TransmissionError
+from sync import TransmissionTrigger, PRIORITY_BACKLOG, PRIORITY_LIVE
+
+# 模拟的种子：(hash, 名称, 下载目录, 完成度, 文件列表 [(文件名, 已下载字节, 总字节)])
+TORRENTS = [
+    ('aaa', '狂飙.S01.2160p', '/downloads/tv', 1,
+     [('狂飙.S01/狂飙.S01E01.2160p.mkv', 100, 100), ('狂飙.S01/狂飙.S01E02.2160p.mkv', 100, 100), ('狂飙.S01/说明.txt', 1, 1)]),
+    ('bbb', '繁花.S01.2160p', '/downloads/tv', 1,
+     [('繁花.S01/繁花.S01E01.2160p.mkv', 100, 100), ('繁花.S01/繁花.S01E02.2160p.mkv', 0, 100)]),
+    ('ccc', 'Dune.Part.Two.2024.2160p', '/downloads/movie', 0.5,
+     [('Dune.Part.Two.2024.2160p.mkv', 50, 100)]),
+]
+PATH_MAP = [('/downloads', '/mnt/downloads')]
+
+class FakeTransmission:
+    """本地模拟的 Transmission RPC 服务：缺少或使用过期的会话 ID 时返回 409"""
+
+    def __init__(self):
+        self.session_id = 'session-1'
+        self.torrents = {torrent[0]: torrent for torrent in TORRENTS}
+        self.recently_active = []
+        self.requests = []
+        self.conflicts = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        self.server.shutdown()
+
+    def torrent(self, torrent_hash):
+        torrent_hash, name, download_dir, percent_done, files = self.torrents[torrent_hash]
+        return {
+            'id': list(self.torrents).index(torrent_hash) + 1,
+            'hashString': torrent_hash,
+            'name': name,
+            'percentDone': percent_done,
+            'leftUntilDone': sum(length - completed for _, completed, length in files),
+            'downloadDir': download_dir,
+            'files': [{'name': file_name, 'bytesCompleted': completed, 'length': length} for file_name, completed, length in files],
+        }
+
+    def torrent_get(self, ids):
+        if ids is None:
+            selected = list(self.torrents)
+        elif ids == 'recently-active':
+            selected, self.recently_active = self.recently_active, []
+        else:
+            selected = [torrent_hash for torrent_hash in ids if torrent_hash in self.torrents]
+        return {'torrents': [self.torrent(torrent_hash) for torrent_hash in selected], 'removed': []}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+                if self.headers.get('X-Transmission-Session-Id') != fake.session_id:
+                    fake.conflicts += 1
+                    self.send_response(409)
+                    self.send_header('X-Transmission-Session-Id', fake.session_id)
+                    self.end_headers()
+                    return
+                fake.requests.append(payload)
+                if payload['method'] == 'torrent-get':
+                    body = {'result': 'success', 'arguments': fake.torrent_get(payload['arguments'].get('ids'))}
+                else:
+                    body = {'result': 'method not recognized'}
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+class RecordingQueue:
+    """记录加入转移队列的文件及优先级"""
+
+    def __init__(self):
+        self.items = []
+        self.condition = threading.Condition()
+
+    def put(self, file_path, priority):
+        with self.condition:
+            self.items.append((file_path, priority))
+            self.condition.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while len(self.items) < count and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return list(self.items)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def report(name, problems):
+    if problems:
+        print(f"{name}：未通过")
+        for problem in problems:
+            print(f"  {problem}")
+    else:
+        print(f"{name}：通过")
+    return len(problems)
+
+def check_handshake():
+    """首次请求和会话 ID 过期时都应先收到 409，再带新的会话 ID 重试成功"""
+    fake = FakeTransmission()
+    problems = []
+    try:
+        client = TransmissionClient(fake.url)
+        torrents, _ = client.get_torrents()
+        if fake.conflicts != 1 or len(torrents) != len(TORRENTS):
+            problems.append(f"首次握手：409 次数 {fake.conflicts}，返回 {len(torrents)} 个种子")
+        client.get_torrents()
+        if fake.conflicts != 1:
+            problems.append(f"会话 ID 未被复用，409 次数 {fake.conflicts}")
+        fake.session_id = 'session-2'
+        client.get_torrents()
+        if fake.conflicts != 2 or client.session.headers.get('X-Transmission-Session-Id') != 'session-2':
+            problems.append(f"会话 ID 过期后未重新握手，409 次数 {fake.conflicts}")
+        try:
+            client.call('session-close')
+            problems.append("RPC 返回失败结果时未抛出 TransmissionError")
+        except TransmissionError:
+            pass
+    finally:
+        fake.stop()
+    return report("会话 ID 握手", problems)
+
+def check_startup_backlog():
+    """启动时的首次全量查询按存量优先级处理已完成的种子，之后只处理新完成的种子"""
+    fake = FakeTransmission()
+    transfer_queue = RecordingQueue()
+    problems = []
+    try:
+        trigger = TransmissionTrigger(TransmissionClient(fake.url), transfer_queue, PATH_MAP, full_sync_every=10)
+        trigger.poll()
+        expected = [
+            ('/mnt/downloads/tv/狂飙.S01/狂飙.S01E01.2160p.mkv', PRIORITY_BACKLOG),
+            ('/mnt/downloads/tv/狂飙.S01/狂飙.S01E02.2160p.mkv', PRIORITY_BACKLOG),
+        ]
+        if transfer_queue.items != expected:
+            problems.append(f"启动时的存量文件: {transfer_queue.items}")
+        if fake.requests[0]['arguments'].get('ids') is not None:
+            problems.append("启动时未查询全部种子")
+
+        # 已处理的种子再次出现在最近变化列表中时不重复加入队列
+        fake.recently_active = ['aaa', 'ccc']
+        trigger.poll()
+        if len(transfer_queue.items) != 2:
+            problems.append(f"已处理的种子被重复加入队列: {transfer_queue.items[2:]}")
+        if fake.requests[-1]['arguments'].get('ids') != 'recently-active':
+            problems.append("后续轮询未只查询最近有变化的种子")
+
+        # 下载中的种子完成后按实时优先级加入队列
+        fake.torrents['ccc'] = ('ccc', 'Dune.Part.Two.2024.2160p', '/downloads/movie', 1,
+                                [('Dune.Part.Two.2024.2160p.mkv', 100, 100)])
+        fake.recently_active = ['ccc']
+        trigger.poll()
+        if transfer_queue.items[2:] != [('/mnt/downloads/movie/Dune.Part.Two.2024.2160p.mkv', PRIORITY_LIVE)]:
+            problems.append(f"新完成的种子: {transfer_queue.items[2:]}")
+    finally:
+        fake.stop()
+    return report("启动时的存量种子", problems)
+
+def check_callback():
+    """下载完成脚本的回调：表单和 JSON 两种格式，缺少 hash 返回 400，重复回调不重复加入队列"""
+    fake = FakeTransmission()
+    transfer_queue = RecordingQueue()
+    port = free_port()
+    # 轮询间隔足够长，启动后只有首次查询，之后的文件只能来自回调
+    trigger = TransmissionTrigger(TransmissionClient(fake.url), transfer_queue, PATH_MAP, interval=3600, callback_port=port)
+    problems = []
+    callback_url = f"http://127.0.0.1:{port}/torrent-done"
+    try:
+        trigger.start()
+        transfer_queue.wait_for(2)
+        fake.torrents['ccc'] = ('ccc', 'Dune.Part.Two.2024.2160p', '/downloads/movie', 1,
+                                [('Dune.Part.Two.2024.2160p.mkv', 100, 100)])
+        fake.torrents['ddd'] = ('ddd', '三体.S01E03.2160p', '/downloads/tv', 1,
+                                [('三体.S01E03.2160p.mp4', 100, 100)])
+
+        response = requests.post(callback_url, data={'hash': 'ccc'}, timeout=5)
+        items = transfer_queue.wait_for(3)
+        if response.status_code != 202 or items[2:] != [('/mnt/downloads/movie/Dune.Part.Two.2024.2160p.mkv', PRIORITY_LIVE)]:
+            problems.append(f"表单回调：状态码 {response.status_code}，队列 {items[2:]}")
+
+        response = requests.post(callback_url, json={'hash': 'ddd'}, timeout=5)
+        items = transfer_queue.wait_for(4)
+        if response.status_code != 202 or items[3:] != [('/mnt/downloads/tv/三体.S01E03.2160p.mp4', PRIORITY_LIVE)]:
+            problems.append(f"JSON 回调：状态码 {response.status_code}，队列 {items[3:]}")
+
+        requests.post(callback_url, data={'hash': 'ccc'}, timeout=5)
+        if len(transfer_queue.wait_for(5, timeout=0.5)) != 4:
+            problems.append("重复回调的种子被再次加入队列")
+
+        status = requests.post(callback_url, data={}, timeout=5).status_code
+        if status != 400:
+            problems.append(f"缺少 hash 时返回 {status}")
+        status = requests.post(f"http://127.0.0.1:{port}/other", data={'hash': 'ccc'}, timeout=5).status_code
+        if status != 404:
+            problems.append(f"未知路径返回 {status}")
+    finally:
+        trigger.stop()
+        fake.stop()
+    return report("下载完成回调", problems)
+
+if __name__ == "__main__":
+    failed = check_handshake() + check_startup_backlog() + check_callback()
+    sys.exit(1 if failed else 0)
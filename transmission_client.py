@@ -0,0 +1,53 @@
+import os
+import requests
+
+# torrent-get 需要的字段
+TORRENT_FIELDS = ['id', 'hashString', 'name', 'percentDone', 'leftUntilDone', 'downloadDir', 'files']
+
+class TransmissionError(Exception):
+    """Transmission RPC 调用失败"""
+
+class TransmissionClient:
+    """Transmission RPC 客户端，自动处理 X-Transmission-Session-Id 握手"""
+
+    def __init__(self, base_url, username=None, password=None, timeout=10):
+        base_url = base_url.rstrip('/')
+        self.rpc_url = base_url if base_url.endswith('/rpc') else f"{base_url}/transmission/rpc"
+        self.session = requests.Session()
+        if username:
+            self.session.auth = (username, password or '')
+        self.timeout = timeout
+
+    def call(self, method, arguments=None):
+        payload = {'method': method, 'arguments': arguments or {}}
+        for _ in range(2):
+            response = self.session.post(self.rpc_url, json=payload, timeout=self.timeout)
+            if response.status_code == 409:
+                # 会话 ID 过期或首次请求，使用服务器返回的新 ID 重试
+                self.session.headers['X-Transmission-Session-Id'] = response.headers.get('X-Transmission-Session-Id', '')
+                continue
+            response.raise_for_status()
+            data = response.json()
+            if data.get('result') != 'success':
+                raise TransmissionError(f"{method} 调用失败: {data.get('result')}")
+            return data.get('arguments', {})
+        raise TransmissionError(f"{method} 调用失败: 无法获取会话 ID")
+
+    def get_torrents(self, ids=None):
+        """返回 (种子列表, 已删除的种子 ID)。ids 可以是 ID 或 hash 列表，'recently-active' 表示最近有变化的种子"""
+        arguments = {'fields': TORRENT_FIELDS}
+        if ids is not None:
+            arguments['ids'] = ids
+        result = self.call('torrent-get', arguments)
+        return result.get('torrents', []), result.get('removed', [])
+
+def is_finished(torrent):
+    return torrent.get('percentDone') == 1 and torrent.get('leftUntilDone', 0) == 0
+
+def torrent_file_paths(torrent):
+    """种子中已下载完成的文件在 Transmission 中的完整路径（未勾选下载的文件不包含在内）"""
+    return [
+        os.path.join(torrent['downloadDir'], file['name'])
+        for file in torrent.get('files', [])
+        if file.get('bytesCompleted') == file.get('length')
+    ]
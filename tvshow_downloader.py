@@ -5,9 +5,11 @@ import configparser
 import os
 import logging
 import sqlite3  # 导入 sqlite3 模块
+import time
 from typing import List, Dict, Tuple
 import re  # 导入正则表达式模块
 from urllib.parse import urljoin  # 导入用于拼接URL的函数
+from media_parser import normalize_title
 
 # 配置日志功能
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
@@ -38,6 +40,10 @@ exclude_keywords = [kw.strip().lower() for kw in exclude_keywords_str.split(',')
 preferred_resolution = config.get("resources", "preferred_resolution", fallback="")
 fallback_resolution = config.get("resources", "fallback_resolution", fallback="")
 
+# 未搜索到资源后重新搜索的间隔，连续失败时加倍；新的一集播出后由 check_rss 清零并立即搜索
+SEARCH_RETRY_BASE_SECONDS = 12 * 3600
+SEARCH_RETRY_MAX_SECONDS = 7 * 24 * 3600
+
 # 创建会话对象并设置默认HTTP头信息
 session = requests.Session()
 headers = {
@@ -57,23 +63,49 @@ class TVInfoExtractor:
         self.db_path = db_path
         self.config = config
 
+    def schedule_search(self, tv_info, downloaded):
+        """记录搜索结果：下载到资源时清零，否则按连续失败次数推迟下次搜索"""
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                if downloaded:
+                    conn.execute('UPDATE MISS_TVS SET search_attempts = 0, next_search = 0 WHERE id = ?', (tv_info['id'],))
+                    return
+                attempts = conn.execute('SELECT search_attempts FROM MISS_TVS WHERE id = ?', (tv_info['id'],)).fetchone()
+                attempts = (attempts[0] if attempts else 0) + 1
+                delay = min(SEARCH_RETRY_BASE_SECONDS * 2 ** (attempts - 1), SEARCH_RETRY_MAX_SECONDS)
+                conn.execute(
+                    'UPDATE MISS_TVS SET search_attempts = ?, next_search = ? WHERE id = ?',
+                    (attempts, int(time.time()) + delay, tv_info['id'])
+                )
+                logger.info(f"{tv_info['剧集']} 第 {attempts} 次未搜索到资源，{delay // 3600} 小时后再次搜索")
+        except sqlite3.Error as e:
+            logger.error(f"数据库操作失败: {e}")
+
     def extract_tv_info(self) -> List[Dict[str, str]]:
-        """从数据库读取缺失的电视节目信息"""
+        """从数据库读取缺失的电视节目信息，跳过没有已播出的缺失集数或还未到下次搜索时间的节目"""
         all_tv_info = []
         try:
             with sqlite3.connect(self.db_path) as conn:  # 使用 sqlite3 连接数据库
                 cursor = conn.cursor()
-                cursor.execute('SELECT title, missing_episodes FROM MISS_TVS')
+                cursor.execute(
+                    "SELECT id, title, missing_episodes, title_key FROM MISS_TVS WHERE IFNULL(missing_episodes, '') <> '' AND next_search <= ?",
+                    (int(time.time()),)
+                )
                 tvs = cursor.fetchall()
+                waiting = cursor.execute('SELECT COUNT(*) FROM MISS_TVS').fetchone()[0] - len(tvs)
+                if waiting:
+                    logger.info(f"{waiting} 个电视节目暂无已播出的缺失集数或还未到下次搜索时间，本次跳过")
 
-                for title, missing_episodes_str in tvs:
+                for tv_id, title, missing_episodes_str, title_key in tvs:
                     missing_episodes = [int(ep.strip()) for ep in missing_episodes_str.split(',') if ep.strip()]
                     min_episode_num = min(missing_episodes) if missing_episodes else 1
                     formatted_episode_number = f'{"0" if min_episode_num < 10 else ""}{min_episode_num}'
                     
                     resolution = self.config.get("resources", "preferred_resolution", fallback="")
                     all_tv_info.append({
+                        "id": tv_id,
                         "剧集": title,
+                        "title_key": title_key or normalize_title(title),
                         "分辨率": resolution,
                         "集数": formatted_episode_number,
                         "missing_episodes": missing_episodes  # 添加缺失的集数列表
@@ -205,7 +237,7 @@ def parse_file_size(size_str: str) -> float:
         return size
     return None
 
-def parse_search_results(html_content, title, episode_number, exclude_keywords, preferred_resolution, fallback_resolution):
+def parse_search_results(html_content, title_key, episode_number, exclude_keywords, preferred_resolution, fallback_resolution):
     """解析搜索结果，并根据集数范围及分辨率情况进行匹配，返回所有符合条件的链接"""
     soup = BeautifulSoup(html_content, 'html.parser')
     results = []
@@ -219,7 +251,9 @@ def parse_search_results(html_content, title, episode_number, exclude_keywords,
         link = a_tag['href']
         result_title = a_tag.get_text(strip=True)
         
-        if title.lower() not in result_title.lower() or should_exclude(result_title, exclude_keywords):
+        # 订阅或结果标题为空时没有匹配键，不能当作匹配
+        result_key = normalize_title(result_title)
+        if not title_key or not result_key or title_key not in result_key or should_exclude(result_title, exclude_keywords):
             continue
         
         match = re.search(r"(?:第(\d{1,2}-\d{1,2}|\d{1,2},\d{1,2}|\d{1,2})集|全(\d{1,2})集)", result_title)
@@ -334,9 +368,10 @@ def download_file(session, download_link, filename, selected_title, download_dir
         return False
 
 def download_tv_series(tv_info, formhash):
-    """下载指定剧集，并尝试连续下载下一集"""
+    """下载指定剧集，并尝试连续下载下一集，返回下载到的集数"""
     title = tv_info['剧集']
     missing_episodes = set(tv_info['missing_episodes'])  # 使用集合来存储缺失的集数，方便后续操作
+    downloaded = 0
     current_episode = min(missing_episodes) if missing_episodes else 1
     formatted_episode_number = f'{"0" if current_episode < 10 else ""}{current_episode}'
     
@@ -349,7 +384,7 @@ def download_tv_series(tv_info, formhash):
 
         parsed_results = parse_search_results(
             search_result_html, 
-            title, 
+            tv_info['title_key'], 
             formatted_episode_number, 
             exclude_keywords, 
             preferred_resolution, 
@@ -380,6 +415,7 @@ def download_tv_series(tv_info, formhash):
                 for ep in range(start_episode, end_episode + 1):
                     if ep in missing_episodes:
                         missing_episodes.remove(ep)
+                        downloaded += 1
 
                 # 如果还有缺失的集数，尝试下载下一集
                 if missing_episodes:
@@ -397,6 +433,7 @@ def download_tv_series(tv_info, formhash):
 
     if not missing_episodes:
         logger.info(f"{title} 所有缺失集数已下载完成")
+    return downloaded
 
 def main():
     extractor = TVInfoExtractor(db_path, config)
@@ -413,7 +450,7 @@ def main():
         return
 
     for tv_info in tv_info_list:
-        download_tv_series(tv_info, formhash)
+        extractor.schedule_search(tv_info, download_tv_series(tv_info, formhash))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file